@@ -0,0 +1,198 @@
+"""
+Times the passes of the compiler on the synthetic programs from `benchmarks.generators`
+and compares the results with a stored baseline.
+
+The times depend on the machine, so the baseline isn't in the repository. It must be
+saved with --save on the same machine before the change, which is being measured.
+
+Every program is compiled at two sizes, so the growth of the time with the size of
+the program is measured as well. A growth exponent close to 1 means the pass is linear
+and one close to 2 means it is quadratic. The growth doesn't depend on the machine,
+so it catches quadratic regressions even without a baseline for the machine.
+
+Run it from the root of the repository:
+    python -m benchmarks.compiler [--size N] [--repeats N] [--only NAME] [--save] [--baseline PATH]
+
+The exit code is 1 if any of the passes has regressed.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+from typing import Any, Callable, Dict, List
+
+from state import State
+from config import Config
+from parsing.parsing import parse_to_ops
+from type_checking.type_checking import type_check
+from generating.fasm_x86_64_linux import generate_fasm_x86_64_linux
+from generating.wat64 import generate_wat64
+from generating.emitter import Emitter
+from benchmarks.generators import generate_all
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+GENERATORS: Dict[str, Callable[[List[Any], Emitter], None]] = {
+    "fasm_x86_64_linux" : generate_fasm_x86_64_linux,
+    "wat64" : generate_wat64,
+}
+
+# A pass has regressed if it is that much slower than the baseline
+TIME_TOLERANCE = 1.5
+# A pass has regressed if its time grows faster than the size of the program to this power
+MAX_GROWTH = 1.6
+# Passes faster than this are too noisy to be compared
+MIN_TIME = 0.005
+
+
+def compile_once(source: str, target: str) -> Dict[str, float]:
+    """
+    Compiles the `source` for the `target` without writing or assembling anything.
+    The garbage collector is disabled while compiling, so it doesn't add noise to the times.
+
+    Returns a dictionary with the times of each pass.
+    """
+    State.full_reset()
+    State.config = Config(["cont.py", "benchmark.cn", "-t", target], lsp_mode=True)
+    State.filename = "benchmark"
+    State.abs_path = os.path.abspath("benchmark.cn")
+    State.dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    gc.collect()
+    gc.disable()
+    try:
+        return time_passes(source, target)
+    finally:
+        gc.enable()
+
+
+def time_passes(source: str, target: str) -> Dict[str, float]:
+    """A helper function for `compile_once`, which runs and times the passes"""
+    times = {}
+    start = time.perf_counter()
+    ops = parse_to_ops(source, is_main=True)
+    times["parse_to_ops"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    type_check(ops, is_main=True)
+    State.compute_used_procs()
+    times["type_check"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as f:
+        emitter = Emitter(f)
+        GENERATORS[target](ops, emitter)
+        emitter.flush()
+    times[f"generate_{target}"] = time.perf_counter() - start
+    return times
+
+
+def measure(sources: List[str], repeats: int) -> List[Dict[str, float]]:
+    """
+    Returns the best times of each pass for each of the `sources` out of `repeats`
+    compilations for every target. The sources are compiled in turns, so a change
+    in the load of the machine affects all of them equally.
+    """
+    best: List[Dict[str, float]] = [{} for _ in sources]
+    for _ in range(repeats):
+        for target in GENERATORS:
+            for source, source_best in zip(sources, best):
+                for name, elapsed in compile_once(source, target).items():
+                    source_best[name] = min(source_best.get(name, elapsed), elapsed)
+    return best
+
+
+def run_benchmarks(size: int, repeats: int, only: List[str]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Runs all the benchmarks or only the ones with names in `only` if it isn't empty.
+
+    Returns a dictionary, which maps the names of the programs and the passes to
+    the time of the pass at the `size` and the growth exponent between `size` and `2 * size`.
+    """
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    with tempfile.TemporaryDirectory() as small_dir, tempfile.TemporaryDirectory() as large_dir:
+        small = generate_all(size, small_dir)
+        large = generate_all(size * 2, large_dir)
+        for (name, small_source), (_, large_source) in zip(small, large):
+            if only and name not in only:
+                continue
+            small_times, large_times = measure([small_source, large_source], repeats)
+            results[name] = {
+                stage : {
+                    "time" : small_times[stage],
+                    "growth" : math.log2(large_times[stage] / small_times[stage]),
+                } for stage in small_times
+            }
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, float]]], baseline: Dict[str, Any]) -> List[str]:
+    """
+    Prints the `results` next to the `baseline`.
+    Returns a list of descriptions of the regressions.
+    """
+    regressions = []
+    print(f"{'program':<16} {'pass':<28} {'time, ms':>10} {'baseline':>10} {'ratio':>7} {'growth':>7}")
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(name, {}).get(stage)
+            ratio = result["time"] / base["time"] if base is not None else None
+            print(
+                f"{name:<16} {stage:<28} {result['time'] * 1000:>10.2f} "
+                f"{base['time'] * 1000 if base is not None else math.nan:>10.2f} "
+                f"{ratio if ratio is not None else math.nan:>7.2f} {result['growth']:>7.2f}"
+            )
+            if result["time"] < MIN_TIME:
+                continue
+            if ratio is not None and ratio > TIME_TOLERANCE:
+                regressions.append(f"{name} {stage} is {ratio:.2f} times slower than the baseline")
+            if result["growth"] > MAX_GROWTH:
+                regressions.append(
+                    f"{name} {stage} grows as size^{result['growth']:.2f} with the size of the program"
+                )
+    return regressions
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Compiler benchmarks")
+    args_parser.add_argument("--size", type=int, default=1000, help="Size of the generated programs")
+    args_parser.add_argument("--repeats", type=int, default=5, help="Number of times each program is compiled")
+    args_parser.add_argument("--only", action="append", default=[], help="Run only the benchmark with the name")
+    args_parser.add_argument("--baseline", default=BASELINE_PATH, help="Path to the baseline")
+    args_parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    args = args_parser.parse_args()
+
+    # The type checker and the generators recurse on deep programs
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    results = run_benchmarks(args.size, args.repeats, args.only)
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("size") != args.size:
+            print(f"The baseline was measured for size {baseline.get('size')}, ignoring it")
+            baseline = {}
+    elif not args.save:
+        print(f"No baseline at {args.baseline}, only the growth is checked, save one with --save")
+    regressions = compare(results, baseline.get("results", {}))
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({"size" : args.size, "results" : results}, f, indent=4)
+            f.write("\n")
+        print(f"Saved the baseline to {args.baseline}")
+    elif regressions:
+        print()
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Generators of synthetic programs, which stress different parts of the compiler.
+Every generated program is self contained, type checks and can be compiled for all the targets.
+"""
+import os
+
+from typing import List, Tuple
+
+
+def generate_procs(procs_count: int, all_tokens: bool = False) -> str:
+    """
+    Generates a program with `procs_count` procedures, which use global variables
+    and structures, bindings, local variables, conditions and loops.
+
+    If `all_tokens` is True, the procedures also use comments, memories, hex numbers,
+    strings and fields of types, so the program has most of the kinds of tokens
+    for measuring the parser. Such program doesn't type check.
+    """
+    lines = []
+    for i in range(procs_count // 100 + 1):
+        lines.append(f"struct Point{i}\n  int x\n  int y\nend")
+        lines.append(f"const LIMIT{i} {i + 10} end")
+        lines.append(f"var counter{i} int")
+        lines.append(f"var point{i} Point{i}")
+        if all_tokens:
+            lines.append(f"memory buffer{i} 16")
+    for i in range(procs_count):
+        group = i // 100
+        comment = f"  // Procedure number {i}\n" if all_tokens else ""
+        tokens = (
+            f"    sum 0x10 - drop\n"
+            f"    a b Point{group} .x buffer{group} ! \"step{i}\" drop drop\n"
+        ) if all_tokens else ""
+        lines.append(
+            f"proc step{i} int int -> int:\n"
+            f"{comment}"
+            f"  var sum int\n"
+            f"  bind a b:\n"
+            f"    a b + !sum\n"
+            f"    sum LIMIT{group} < if\n"
+            f"      sum 2 * counter{group} + !counter{group}\n"
+            f"    else\n"
+            f"      sum point{group}.x + !point{group}.y\n"
+            f"    end\n"
+            f"    while sum 0 > do\n"
+            f"      sum 1 - !sum\n"
+            f"    end\n"
+            f"{tokens}"
+            f"    counter{group}\n"
+            f"  end\n"
+            f"end"
+        )
+        lines.append(f"1 2 step{i} drop")
+    return "\n".join(lines) + "\n"
+
+
+def generate_include_chain(depth: int, directory: str) -> str:
+    """
+    Writes `depth` files to the `directory`, where every file includes
+    the next one and defines a few procedures using the definitions from it.
+
+    Returns the source code of the main file, which includes the first file of the chain.
+    """
+    for i in range(depth):
+        lines = []
+        if i + 1 < depth:
+            lines.append(f"include {os.path.join(directory, f'chain{i + 1}.cn')}")
+        lines.append(f"const CHAIN{i} {i} end")
+        lines.append(f"struct Link{i}\n  int value\n  *int next\nend")
+        previous = f"CHAIN{i + 1} + link{i + 1}" if i + 1 < depth else ""
+        lines.append(
+            f"proc link{i} int -> int:\n"
+            f"  CHAIN{i} + {previous}\n"
+            f"end"
+        )
+        with open(os.path.join(directory, f"chain{i}.cn"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    return f"include {os.path.join(directory, 'chain0.cn')}\n0 link0 drop\n"
+
+
+def generate_large_structs(structs_count: int, fields_count: int) -> str:
+    """
+    Generates `structs_count` structures with `fields_count` fields and
+    a few methods each. The structures are split into short inheritance chains.
+    """
+    lines = []
+    for i in range(structs_count):
+        parent = f"(Large{i - 1}) " if i % 4 else ""
+        fields = "\n".join(f"  int field{i}_{j}" for j in range(fields_count))
+        lines.append(
+            f"struct {parent}Large{i}\n"
+            f"{fields}\n"
+            f"  nproc sum{i} -> int:\n"
+            f"    {' '.join(f'self.field{i}_{j}' for j in range(fields_count))}"
+            f" {' '.join('+' for _ in range(fields_count - 1))}\n"
+            f"  end\n"
+            f"  nproc set{i} int value:\n"
+            + "".join(f"    value !self.field{i}_{j}\n" for j in range(fields_count)) +
+            f"  end\n"
+            f"end"
+        )
+        lines.append(
+            f"var large{i} Large{i}\n"
+            f"{i} large{i} .set{i}\n"
+            f"large{i} .sum{i} drop"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def generate_string_table(strings_count: int) -> str:
+    """
+    Generates a program with `strings_count` different string literals
+    of different lengths, which all end up in the data section.
+    """
+    lines = []
+    for i in range(strings_count):
+        text = f"entry {i}: " + "abcdefghij" * (i % 8) + "\\n"
+        lines.append(f"\"{text}\" drop drop")
+    return "\n".join(lines) + "\n"
+
+
+def generate_generics(procs_count: int, calls: bool = True) -> str:
+    """
+    Generates `procs_count` groups of three generic procedures similar to `2dup` from std/stack.cn.
+    If `calls` is True, each of them is called with a few different combinations of types.
+    """
+    lines = ["struct Pair\n  int first\n  int second\nend", "var pair Pair"]
+    for i in range(procs_count):
+        lines.append(
+            f"nproc twice{i} t1 a t2 b -> t2 t1 t2 t1:\n"
+            f"  b a b a\n"
+            f"end\n"
+            f"proc first{i} *t1 t2 -> t2 *t1:\n"
+            f"  swap\n"
+            f"end\n"
+            f"nproc thrice{i} t1 a t2 b t3 c -> t1 t2 t3 t1 t2 t3:\n"
+            f"  a b c a b c\n"
+            f"end"
+        )
+        if not calls:
+            continue
+        lines.append(
+            f"1 2 twice{i} drop drop drop drop\n"
+            f"pair 2 twice{i} drop drop drop drop\n"
+            f"pair pair twice{i} drop drop drop drop\n"
+            f"pair 3 first{i} drop drop"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def generate_for_loops(loops_count: int) -> str:
+    """
+    Generates a program with `loops_count` for loops of both kinds in
+    one list of operations, all of them are desugared while type checking.
+    """
+    lines = ["var values [8] int", "var text [8] int", "var total int"]
+    for i in range(loops_count):
+        kind, iterator = ("in", "values") if i % 2 else ("until", "text")
+        lines.append(
+            f"for item {kind} {iterator}\n"
+            f"  total item + {i} + !total\n"
+            f"end"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def generate_all(size: int, directory: str) -> List[Tuple[str, str]]:
+    """
+    Generates all the benchmark programs scaled by the `size`.
+    The files of the include chain are written to the `directory`.
+
+    Returns a list of pairs of the name of the program and its source code.
+    """
+    return [
+        ("procs", generate_procs(size)),
+        ("include_chain", generate_include_chain(size // 10, directory)),
+        ("large_structs", generate_large_structs(size // 20, 20)),
+        ("string_table", generate_string_table(size * 2)),
+        ("generics", generate_generics(size // 2)),
+        ("for_loops", generate_for_loops(size * 2)),
+    ]
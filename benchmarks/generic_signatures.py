@@ -0,0 +1,50 @@
+"""
+Measures the cost of parsing signatures of generic procedures,
+which resolve a lot of type variables e. g. `2dup` from std/stack.cn.
+
+Run it from the root of the repository:
+    python -m benchmarks.generic_signatures [procs count] [repeats]
+"""
+import sys
+import time
+
+from state import State
+from type_checking.types import parse_type, VarType
+from benchmarks.parse_throughput import run
+from benchmarks.generators import generate_generics
+
+
+def time_type_variables(count: int) -> float:
+    """
+    Times resolving `count` type variables with `parse_type`
+    inside a signature, which has a few of them in scope.
+    """
+    scope = {name : VarType(name) for name in ("t1", "t2", "t3")}
+    State.var_type_scopes.append(scope)
+    start = time.perf_counter()
+    for _ in range(count // 3):
+        parse_type(("t1", 0), "benchmark", var_type_scope=scope)
+        parse_type(("t2", 0), "benchmark", var_type_scope=scope)
+        parse_type(("t3", 0), "benchmark", var_type_scope=scope)
+    elapsed = time.perf_counter() - start
+    State.var_type_scopes.pop()
+    return elapsed
+
+
+def main():
+    procs_count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    source = generate_generics(procs_count, calls=False)
+    best = min(run(source)[0] for _ in range(repeats))
+    print(f"{procs_count * 3} generic procedures")
+    print(f"parse_to_ops: {best:.3f}s (best of {repeats})")
+    print(f"  {best / (procs_count * 3) * 1e6:.1f}us per procedure")
+
+    lookups = 300000
+    best = min(time_type_variables(lookups) for _ in range(repeats))
+    print(f"parse_type on type variables: {best / lookups * 1e9:.0f}ns per lookup (best of {repeats})")
+
+
+if __name__ == "__main__":
+    main()
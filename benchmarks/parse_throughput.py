@@ -0,0 +1,49 @@
+"""
+Measures the throughput of the parser on a synthetic program.
+
+Run it from the root of the repository:
+    python -m benchmarks.parse_throughput [procs count] [repeats]
+"""
+import os
+import sys
+import time
+
+from typing import Tuple
+
+from state import State
+from config import Config
+from parsing.parsing import parse_to_ops, tokens
+from benchmarks.generators import generate_procs
+
+
+def run(source: str) -> Tuple[float, int]:
+    """Parses the `source` and returns a tuple of the time spent in `parse_to_ops` and the number of operations"""
+    State.full_reset()
+    State.config = Config(["cont.py", "benchmark.cn"], lsp_mode=True)
+    State.filename = "benchmark"
+    State.abs_path = os.path.abspath("benchmark.cn")
+    State.dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    start = time.perf_counter()
+    ops = parse_to_ops(source, is_main=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(ops)
+
+
+def main():
+    procs_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    source = generate_procs(procs_count, all_tokens=True)
+    State.full_reset()
+    tokens_count = sum(1 for _ in tokens(source))
+    print(f"{procs_count} procedures, {len(source.splitlines())} lines, {tokens_count} tokens")
+
+    best, ops_count = min(run(source) for _ in range(repeats))
+    print(f"parse_to_ops: {best:.3f}s (best of {repeats})")
+    print(f"  {tokens_count / best:,.0f} tokens/s")
+    print(f"  {ops_count / best:,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Measures the execution time and the peak memory of the programs generated by the compiler
+for all the targets. The workloads are in benchmarks/programs in the same format as the tests:
+the source code and the expected output separated by a line with a single colon.
+
+The fasm_x86_64_linux executables are run directly and the wat64 modules are run with node
+using test.js. The results are compared with a stored baseline.
+
+The times and the memory depend on the machine, so the baseline isn't in the repository.
+It must be saved with --save on the same machine before the change, which is being measured.
+
+Linux keeps the maximum resident set size of a process across exec, so it is never
+less than the resident set size of the python process, which has started it.
+The values close to it mean the program itself has used less memory than that.
+
+Run it from the root of the repository:
+    python -m benchmarks.runtime [--repeats N] [--only NAME] [--target TARGET] [--save] [--baseline PATH]
+
+The exit code is 1 if any of the programs has given a wrong output or has regressed.
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROGRAMS_DIR = os.path.join(ROOT, "benchmarks", "programs")
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "runtime_baseline.json")
+
+TARGETS = ["fasm_x86_64_linux", "wat64"]
+
+# A program has regressed if it is that much slower or uses that much more memory than in the baseline
+TIME_TOLERANCE = 1.5
+RSS_TOLERANCE = 1.5
+
+
+def load_program(name: str) -> Tuple[str, str]:
+    """Returns the source code and the expected output of the workload with the `name`"""
+    with open(os.path.join(PROGRAMS_DIR, name), "r") as f:
+        source, expected = f.read().split("\n:\n")
+    return source, expected
+
+
+def compile_program(source: str, name: str, target: str, directory: str) -> List[str]:
+    """
+    Compiles the `source` for the `target` in the `directory`.
+    Returns the command, which runs the compiled program.
+    """
+    path = os.path.join(directory, name)
+    with open(f"{path}.cn", "w") as f:
+        f.write(source)
+    result = subprocess.run(
+        ["python", os.path.join(ROOT, "cont.py"), f"{path}.cn", "-t", target, "-o", path],
+        cwd=directory, capture_output=True, text=True,
+    )
+    if result.returncode != 0 or result.stderr:
+        raise RuntimeError(f"Compilation of {name} for {target} has failed:\n{result.stdout}{result.stderr}")
+
+    if target == "wat64":
+        return ["node", os.path.join(ROOT, "test.js"), f"{path}.wasm"]
+    return [path]
+
+
+def run_program(command: List[str], directory: str) -> Tuple[str, float, int]:
+    """
+    Runs the `command` and waits for it to finish.
+    Returns a tuple of the output, the wall time and the maximum resident set size in bytes.
+    """
+    out_path = os.path.join(directory, "stdout")
+    with open(out_path, "w") as out:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=out, stderr=subprocess.STDOUT, cwd=ROOT)
+        # wait4 is used instead of Popen.wait to get the resource usage of the process
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    with open(out_path, "r") as f:
+        output = f.read()
+    # ru_maxrss is in kilobytes on linux
+    return output, elapsed, usage.ru_maxrss * 1024
+
+
+def run_benchmarks(
+    names: List[str], targets: List[str], repeats: int
+) -> Tuple[Dict[str, Dict[str, Dict[str, float]]], List[str]]:
+    """
+    Compiles and runs each of the workloads with the `names` for each of the `targets` `repeats` times.
+
+    Returns a tuple of a dictionary, which maps the names of the workloads and the targets
+    to the best time and the maximum resident set size, and a list of the wrong outputs.
+    """
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names:
+            source, expected = load_program(name)
+            results[name] = {}
+            for target in targets:
+                command = compile_program(source, name, target, directory)
+                best: Optional[Dict[str, float]] = None
+                for _ in range(repeats):
+                    output, elapsed, rss = run_program(command, directory)
+                    if output != expected:
+                        failures.append(f"{name} on {target} has given a wrong output:\n{output}")
+                        break
+                    if best is None or elapsed < best["time"]:
+                        best = {"time" : elapsed, "max_rss" : rss}
+                if best is not None:
+                    results[name][target] = best
+    return results, failures
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, float]]], baseline: Dict[str, Any]) -> List[str]:
+    """
+    Prints the `results` next to the `baseline`.
+    Returns a list of descriptions of the regressions.
+    """
+    regressions = []
+    print(f"{'program':<16} {'target':<20} {'time, ms':>10} {'baseline':>10} {'rss, KiB':>10} {'baseline':>10}")
+    for name, targets in results.items():
+        for target, result in targets.items():
+            base = baseline.get(name, {}).get(target)
+            base_time = f"{base['time'] * 1000:.2f}" if base is not None else "-"
+            base_rss = f"{base['max_rss'] // 1024}" if base is not None else "-"
+            print(
+                f"{name:<16} {target:<20} {result['time'] * 1000:>10.2f} {base_time:>10} "
+                f"{result['max_rss'] // 1024:>10} {base_rss:>10}"
+            )
+            if base is None:
+                continue
+            if result["time"] > base["time"] * TIME_TOLERANCE:
+                regressions.append(
+                    f"{name} on {target} is {result['time'] / base['time']:.2f} times slower than the baseline"
+                )
+            if result["max_rss"] > base["max_rss"] * RSS_TOLERANCE:
+                regressions.append(
+                    f"{name} on {target} uses {result['max_rss'] / base['max_rss']:.2f} "
+                    "times more memory than the baseline"
+                )
+    return regressions
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Benchmarks of the generated code")
+    args_parser.add_argument("--repeats", type=int, default=5, help="Number of times each program is run")
+    args_parser.add_argument("--only", action="append", default=[], help="Run only the workload with the name")
+    args_parser.add_argument("--target", action="append", default=[], help="Run only for the target")
+    args_parser.add_argument("--baseline", default=BASELINE_PATH, help="Path to the baseline")
+    args_parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    args = args_parser.parse_args()
+
+    names = args.only if args.only else sorted(os.listdir(PROGRAMS_DIR))
+    results, failures = run_benchmarks(names, args.target if args.target else TARGETS, args.repeats)
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    elif not args.save:
+        print(f"No baseline at {args.baseline}, only the outputs are checked, save one with --save")
+    regressions = compare(results, baseline)
+
+    if args.save and not failures:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+            f.write("\n")
+        print(f"Saved the baseline to {args.baseline}")
+    elif failures or (regressions and not args.save):
+        print()
+        for failure in failures:
+            print(f"Failure: {failure}")
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
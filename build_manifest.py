@@ -0,0 +1,139 @@
+import json
+import os
+
+from typing import Any, Dict, List, Optional
+
+from state import State
+from parsing.include_cache import compiler_digest, config_options, file_digest
+
+# Must be changed every time the format of the manifest changes
+MANIFEST_VERSION = 1
+
+MANIFEST_DIRS = ("parsing", "compile_eval", "type_checking", "optimizing", "generating")
+MANIFEST_FILES = ("state.py", "config.py", "cont.py")
+
+# The files created for each target, the first one is the generated source code
+OUTPUT_FILES: Dict[str, List[str]] = {
+    "fasm_x86_64_linux" : ["{out}.asm", "{out}"],
+    "wat64" : ["{out}.wat", "{out}.wasm"],
+}
+
+
+class BuildManifest:
+    """
+    The description of a build, which is stored next to the output files
+    and is used for skipping the parts of the next build, which would do the same thing.
+
+    The manifest stores everything the output depends on: the digest of the compiler,
+    the configuration, the hashes of all the input files with the include graph and
+    the hashes of the output files.
+    """
+    def __init__(self, out: str):
+        self.out = out
+        self.path = f"{out}.manifest.json"
+        self.previous: Optional[Dict[str, Any]] = None
+        try:
+            with open(self.path, "r") as f:
+                self.previous = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def header(self) -> Dict[str, Any]:
+        """Returns the part of the manifest, which doesn't depend on the source code"""
+        header = {
+            "version" : MANIFEST_VERSION,
+            # Different programs can be built into the same output files
+            "program" : State.abs_path,
+            "compiler" : compiler_digest(MANIFEST_DIRS, MANIFEST_FILES),
+            "config" : config_options(),
+            "cwd" : os.getcwd(),
+            "dir" : os.path.abspath(State.dir),
+        }
+        # The same conversions as for the loaded manifest, e. g. tuples become lists
+        return json.loads(json.dumps(header))
+
+    def output_files(self) -> List[str]:
+        """Returns the paths of the files created for the current target"""
+        return [path.format(out=self.out) for path in OUTPUT_FILES[State.config.target]]
+
+    def is_up_to_date(self) -> bool:
+        """Returns whether the previous build has produced the same output as the current one would"""
+        if self.previous is None or self.previous.get("header") != self.header():
+            return False
+
+        std_dir = os.path.abspath(os.path.join(State.dir, "std"))
+        for path, digest in self.previous["inputs"].items():
+            if not os.path.exists(path) or file_digest(path) != digest:
+                return False
+            # Includes are searched in the working directory first, so a new file can shadow the standard library
+            name = os.path.relpath(path, std_dir)
+            if path.startswith(std_dir + os.sep) and os.path.exists(name) and os.path.abspath(name) != path:
+                return False
+        return self.are_outputs_unchanged()
+
+    def are_outputs_unchanged(self, except_source: bool = False) -> bool:
+        """
+        Returns whether all the output files are the same as after the previous build.
+        Doesn't check the generated source code if `except_source` is True.
+        """
+        if self.previous is None:
+            return False
+        outputs = self.output_files()[1:] if except_source else self.output_files()
+        for path in outputs:
+            if not os.path.exists(path) or file_digest(path) != self.previous["outputs"].get(path):
+                return False
+        return True
+
+    def needs_assembling(self) -> bool:
+        """
+        Returns whether the generated source code must be assembled.
+        It doesn't need to be if it is the same as in the previous build and the assembled file hasn't changed.
+        """
+        source = self.output_files()[0]
+        return not (
+            self.are_outputs_unchanged(except_source=True) and
+            file_digest(source) == self.previous["outputs"].get(source)
+        )
+
+    def save(self):
+        """Stores the manifest for the build, which has just finished"""
+        inputs = [State.abs_path, *State.included_files]
+        includes: Dict[str, List[str]] = {path : [] for path in inputs}
+        for parent, child in State.include_edges:
+            includes[parent].append(child)
+
+        manifest = {
+            "header" : self.header(),
+            "inputs" : {path : file_digest(path) for path in inputs},
+            "includes" : includes,
+            "outputs" : {path : file_digest(path) for path in self.output_files() if os.path.exists(path)},
+        }
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(temp_path, self.path)
+
+
+manifest: Optional[BuildManifest] = None
+
+
+def start(out: str):
+    """Enables the incremental build for the output files with the base path `out`"""
+    global manifest
+    manifest = BuildManifest(out)
+
+
+def is_up_to_date() -> bool:
+    """Returns whether the incremental build is enabled and the previous build can be reused as is"""
+    return manifest is not None and manifest.is_up_to_date()
+
+
+def needs_assembling() -> bool:
+    """Returns whether the generated source code must be assembled, which is always true for a full build"""
+    return manifest is None or manifest.needs_assembling()
+
+
+def save():
+    """Stores the manifest for the finished build if the incremental build is enabled"""
+    if manifest is not None:
+        manifest.save()
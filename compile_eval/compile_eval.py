@@ -72,7 +72,7 @@ def evaluate_token(token: str, stack: list):
         )
 
 
-def evaluate_block(orig_loc: str, error: str):
+def evaluate_block(orig_loc: int, error: str):
     """
     Evaluates a compile-time eval block. 
     The global token iterator should be placed at the beginning of the block.
@@ -87,7 +87,7 @@ def evaluate_block(orig_loc: str, error: str):
         except StopIteration:
             break
 
-        State.loc = f"{State.filename}:{token[1]}"
+        State.loc = token[1]
         if token[0] in ("end", ";") or token[0].endswith(";"):
             if token[0].endswith(";") and token[0] != ";":
                 evaluate_token(token[0][:-1], stack)
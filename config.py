@@ -3,6 +3,7 @@ import json
 import os
 
 from generating.generating import TARGETS
+from timing import TIME_PASSES_FORMATS
 
 from typing import Any, Dict, List, Tuple, Optional 
 
@@ -24,12 +25,16 @@ class Config:
         "dump_proc" : "Dump operations of a specific procedure",
         "dump_tokens" : "Dump tokens without parsing or compilating",
         "dump_tc" : "Dump operations after type checking",
+        "incremental" : "Skip the parts of the build, which haven't changed since the previous one",
         "out" : "The name for output file(s)",
         "target" : "A taget to compile to",
         "config" : "Config file",
         "stdout" : "File to output stdout of complier and program",
         "input" : "Stdin for program",
         "error" : "Stderr for program",
+        "cache_dir" : "Directory for caching parsed included files and type checked procedures",
+        "time_passes" : "Report time and memory used by each compiler pass",
+        "time_passes_format" : "The format of the report of the compiler passes, text or json",
     }
 
     BOOL_OPTIONS: Dict[str, Tuple[List[str], bool]] = {
@@ -37,6 +42,8 @@ class Config:
         "dump" : (["-d", "-dump"], False),
         "dump_tokens" : (["-dt", "-dump_tokens"], False),
         "dump_tc" : (["-dtc", "-dump_tc"], False),
+        "incremental" : (["-inc", "--incremental"], False),
+        "time_passes" : (["-tp", "--time-passes"], False),
     }
 
     REGULAR_OPTIONS: Dict[str, List[str]] = {
@@ -46,13 +53,20 @@ class Config:
         "stdout" : (["-stdo", "--stdout"], None),
         "input" : (["-i", "--input"], None),
         "error" : (["-e", "--error"], None),
+        "cache_dir" : (["-cd", "--cache_dir"], None),
+        "time_passes_format" : (["-tpf", "--time-passes-format"], "text"),
     }
-    CONFIG_REGULAR_OPTIONS: List[str] = ["out", "target"]
+    CONFIG_REGULAR_OPTIONS: List[str] = ["out", "target", "cache_dir", "time_passes_format"]
+    # The flags, which can also be enabled in the config
+    CONFIG_FLAG_OPTIONS: List[str] = ["time_passes"]
 
     CONFIG_BOOL_OPTIONS: Dict[str, bool] = {
         "re_IOR" : True,
         "re_NPD" : True,
         "o_UPR" : True,
+        "o_LTC" : False,
+        "o_PTC" : True,
+        "o_PCG" : True,
     }
 
     CONFIG_BOOL_CLEAR_OPTIONS: Dict[str, bool] = {
@@ -62,6 +76,13 @@ class Config:
     CONFIG_INT_OPTIONS: Dict[str, int] = {
         "size_call_stack" : 65536,
         "size_bind_stack" : 8192,
+        # 0 disables the optimizations, 1 folds the constants, 2 also caches the top of the stack in registers
+        "optimization_level" : 2,
+        # 0 jobs is the number of processors
+        "ptc_jobs" : 0,
+        "ptc_min_procs" : 256,
+        "pcg_jobs" : 0,
+        "pcg_min_procs" : 256,
     }
 
     CHECK_POSITIVE: List[str] = ["size_call_stack", "size_bind_stack"]
@@ -74,6 +95,7 @@ class Config:
         if config_file:
             self._validate(config_file)
         self._validate_target()
+        self._validate_time_passes()
 
     def setup_args_parser(self) -> argparse.ArgumentParser:
         """Creates, configures and returns an `ArgumentParser`"""
@@ -110,11 +132,17 @@ class Config:
             print(f"\033[1;31mError\033[0m: target not found: {self.target}")
             exit(1)
 
+    def _validate_time_passes(self):
+        """Checks if the format of the passes report is a valid one"""
+        if self.time_passes_format not in TIME_PASSES_FORMATS:
+            print(f"\033[1;31mError\033[0m: unknown format for time_passes_format: {self.time_passes_format}")
+            exit(1)
+
     @property
     def _valid_keys(self) -> Tuple[str, ...]:
         """Returns a tuple of all the valid option ids"""
         return (
-            *self.CONFIG_REGULAR_OPTIONS, *self.CONFIG_BOOL_OPTIONS,
+            *self.CONFIG_REGULAR_OPTIONS, *self.CONFIG_FLAG_OPTIONS, *self.CONFIG_BOOL_OPTIONS,
             *self.CONFIG_INT_OPTIONS, *self.CONFIG_BOOL_CLEAR_OPTIONS,
         )
 
@@ -138,7 +166,7 @@ class Config:
         for name in self.BOOL_OPTIONS:
             setattr(
                 self.__class__, name,
-                property(fget=lambda self, name=name: getattr(self.args, name)),
+                property(fget=lambda self, name=name: getattr(self.args, name) or self.config.get(name, False)),
             )
 
         for name in self.REGULAR_OPTIONS:
@@ -5,8 +5,11 @@ from state import State, cont_assert
 from config import Config
 from parsing.op import OpType
 from parsing.parsing import parse_to_ops
-from generating.generating import compile_ops
+from generating.generating import compile_ops, RUNNERS
 from type_checking.type_checking import type_check
+from optimizing.optimizing import optimize
+import build_manifest
+import timing
 
 
 def main(lsp_mode: bool = False):
@@ -16,12 +19,11 @@ def main(lsp_mode: bool = False):
     """
     config = Config(sys.argv, lsp_mode=lsp_mode)
     State.config = config
+    if config.time_passes:
+        timing.start()
 
     file_name = os.path.splitext(config.program)[0]
 
-    with open(config.program, "r") as f:
-        program = f.read()
-
     sys.stdout = open(config.stdout, "w") if config.stdout else sys.stdout
     sys.stderr = open(config.error, "w") if config.error else sys.stderr
     sys.stdin = open(config.input, "r") if config.input else sys.stdin
@@ -30,7 +32,18 @@ def main(lsp_mode: bool = False):
     State.abs_path = os.path.abspath(config.program)
     State.dir = os.path.dirname(__file__)
 
-    ops = parse_to_ops(program, config.dump_tokens, is_main=True)
+    is_dumping = config.dump or config.dump_tc or config.dump_tokens or config.dump_proc is not None
+    if config.incremental and not is_dumping and not lsp_mode and (not config.run or config.target in RUNNERS):
+        out = file_name if config.out is None else config.out
+        build_manifest.start(out)
+        if build_manifest.is_up_to_date():
+            if config.run:
+                RUNNERS[config.target](out)
+            timing.stop(config.time_passes_format)
+            return
+
+    with open(config.program, "r") as f, timing.timed_pass("parse", State.abs_path):
+        ops = parse_to_ops(f, config.dump_tokens, is_main=True)
 
     assert not State.compile_ifs_opened, "unclosed #if" 
     cont_assert(not State.false_compile_ifs, "Something went terribly wrong with #if")
@@ -61,7 +74,7 @@ def main(lsp_mode: bool = False):
                 is_printing = True
             if is_printing:
                 print(
-                    f"{op.loc} {op.type.name} {op.operand if op.type.name != 'OPERATOR' else op.operand.name}"
+                    f"{State.format_loc(op.loc)} {op.type.name} {op.operand if op.type.name != 'OPERATOR' else op.operand.name}"
                 )
             if is_printing and op.type == OpType.ENDPROC:
                 break
@@ -71,25 +84,34 @@ def main(lsp_mode: bool = False):
         for op in ops:
             if op.compiled:
                 print(
-                    f"{op.loc} {op.type.name} {op.operand if op.type.name != 'OPERATOR' else op.operand.name}"
+                    f"{State.format_loc(op.loc)} {op.type.name} {op.operand if op.type.name != 'OPERATOR' else op.operand.name}"
                 )
+        timing.stop(config.time_passes_format)
         return
 
-    type_check(ops, is_main=True)
+    with timing.timed_pass("type_check"):
+        type_check(ops, is_main=True)
 
     if config.dump_tc:
         for op in ops:
             if op.compiled:
                 print(
-                    f"{op.loc} {op.type.name} {op.operand if op.type.name != 'OPERATOR' else op.operand.name}"
+                    f"{State.format_loc(op.loc)} {op.type.name} {op.operand if op.type.name != 'OPERATOR' else op.operand.name}"
                 )
+        timing.stop(config.time_passes_format)
         return
     
     if lsp_mode: return
 
-    State.compute_used_procs()
+    with timing.timed_pass("compute_used_procs"):
+        State.compute_used_procs()
+
+    with timing.timed_pass("optimize"):
+        ops = optimize(ops)
 
     compile_ops(ops)
+    build_manifest.save()
+    timing.stop(config.time_passes_format)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+from typing import List, Optional, TextIO
+
+# The number of characters collected before they are written to the file
+CHUNK_SIZE = 1 << 16
+
+# The decimal representations of the bytes for the db directives
+DECIMAL_BYTES = [str(byte) for byte in range(256)]
+
+
+class Emitter:
+    """
+    The output of a code generator. The code is written in parts, which are collected
+    in a list and written to the `file` in chunks, so the output is never built by
+    concatenating strings and the memory used doesn't grow with its size.
+    If there is no file, the parts are kept until `getvalue` is called.
+    """
+    def __init__(self, file: Optional[TextIO] = None):
+        self.file = file
+        self.parts: List[str] = []
+        self.size = 0
+
+    def write(self, code: str):
+        self.parts.append(code)
+        self.size += len(code)
+        if self.size >= CHUNK_SIZE and self.file is not None:
+            self.flush()
+
+    def flush(self):
+        """Writes the collected parts to the file"""
+        if self.file is not None:
+            self.file.write("".join(self.parts))
+            self.parts.clear()
+            self.size = 0
+
+    def getvalue(self) -> str:
+        """Returns all the code written to an emitter without a file"""
+        return "".join(self.parts)
+
+
+def decimal_bytes(data: bytes) -> str:
+    """Returns the `data` as a comma separated list of decimal numbers, e. g. b"hi" -> "104, 105" """
+    return ", ".join(map(DECIMAL_BYTES.__getitem__, data))
@@ -2,17 +2,37 @@ import subprocess
 import os
 import stat
 
-from typing import List, Set
+from typing import List, Optional, Set, Tuple
 
 from parsing.op import *
 from type_checking.types import Array, sizeof
 from state import *
+import build_manifest
+import timing
 from type_checking.types import *
+from .emitter import Emitter, decimal_bytes
+from .parallel import ParallelCodeGenerator, is_generated
 
 assert len(Operator) == 20, "Unimplemented operator in fasm_x86_64_linux.py"
 assert len(OpType) == 40, "Unimplemented type in fasm_x86_64_linux.py"
 
 SYSCALL_ARGS = ["rax", "rdi", "rsi", "rdx", "r10", "r8", "r9"]
+# The condition codes of the comparisons and of their negations
+CONDITION_CODES = {
+    Operator.LT : ("l", "ge"),
+    Operator.GT : ("g", "le"),
+    Operator.EQ : ("e", "ne"),
+    Operator.LE : ("le", "g"),
+    Operator.GE : ("ge", "l"),
+    Operator.NE : ("ne", "e"),
+}
+# The operations, which can use the flags of the pending comparison.
+# UNBIND doesn't change the values on the stack, so the comparison can be generated after it.
+FUSED_OP_TYPES = (OpType.IF, OpType.WHILE, OpType.ENDWHILE, OpType.UNBIND)
+# The registers, which hold the values from the top of the stack on the optimization level 2
+CACHE_REGISTERS = ["r8", "r9", "r10", "r11", "r13", "r14"]
+# The operations, which take the cached values themselves, before jumping
+BRANCH_OP_TYPES = (OpType.IF, OpType.WHILE, OpType.ENDWHILE)
 
 
 def compile_ops_fasm_x86_64_linux(ops: List[Op]):
@@ -32,18 +52,31 @@ def compile_ops_fasm_x86_64_linux(ops: List[Op]):
 
     out = State.filename if State.config.out is None else State.config.out
 
-    with open(f"{out}.asm", "w") as f:
-        f.write(generate_fasm_x86_64_linux(ops))
-
-    subprocess.run(["fasm", f"{out}.asm"], stdin=sys.stdin, stderr=sys.stderr)
-    os.chmod(
-        out, os.stat(out).st_mode | stat.S_IEXEC
-    )  # Give execution permission to the file
+    with timing.timed_pass("generate"), open(f"{out}.asm", "w") as f:
+        emitter = Emitter(f)
+        generate_fasm_x86_64_linux(ops, emitter)
+        emitter.flush()
+
+    # The executable from the previous build is reused if the assembly is the same
+    if build_manifest.needs_assembling():
+        with timing.timed_pass("assemble"):
+            result = subprocess.run(["fasm", f"{out}.asm"], stdin=sys.stdin, stderr=sys.stderr)
+        # The manifest isn't saved, so the executable from the previous build is never reused
+        if result.returncode != 0:
+            exit(result.returncode)
+        os.chmod(
+            out, os.stat(out).st_mode | stat.S_IEXEC
+        )  # Give execution permission to the file
 
     if State.config.run:
-        subprocess.run(
-            [f"./{out}"], stdout=sys.stdout, stdin=sys.stdin, stderr=sys.stderr
-        )
+        run_fasm_x86_64_linux(out)
+
+
+def run_fasm_x86_64_linux(out: str):
+    """Runs the executable `out` assembled for the fasm_x86_64_linux target"""
+    subprocess.run(
+        [f"./{out}"], stdout=sys.stdout, stdin=sys.stdin, stderr=sys.stderr
+    )
 
 INDEX_ERROR_CODE = (
     "check_array_bounds:\n"
@@ -110,9 +143,9 @@ NULL_POINTER_CODE = (
     "ret\n"
 )
 
-def generate_fasm_x86_64_linux(ops: List[Op]) -> str:
-    """Generates a string of fasm assembly for the program from the list of operations `ops`."""
-    buf = (
+def generate_fasm_x86_64_linux(ops: List[Op], out: Emitter):
+    """Generates fasm assembly for the program from the list of operations `ops` into the emitter `out`."""
+    out.write(
         "format ELF64 executable 3\n"
         "segment readable executable\n"
         "entry _start\n"
@@ -121,17 +154,29 @@ def generate_fasm_x86_64_linux(ops: List[Op]) -> str:
         "_start:\n"
     )
 
-    for op in ops:
+    parallel = ParallelCodeGenerator.create(ops, generate_op_fasm_x86_64_linux)
+    code = out if parallel is None else parallel
+    index = 0
+    while index < len(ops):
+        op = ops[index]
+        index += 1
         if State.current_proc is not None and State.config.o_UPR:
             if State.current_proc not in State.used_procs:
                 if op.type == OpType.ENDPROC:
                     State.current_proc = None
                 continue
-        buf += generate_op_fasm_x86_64_linux(op)
+        if parallel is not None and op.type == OpType.DEFPROC and is_generated(op):
+            code.write(generate_spill())
+            index = parallel.submit(index - 1) + 1
+            continue
+        code.write(generate_op_fasm_x86_64_linux(op))
+    code.write(generate_spill())
+    if parallel is not None:
+        parallel.finish(out)
 
     ior_code = 'index_out_of_range_text: db "Index out of range in "'
     npd_code = 'null_ptr_deref_text: db "Null pointer dereference in "'
-    buf += (
+    out.write(
         "mov rax, 60\n"
         "xor rdi, rdi\n"
         "syscall\n"
@@ -142,14 +187,14 @@ def generate_fasm_x86_64_linux(ops: List[Op]) -> str:
     )
 
     for index, loc in enumerate(State.locs_to_include):
-        buf += f"loc_{index}: db {', '.join([str(j) for j in bytes(loc, encoding='utf-8')])}, 10\n"
+        out.write(f"loc_{index}: db {decimal_bytes(bytes(State.format_loc(loc), encoding='utf-8'))}, 10\n")
     for index, string in enumerate(State.string_data):
         if len(string) != 0:
-            buf += f"str_{index}: db {', '.join([str(j) for j in string])}\n"
+            out.write(f"str_{index}: db {decimal_bytes(string)}\n")
         else:
-            buf += f"str_{index}:\n"
+            out.write(f"str_{index}:\n")
 
-    buf += (
+    out.write(
         f"{f'mem: rb {Memory.global_offset}' if Memory.global_offset else ''}\n"
         "call_stack_ptr: rb 8\n"
         "bind_stack_ptr: rb 8\n"
@@ -157,15 +202,13 @@ def generate_fasm_x86_64_linux(ops: List[Op]) -> str:
         f"call_stack: rb {State.config.size_call_stack}\n"
     )
 
-    return buf
-
 
 def generate_fasm_types() -> str:
     """
     Generates a string of assembly, which if put into the .data segment,
     will define all the runtimed types in the static memmory.
     """
-    buf = ""
+    buf: List[str] = []
     queue_set = State.runtimed_types_set.copy()
     queue_list = State.runtimed_types_list.copy()
     generated_types: Set[object] = set()
@@ -175,8 +218,8 @@ def generate_fasm_types() -> str:
         if typ.text_repr() in generated_types:
             continue
         generated_types.add(typ.text_repr())
-        buf += generate_fasm_type(typ, queue_set, queue_list, generated_types) + "\n"
-    return buf
+        buf.append(generate_fasm_type(typ, queue_set, queue_list, generated_types) + "\n")
+    return "".join(buf)
 
 
 def generate_fasm_type(typ: Type, queue_set: Set[Type], queue_list: List[Type], generated_types: Set[str]):
@@ -250,11 +293,15 @@ def generate_fasm_type(typ: Type, queue_set: Set[Type], queue_list: List[Type],
 
 def generate_op_comment(op: Op):
     """Generates a comment, describing the operation `op`."""
-    buf = f";; {State.loc} {op.type.name} "
+    buf = f";; {State.format_loc(State.loc)} {op.type.name} "
     if op.type == OpType.OPERATOR:
         buf += f"{op.operand.name}\n"
     elif isinstance(op.operand, Block):
         buf += f"Block: {op.operand.type.name} {op.operand.start} - {op.operand.end}\n"
+    elif isinstance(op.operand, Type):
+        # The default and the runtime representations of structures contain their addresses,
+        # which would make the output differ between runs
+        buf += f"{type_to_str(op.operand)}\n"
     else:
         buf += f"{op.operand}\n"
     return buf
@@ -269,10 +316,19 @@ def generate_op_fasm_x86_64_linux(op: Op) -> str:
 
     if not op.compiled:
         return ""
+    if State.pending_comparison is not None and op.type not in FUSED_OP_TYPES:
+        return generate_pending_comparison() + generate_op_fasm_x86_64_linux(op)
 
     State.loc = op.loc
     comment = generate_op_comment(op)
 
+    if State.config.optimization_level >= 2:
+        cached = generate_cached_op_fasm_x86_64_linux(op)
+        if cached is not None:
+            return comment + cached
+        if State.cached_registers and op.type not in BRANCH_OP_TYPES:
+            return generate_spill() + generate_op_fasm_x86_64_linux(op)
+
     if op.type == OpType.PUSH_INT:
         if op.operand == 0:
             mov = f"xor rax, rax"
@@ -325,6 +381,10 @@ def generate_op_fasm_x86_64_linux(op: Op) -> str:
     elif op.type == OpType.PUSH_PROC:
         return comment + f"push addr_{op.operand.ip}\n"
     elif op.type == OpType.OPERATOR:
+        if op.operand in CONDITION_CODES and State.config.optimization_level >= 1:
+            # The comparison is generated with the next operation, which may be a branch
+            State.pending_comparison = op
+            return comment
         return comment + generate_operator_fasm_x86_64_linux(op)
     elif op.type == OpType.SYSCALL:
         buf = ""
@@ -333,11 +393,7 @@ def generate_op_fasm_x86_64_linux(op: Op) -> str:
         buf += f"syscall\npush rax\n\n"
         return comment + buf
     elif op.type == OpType.IF:
-        return comment + (
-            "pop rax\n"
-            "cmp rax, 0\n"
-            f"jz addr_{op.operand.end}\n"
-        )
+        return comment + generate_branch(f"addr_{op.operand.end}", False)
     elif op.type == OpType.ELSE:
         return comment + (
             f"jmp addr_{op.operand.end}\n"
@@ -346,6 +402,9 @@ def generate_op_fasm_x86_64_linux(op: Op) -> str:
     elif op.type == OpType.ENDIF:
         return comment + f"addr_{op.operand.end}:\n"
     elif op.type == OpType.WHILE:
+        if State.config.optimization_level >= 1:
+            # The condition is checked again at the end of the loop, so the loop has a single jump
+            return comment + generate_branch(f"addr_{op.operand.end}", False) + f"addr_{op.operand.start}:\n"
         return comment + (
             f"addr_{op.operand.start}:\n"
             "pop rax\n"
@@ -353,6 +412,8 @@ def generate_op_fasm_x86_64_linux(op: Op) -> str:
             f"jz addr_{op.operand.end}\n"
         )
     elif op.type == OpType.ENDWHILE:
+        if State.config.optimization_level >= 1:
+            return comment + generate_branch(f"addr_{op.operand.start}", True) + f"addr_{op.operand.end}:\n"
         return comment + (
             f"jmp addr_{op.operand.start}\n"
             f"addr_{op.operand.end}:\n"
@@ -609,7 +670,7 @@ def generate_op_fasm_x86_64_linux(op: Op) -> str:
                 "mov rax, r10\n"
                 f"mov rbx, {op.operand[1]}\n"
                 f"mov r15, loc_{op.loc_id}\n"
-                f"mov r12, {len(State.locs_to_include[op.loc_id]) + 1}\n"
+                f"mov r12, {len(State.format_loc(State.locs_to_include[op.loc_id])) + 1}\n"
                 "call check_array_bounds\n"
             )
         return comment + code
@@ -623,6 +684,220 @@ def generate_op_fasm_x86_64_linux(op: Op) -> str:
         cont_assert(False, f"Generation isn't implemented for op type: {op.type.name}")
 
 
+def generate_pending_comparison() -> str:
+    """
+    Generates and returns the string of assembly for the pending comparison,
+    which wasn't fused with a branch, or an empty string if there is none.
+    """
+    op = State.pending_comparison
+    if op is None:
+        return ""
+    State.pending_comparison = None
+    if State.config.optimization_level < 2:
+        return generate_operator_fasm_x86_64_linux(op)
+
+    # The compared values are the top two cached ones, the result replaces them
+    registers = State.cached_registers
+    right = registers.pop()
+    return (
+        "xor rcx, rcx\n"
+        "mov rdx, 1\n"
+        f"cmp {registers[-1]}, {right}\n"
+        f"cmov{CONDITION_CODES[op.operand][0]} rcx, rdx\n"
+        f"mov {registers[-1]}, rcx\n"
+    )
+
+
+def generate_spill() -> str:
+    """
+    Generates and returns the string of assembly, which pushes the pending comparison
+    and all the values cached in registers to the stack.
+    """
+    code = generate_pending_comparison()
+    code += "".join(f"push {register}\n" for register in State.cached_registers)
+    State.cached_registers = []
+    return code
+
+
+def generate_branch(label: str, condition: bool) -> str:
+    """
+    Generates and returns the string of assembly, which pops a condition and jumps to the `label`
+    if it is the `condition`. If there is a pending comparison, its flags are used as the condition
+    instead of pushing it as a value. The cached values are pushed before the jump.
+    """
+    op = State.pending_comparison
+    registers = State.cached_registers
+    if op is not None and State.config.optimization_level >= 2:
+        State.pending_comparison = None
+        left, right = registers[-2:]
+        del registers[-2:]
+        return generate_spill() + (
+            f"cmp {left}, {right}\n"
+            f"j{CONDITION_CODES[op.operand][0 if condition else 1]} {label}\n"
+        )
+    if op is not None:
+        State.pending_comparison = None
+        return (
+            "pop rbx\n"
+            "pop rax\n"
+            "cmp rax, rbx\n"
+            f"j{CONDITION_CODES[op.operand][0 if condition else 1]} {label}\n"
+        )
+    if registers:
+        value = registers.pop()
+        return generate_spill() + (
+            f"cmp {value}, 0\n"
+            f"{'jnz' if condition else 'jz'} {label}\n"
+        )
+    return (
+        "pop rax\n"
+        "cmp rax, 0\n"
+        f"{'jnz' if condition else 'jz'} {label}\n"
+    )
+
+
+def cache_register() -> Tuple[str, str]:
+    """
+    Caches a new value on the top of the stack. If all the registers are used,
+    the bottom cached value is pushed to the stack to free its register.
+
+    Returns a tuple of the string of assembly, which frees the register, and the register.
+    """
+    registers = State.cached_registers
+    code = ""
+    if len(registers) == len(CACHE_REGISTERS):
+        code = f"push {registers.pop(0)}\n"
+    register = next(register for register in CACHE_REGISTERS if register not in registers)
+    registers.append(register)
+    return code, register
+
+
+def cache_values(count: int) -> str:
+    """
+    Returns the string of assembly, which pops values from the stack
+    into registers, until at least `count` values are cached.
+    """
+    registers = State.cached_registers
+    code = ""
+    while len(registers) < count:
+        register = next(register for register in CACHE_REGISTERS if register not in registers)
+        code += f"pop {register}\n"
+        registers.insert(0, register)
+    return code
+
+
+def generate_cached_op_fasm_x86_64_linux(op: Op) -> Optional[str]:
+    """
+    Generates and returns the string of assembly for the operation `op`, which uses
+    the values cached in registers instead of the stack, or None if the operation
+    needs all the values to be on the stack.
+    """
+    registers = State.cached_registers
+    if op.type == OpType.PUSH_INT:
+        code, register = cache_register()
+        if op.operand == 0:
+            return code + f"xor {register}, {register}\n"
+        return code + f"mov {register}, {op.operand}\n"
+    elif op.type == OpType.PUSH_BIND_STACK:
+        code, register = cache_register()
+        return code + (
+            f"mov rbx, bind_stack-{(State.bind_stack_size - op.operand)*8}\n"
+            "mov rcx, [bind_stack_ptr]\n"
+            f"mov {register}, [rbx+rcx]\n"
+        )
+    elif op.type == OpType.BIND:
+        State.bind_stack_size += op.operand
+        code = ""
+        for i in range(op.operand):
+            if registers:
+                value = registers.pop()
+            else:
+                value = "rax"
+                code += "pop rax\n"
+            code += (
+                "mov rbx, [bind_stack_ptr]\n"
+                f"add rbx, {(op.operand - i - 1) * 8}\n"
+                f"mov [bind_stack+rbx], {value}\n"
+            )
+        return code + (
+            "mov rax, [bind_stack_ptr]\n"
+            f"add rax, {op.operand * 8}\n"
+            "mov [bind_stack_ptr], rax\n"
+        )
+    elif op.type == OpType.UNBIND:
+        State.bind_stack_size -= op.operand
+        return (
+            "mov rbx, [bind_stack_ptr]\n"
+            f"sub rbx, {op.operand * 8}\n"
+            "mov [bind_stack_ptr], rbx\n"
+        )
+    elif op.type != OpType.OPERATOR:
+        return None
+
+    operator = op.operand
+    if operator in CONDITION_CODES:
+        # The comparison is generated with the next operation, which may be a branch
+        State.pending_comparison = op
+        return cache_values(2)
+    elif operator in (Operator.ADD, Operator.SUB, Operator.MUL):
+        code = cache_values(2)
+        right = registers.pop()
+        instruction = "imul" if operator == Operator.MUL else operator.name.lower()
+        return code + f"{instruction} {registers[-1]}, {right}\n"
+    elif operator == Operator.DIV:
+        code = cache_values(2)
+        return code + (
+            "xor rdx, rdx\n"
+            f"mov rax, {registers[-2]}\n"
+            f"idiv {registers[-1]}\n"
+            f"mov {registers[-2]}, rax\n"
+            f"mov {registers[-1]}, rdx\n"
+        )
+    elif operator == Operator.DUP:
+        code = cache_values(1)
+        value = registers[-1]
+        spill, register = cache_register()
+        return code + spill + f"mov {register}, {value}\n"
+    elif operator == Operator.DROP:
+        if registers:
+            registers.pop()
+            return ""
+        return "pop rax\n"
+    elif operator == Operator.SWAP:
+        code = cache_values(2)
+        registers[-1], registers[-2] = registers[-2], registers[-1]
+        return code
+    elif operator == Operator.OVER:
+        code = cache_values(2)
+        value = registers[-2]
+        spill, register = cache_register()
+        return code + spill + f"mov {register}, {value}\n"
+    elif operator == Operator.ROT:
+        code = cache_values(3)
+        registers[-1], registers[-3] = registers[-3], registers[-1]
+        return code
+    elif op.loc_id != -1 and State.config.re_NPD:
+        # The null pointer check uses the stack
+        return None
+    elif operator in (Operator.LOAD, Operator.LOAD8):
+        code = cache_values(1)
+        if operator == Operator.LOAD8:
+            return code + (
+                "xor rcx, rcx\n"
+                f"mov cl, [{registers[-1]}]\n"
+                f"mov {registers[-1]}, rcx\n"
+            )
+        return code + f"mov {registers[-1]}, [{registers[-1]}]\n"
+    elif operator in (Operator.STORE, Operator.STORE8):
+        code = cache_values(2)
+        pointer = registers.pop()
+        value = registers.pop()
+        if operator == Operator.STORE8:
+            value += "b"
+        return code + f"mov [{pointer}], {value}\n"
+    return None
+
+
 def generate_operator_fasm_x86_64_linux(op: Op):
     """
     Generates and returns a string of assembly for an operation `op`,
@@ -634,7 +909,7 @@ def generate_operator_fasm_x86_64_linux(op: Op):
     if op.loc_id != -1 and State.config.re_NPD:
         call_npd_code = (
             f"mov r15, loc_{op.loc_id}\n"
-            f"mov r12, {len(State.locs_to_include[op.loc_id]) + 1}\n"
+            f"mov r12, {len(State.format_loc(State.locs_to_include[op.loc_id])) + 1}\n"
             "call check_null_ptr\n"
         )
     else:
@@ -1,7 +1,7 @@
 from typing import List
 from parsing.op import *
 from state import *
-from .fasm_x86_64_linux import compile_ops_fasm_x86_64_linux
+from .fasm_x86_64_linux import compile_ops_fasm_x86_64_linux, run_fasm_x86_64_linux
 from .wat64 import compile_ops_wat64
 
 TARGETS = {
@@ -9,6 +9,11 @@ TARGETS = {
     "wat64" : compile_ops_wat64
 }
 
+# The targets, which support the run flag
+RUNNERS = {
+    "fasm_x86_64_linux" : run_fasm_x86_64_linux,
+}
+
 def compile_ops(ops: List[Op]):
     """Compiles for the current target, which is determined by the config."""
     cont_assert(State.config.target in TARGETS, "taget not found")
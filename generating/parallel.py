@@ -0,0 +1,163 @@
+import io
+import multiprocessing
+import os
+import sys
+
+from typing import Any, Callable, List, Optional, Tuple
+
+from parsing.op import Op, OpType
+from state import State
+from .emitter import Emitter
+
+# The operations of the program and the function generating the code for one of them.
+# The workers are forked, so they have the same objects as the main process.
+_ops: List[Op] = []
+_generate_op: Callable[[Op], str] = lambda op: ""
+
+
+def generate_procs(batch: List[Tuple[int, int, int]]) -> List[Tuple[Any, ...]]:
+    """
+    Generates the code for a batch of procedures in a worker. The batch is a list of
+    the indexes of their DEFPROC and ENDPROC operations and the sizes of the bind stack
+    before them. Stops at the first procedure with an error.
+
+    Returns a list of the results of `generate_proc`.
+    """
+    results = []
+    for start, end, bind_stack_size in batch:
+        results.append(generate_proc(start, end, bind_stack_size))
+        if results[-1][0] != "ok":
+            break
+    return results
+
+
+def generate_proc(start: int, end: int, bind_stack_size: int) -> Tuple[Any, ...]:
+    """
+    Generates the code for the procedure with operations from `start` to `end` in a worker.
+
+    Returns a tuple of "ok" and the code if it was generated. Otherwise returns a tuple of
+    "exit" and the exit code or "raise" and the exception, the written errors and `State.loc`.
+    """
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    try:
+        State.current_proc = None
+        State.bind_stack_size = bind_stack_size
+        State.pending_comparison = None
+        State.cached_registers = []
+        return ("ok", "".join([_generate_op(op) for op in _ops[start : end + 1]]))
+    except SystemExit as e:
+        return ("exit", e.code, sys.stderr.getvalue(), State.loc)
+    except Exception as e:
+        return ("raise", e, sys.stderr.getvalue(), State.loc)
+    finally:
+        sys.stderr = stderr
+
+
+class ParallelCodeGenerator:
+    """
+    Generates the code of the procedures in a pool of forked processes,
+    while the main process generates the rest of the program.
+
+    The code of an operation only depends on the operation, the current procedure
+    and the size of the bind stack, which is computed for every procedure before it is sent.
+    The main process writes its code into the generator and the code of the procedures
+    is put between it in the order of the program, so the output is the same
+    as if the operations were generated one by one.
+    """
+    def __init__(self, ops: List[Op], generate_op: Callable[[Op], str], jobs: int, procs_count: int):
+        global _ops, _generate_op
+        _ops = ops
+        _generate_op = generate_op
+        self.ops = ops
+        self.batch_size = max(1, procs_count // (jobs * 4))
+        self.batch: List[Tuple[int, int, int]] = []
+        self.pending: List[Any] = []
+        # The code written by the main process and None in place of every submitted procedure
+        self.parts: List[Optional[str]] = []
+        self.pool = multiprocessing.get_context("fork").Pool(jobs)
+
+    @staticmethod
+    def create(ops: List[Op], generate_op: Callable[[Op], str]) -> Optional["ParallelCodeGenerator"]:
+        """
+        Returns a `ParallelCodeGenerator` for the program if the parallel code generation(o_PCG)
+        is enabled and the program has enough procedures for it to be worth it, otherwise None.
+        """
+        if not State.config.o_PCG:
+            return None
+        jobs = State.config.pcg_jobs if State.config.pcg_jobs > 0 else os.cpu_count() or 1
+        procs_count = sum(1 for op in ops if op.type == OpType.DEFPROC and is_generated(op))
+        if jobs < 2 or procs_count < State.config.pcg_min_procs:
+            return None
+        try:
+            return ParallelCodeGenerator(ops, generate_op, jobs, procs_count)
+        except (OSError, ValueError):
+            # Forking isn't available on the platform
+            return None
+
+    def write(self, code: str):
+        self.parts.append(code)
+
+    def submit(self, start: int) -> int:
+        """
+        Sends the procedure defined at the `start` to the workers and changes
+        `State.bind_stack_size` the same way generating its operations would.
+
+        Returns the index of the ENDPROC operation of the procedure.
+        """
+        end = start
+        bind_stack_size = State.bind_stack_size
+        while self.ops[end].type != OpType.ENDPROC:
+            end += 1
+            if not self.ops[end].compiled:
+                continue
+            if self.ops[end].type == OpType.BIND:
+                State.bind_stack_size += self.ops[end].operand
+            elif self.ops[end].type == OpType.UNBIND:
+                State.bind_stack_size -= self.ops[end].operand
+
+        self.parts.append(None)
+        self.batch.append((start, end, bind_stack_size))
+        if len(self.batch) >= self.batch_size:
+            self.submit_batch()
+        return end
+
+    def submit_batch(self):
+        """Sends the collected procedures to the workers"""
+        if self.batch:
+            self.pending.append(self.pool.apply_async(generate_procs, (self.batch,)))
+            self.batch = []
+
+    def finish(self, out: Emitter):
+        """
+        Waits for the workers and writes all the code into the emitter `out`.
+        Reports the error of the first incorrect procedure if there is one.
+        """
+        self.submit_batch()
+        try:
+            procs_code = []
+            for pending in self.pending:
+                for result in pending.get():
+                    if result[0] != "ok":
+                        self.report(result)
+                    procs_code.append(result[1])
+        finally:
+            self.pool.terminate()
+
+        procs = iter(procs_code)
+        for part in self.parts:
+            out.write(next(procs) if part is None else part)
+
+    def report(self, result: Tuple[Any, ...]):
+        """Reports the error of a procedure the same way, as if it was generated in the main process"""
+        kind, value, errors, loc = result
+        sys.stderr.write(errors)
+        State.loc = loc
+        if kind == "exit":
+            exit(value)
+        raise value
+
+
+def is_generated(op: Op) -> bool:
+    """Returns whether the code of the procedure defined by the DEFPROC operation `op` is generated"""
+    return op.compiled and (op.operand in State.used_procs or not State.config.o_UPR)
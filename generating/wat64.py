@@ -6,6 +6,9 @@ from typing import List, Set, Union
 from parsing.op import *
 from state import *
 from type_checking.types import *
+import build_manifest
+import timing
+from .emitter import Emitter
 
 assert len(Operator) == 20, "Unimplemented operator in wat64.py"
 assert len(OpType) == 40, "Unimplemented type in wat64.py"
@@ -65,6 +68,8 @@ WAT64_HEADER =\
 """.replace("\n", "").replace("    ", "")
 LOAD_CODE = "(i32.wrap_i64) (i64.load)"
 MEMORY_PAGE_SIZE = 65536 
+# The hex codes of the bytes for the strings of data instructions
+HEX_CODES = [f"\\{byte:02x}" for byte in range(256)]
 
 def compile_ops_wat64(ops: List[Op]):
     """
@@ -85,17 +90,27 @@ def compile_ops_wat64(ops: List[Op]):
     
     out = State.filename if State.config.out is None else State.config.out
 
-    with open(f"{out}.wat", "w") as f:
-        f.write(generate_wat64(ops))
+    with timing.timed_pass("generate"), open(f"{out}.wat", "w") as f:
+        emitter = Emitter(f)
+        generate_wat64(ops, emitter)
+        emitter.flush()
 
-    subprocess.run(["wat2wasm", f"{out}.wat", "-o", f"{out}.wasm"], stdin=sys.stdin, stderr=sys.stderr)
+    # The module from the previous build is reused if the wat is the same
+    if build_manifest.needs_assembling():
+        with timing.timed_pass("assemble"):
+            result = subprocess.run(
+                ["wat2wasm", f"{out}.wat", "-o", f"{out}.wasm"], stdin=sys.stdin, stderr=sys.stderr
+            )
+        # The manifest isn't saved, so the module from the previous build is never reused
+        if result.returncode != 0:
+            exit(result.returncode)
 
 def byte_to_hex_code(byte: int):
     """
     Take a non-negative integer, that is less that 256 and
     converts it to a string hex code e. g. 69 -> "\\45".
     """
-    return f"\\" + (hex(byte)[2:] if byte >= 16 else '0' + hex(byte)[2:])
+    return HEX_CODES[byte]
 
 def generate_type(t: Type, offset: int, buf: List[Union[int, Type]],
                   queue_set: Set[Type], queue_list: List[Type],
@@ -195,14 +210,14 @@ def generate_types(offset: int) -> Tuple[int, str, Dict[Type, int]]:
         types_table[t] = offset
         offset = generate_type(t, offset, buf, queue_set, queue_list, types_table)
 
-    text_buf = f"(data (i32.const {initial_offset}) \""
+    text_buf = [f"(data (i32.const {initial_offset}) \""]
     for byte in buf:
         if isinstance(byte, Type):
             byte = types_table[byte]
-        text_buf += "".join(map(byte_to_hex_code, byte.to_bytes(8, "little")))
-    text_buf += '")'
+        text_buf.extend(map(HEX_CODES.__getitem__, byte.to_bytes(8, "little")))
+    text_buf.append('")')
 
-    return offset, text_buf, types_table
+    return offset, "".join(text_buf), types_table
 
 def generate_data() -> Tuple[int, str, Dict[str, int]]:
     """
@@ -214,15 +229,15 @@ def generate_data() -> Tuple[int, str, Dict[str, int]]:
     "str_{string_index}" to their offsets. Or in other words (offset, buf, data_table).
     """
     data_table = {}
-    buf = ""
+    buf = []
     offset = 1
     for index, string in enumerate(State.string_data):
-        string_data = "".join(map(byte_to_hex_code, string))
-        buf += f'(data (i32.const {offset}) "{string_data}")'
+        string_data = "".join(map(HEX_CODES.__getitem__, string))
+        buf.append(f'(data (i32.const {offset}) "{string_data}")')
         data_table[f"str_{index}"] = offset
         offset += len(string)
 
-    return (offset, buf, data_table)
+    return (offset, "".join(buf), data_table)
 
 def generate_proc_table() -> Tuple[Dict[Proc, int], str]:
     """
@@ -231,13 +246,13 @@ def generate_proc_table() -> Tuple[Dict[Proc, int], str]:
 
     Returns a tuple of the mapping and the wat string.
     """
-    buf = f"(table (export \"__addrtable\") {len(State.referenced_procs)} funcref) "
-    buf += "(elem (i32.const 0)"
+    buf = [f"(table (export \"__addrtable\") {len(State.referenced_procs)} funcref) (elem (i32.const 0)"]
     procs_table = {}
     for index, proc in enumerate(State.referenced_procs):
         procs_table[proc] = index
-        buf += f" $addr_{proc.ip}"
-    return procs_table, buf + ")"
+        buf.append(f" $addr_{proc.ip}")
+    buf.append(")")
+    return procs_table, "".join(buf)
 
 def get_static_size(data_offset: int) -> int:
     """Gets size of the static memory from the state and the final data offset."""
@@ -258,7 +273,7 @@ def generate_imports() -> str:
     Generates and returns a wat string of import instructions,
     which import every procedure in `State.imported_procs`
     """
-    buf = ""
+    buf = []
 
     for name, path in State.imported_procs:
         path = " ".join(
@@ -266,31 +281,37 @@ def generate_imports() -> str:
             path.split(".")))
         param = f"(param{' i64' * len(State.procs[name].in_stack)})"
         result = f"(result{' i64' * len(State.procs[name].out_stack)})"
-        buf += f"(import {path} (func $addr_{State.procs[name].ip} {param} {result}))"
+        buf.append(f"(import {path} (func $addr_{State.procs[name].ip} {param} {result}))")
 
-    return buf
+    return "".join(buf)
 
 def generate_call_types(call_types: List[str]) -> str:
     """
     Generates and returns a wat string of type instructions, which
     declare all type signatures in `call_types` and call them "$call_type_{index}"
     """
-    buf = ""
-    for index, signature in enumerate(call_types):
-        buf += f" (type $call_type_{index} {signature})"
-    return buf
+    return "".join(
+        f" (type $call_type_{index} {signature})" for index, signature in enumerate(call_types)
+    )
 
-def generate_wat64(ops: List[Op]) -> str:
-    """Generates a string of fasm assembly for the program from the list of operations `ops`."""
+def generate_wat64(ops: List[Op], out: Emitter):
+    """Generates wat for the program from the list of operations `ops` into the emitter `out`."""
     offset, data, data_table = generate_data()
     procs_table, procs_table_wat = generate_proc_table()
     offset, types_wat, types_table = generate_types(offset)
-    buf = "(module " + generate_imports() + WAT64_HEADER.format(
+    out.write("(module ")
+    out.write(generate_imports())
+    out.write(WAT64_HEADER.format(
         math.ceil(get_static_size(offset) / MEMORY_PAGE_SIZE),
         get_static_size(offset)
-    ) + generate_globals(offset) + data + procs_table_wat + types_wat
+    ))
+    out.write(generate_globals(offset))
+    out.write(data)
+    out.write(procs_table_wat)
+    out.write(types_wat)
     call_types: List[str] = []
-    main_buf = '(func (export "main") '
+    # The main function goes after the types of the calls, which are known only after all the operations
+    main_buf = ['(func (export "main") ']
     for op in ops:
         if not op.compiled: continue
         if State.current_proc is not None and State.config.o_UPR:
@@ -300,14 +321,13 @@ def generate_wat64(ops: List[Op]) -> str:
                 continue
         
         if State.current_proc is not None or op.type == OpType.DEFPROC:
-            buf += generate_op_wat64(op, offset, data_table, procs_table, call_types, types_table)
+            out.write(generate_op_wat64(op, offset, data_table, procs_table, call_types, types_table))
         else:
-            main_buf += generate_op_wat64(op, offset, data_table, procs_table, call_types, types_table)
-    buf += generate_call_types(call_types)
-    main_buf += ")"
-    buf += main_buf + ")"
-
-    return buf
+            main_buf.append(generate_op_wat64(op, offset, data_table, procs_table, call_types, types_table))
+    out.write(generate_call_types(call_types))
+    for code in main_buf:
+        out.write(code)
+    out.write("))")
 
 def generate_block_type_info(block: Block) -> str:
     """Generates and returns a wat string with the signature for the `block`."""
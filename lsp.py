@@ -6,6 +6,7 @@ from typing import Any
 
 import cont
 from state import State
+from type_checking import proc_cache
 
 class StdIOWrapper(io.TextIOBase):
     OVERWRITTEN = ["close", "__getattribute__", "__setattr__", "__delattr__"]
@@ -38,6 +39,7 @@ def main():
     orig_stdout = sys.stdout
     sys.stdin = StdIOWrapper(sys.stdin)
     sys.stderr = StdIOWrapper(sys.stderr)
+    proc_cache.keep_entries_in_memory()
     while True:
         try:
             command = json.loads(input())
@@ -51,11 +53,9 @@ def main():
                     sys.stdout = orig_stdout
                     print('{"success": true, "has_error": false}', flush=True)
                 except AssertionError as e:
-                    # Not using split, because file names might include a colon and maxsplit works from the left
-                    char_begin = State.loc.rfind(":")
-                    char = int(State.loc[char_begin+1:]) - 1
-                    line_begin = State.loc.rfind(":", 0, char_begin)
-                    line = int(State.loc[line_begin+1:char_begin]) - 1
+                    _, line, char = State.unpack_loc(State.loc)
+                    line -= 1
+                    char -= 1
                     sys.stdout = orig_stdout
                     print(json.dumps({
                         "success": True, "has_error": True, "error_message": e.args[0],
@@ -0,0 +1,193 @@
+from typing import Callable, Dict, List, Optional, Set
+
+from parsing.op import Op, OpType, Operator
+from state import State
+
+INT_BITS = 64
+
+# The operators computed on constants, they take the values from the bottom of the stack to the top
+BINARY_OPERATORS: Dict[Operator, Callable[[int, int], int]] = {
+    Operator.ADD : lambda a, b: a + b,
+    Operator.SUB : lambda a, b: a - b,
+    Operator.MUL : lambda a, b: a * b,
+    Operator.LT : lambda a, b: int(a < b),
+    Operator.GT : lambda a, b: int(a > b),
+    Operator.EQ : lambda a, b: int(a == b),
+    Operator.LE : lambda a, b: int(a <= b),
+    Operator.GE : lambda a, b: int(a >= b),
+    Operator.NE : lambda a, b: int(a != b),
+}
+
+# The operators, which rearrange the constants on the top of the stack,
+# mapped to the number of the constants and the indexes of the constants they leave
+STACK_OPERATORS: Dict[Operator, tuple] = {
+    Operator.DUP : (1, (0, 0)),
+    Operator.DROP : (1, ()),
+    Operator.SWAP : (2, (1, 0)),
+    Operator.OVER : (2, (0, 1, 0)),
+    Operator.ROT : (3, (2, 1, 0)),
+}
+
+# The operators with a constant, which doesn't change the other value
+IDENTITIES: Dict[Operator, int] = {
+    Operator.ADD : 0,
+    Operator.SUB : 0,
+    Operator.MUL : 1,
+}
+
+
+def optimize(ops: List[Op]) -> List[Op]:
+    """
+    The main entry point to the optimization step of the compilation process.
+    Optimizes the type checked operations according to the optimization level
+    in the config, which is the same for all the targets.
+
+    Returns the list of the optimized operations.
+    The operations themselves are never changed, since they can be cached.
+    """
+    if State.config.optimization_level >= 1:
+        ops = fold_constants(ops)
+    return ops
+
+
+def to_int64(value: int) -> int:
+    """Returns the `value` wrapped to a signed 64-bit integer the same way the machine does it"""
+    return (value + (1 << (INT_BITS - 1))) % (1 << INT_BITS) - (1 << (INT_BITS - 1))
+
+
+def fold_constants(ops: List[Op]) -> List[Op]:
+    """
+    Computes the operators on constants at compile time, removes the operators,
+    which don't change a value, and the branches of ifs with constant conditions,
+    which are never taken.
+
+    Returns the list of the folded operations.
+    """
+    folded: List[Op] = []
+    # The indexes of the operations in the branches, which are never taken
+    removed: Set[int] = set()
+    for index, op in enumerate(ops):
+        if index in removed:
+            continue
+        if op.compiled and op.type == OpType.OPERATOR and fold_operator(op, folded):
+            continue
+        if op.compiled and op.type == OpType.IF and constants(folded, 1) is not None:
+            condition = folded.pop().operand
+            removed.update(untaken_branch(ops, index, condition != 0))
+            continue
+        folded.append(op)
+
+    return folded
+
+
+def constants(folded: List[Op], count: int) -> Optional[List[int]]:
+    """
+    Returns the values of the `count` constants on the top of the `folded`
+    operations or None if there are less of them.
+    """
+    if len(folded) < count:
+        return None
+    values = []
+    for op in folded[len(folded) - count:]:
+        if not op.compiled or op.type != OpType.PUSH_INT:
+            return None
+        values.append(to_int64(op.operand))
+    return values
+
+
+def fold_operator(op: Op, folded: List[Op]) -> bool:
+    """
+    Folds the OPERATOR operation `op` into the `folded` operations before it.
+
+    Returns whether it was folded.
+    """
+    operator = op.operand
+    if operator in BINARY_OPERATORS:
+        values = constants(folded, 2)
+        if values is not None:
+            del folded[-2:]
+            folded.append(Op(OpType.PUSH_INT, to_int64(BINARY_OPERATORS[operator](*values)), op.loc))
+            return True
+    elif operator == Operator.DIV:
+        values = constants(folded, 2)
+        # The division is only the same on all the targets for non-negative values
+        if values is not None and values[0] >= 0 and values[1] > 0:
+            del folded[-2:]
+            folded.append(Op(OpType.PUSH_INT, values[0] // values[1], op.loc))
+            folded.append(Op(OpType.PUSH_INT, values[0] % values[1], op.loc))
+            return True
+    elif operator in STACK_OPERATORS:
+        count, order = STACK_OPERATORS[operator]
+        values = constants(folded, count)
+        if values is not None:
+            del folded[len(folded) - count:]
+            folded.extend(Op(OpType.PUSH_INT, values[i], op.loc) for i in order)
+            return True
+
+    if operator not in IDENTITIES:
+        return False
+    values = constants(folded, 1)
+    if values is None:
+        return False
+    if values[0] == IDENTITIES[operator]:
+        folded.pop()
+        return True
+    return fold_chain(op, folded, values[0])
+
+
+def fold_chain(op: Op, folded: List[Op], value: int) -> bool:
+    """
+    Folds the OPERATOR operation `op` with the constant `value` into the same operator
+    with a constant before it, e. g. `8 + 16 -` becomes `-8 +`.
+
+    Returns whether it was folded.
+    """
+    if len(folded) < 3:
+        return False
+    previous_constant, previous = folded[-3], folded[-2]
+    if not previous_constant.compiled or previous_constant.type != OpType.PUSH_INT:
+        return False
+    if not previous.compiled or previous.type != OpType.OPERATOR:
+        return False
+
+    previous_value = to_int64(previous_constant.operand)
+    if op.operand == Operator.MUL and previous.operand == Operator.MUL:
+        result = to_int64(previous_value * value)
+    elif op.operand != Operator.MUL and previous.operand in (Operator.ADD, Operator.SUB):
+        if previous.operand == Operator.SUB:
+            previous_value = -previous_value
+        result = to_int64(previous_value + (value if op.operand == Operator.ADD else -value))
+    else:
+        return False
+
+    del folded[-3:]
+    if result != IDENTITIES[op.operand]:
+        folded.append(Op(OpType.PUSH_INT, result, op.loc))
+        folded.append(Op(OpType.OPERATOR, Operator.ADD if op.operand == Operator.SUB else op.operand, op.loc))
+    return True
+
+
+def untaken_branch(ops: List[Op], index: int, condition: bool) -> Set[int]:
+    """
+    Returns the indexes of the operations of the if at the `index`, which aren't needed,
+    when its condition is always `condition`. These are the IF, ELSE and ENDIF operations
+    and the branch, which is never taken.
+    """
+    block = ops[index].operand
+    # The ELSE block starts at the end of the IF block and the ENDIF ends the last of them
+    end_block = block
+    removed = {index}
+    else_index = None
+    end = index + 1
+    while not (ops[end].compiled and ops[end].type == OpType.ENDIF and ops[end].operand is end_block):
+        if ops[end].compiled and ops[end].type == OpType.ELSE and ops[end].operand.start == block.end:
+            else_index = end
+            end_block = ops[end].operand
+        end += 1
+
+    if condition:
+        removed.update(range(else_index if else_index is not None else end, end + 1))
+    else:
+        removed.update(range(index, else_index + 1 if else_index is not None else end))
+        removed.add(end)
+    return removed
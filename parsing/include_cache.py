@@ -0,0 +1,326 @@
+import hashlib
+import json
+import os
+import pickle
+
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from state import State, Memory
+from parsing.op import Op
+
+# Must be changed every time the format of the cache entries changes
+CACHE_VERSION = 3
+
+COMPILER_DIRS = ("parsing", "compile_eval", "type_checking")
+COMPILER_FILES = ("state.py", "config.py")
+
+# The fields of `State`, which are only appended to while parsing a file
+APPENDED_LISTS = [
+    "ops_by_ips", "bind_stack", "imported_procs", "included_files", "include_edges", "files",
+    "runtimed_types_list", "string_data", "locs_to_include",
+]
+EXTENDED_DICTS = ["memories", "variables", "procs", "structures", "constants", "enums", "global_names"]
+EXTENDED_SETS = ["referenced_procs", "used_procs", "runtimed_types_set"]
+REPLACED_FIELDS = ["current_ip", "global_binded", "bind_stack_size", "curr_type_id"]
+# Parsing a file must leave these fields as they were for the file to be cached
+UNCHANGED_FIELDS = [
+    "route_stack", "do_stack", "compile_ifs_opened", "false_compile_ifs", "var_type_scopes",
+    "is_unpack", "is_init", "is_static", "is_named", "owner", "current_proc",
+]
+
+
+@lru_cache(maxsize=None)
+def compiler_digest(dirs: Tuple[str, ...] = COMPILER_DIRS, files: Tuple[str, ...] = COMPILER_FILES) -> str:
+    """
+    Returns a digest of the source code of the compiler's frontend or of the python files
+    in the `dirs` and the `files`, so cache entries created by a different version
+    of the compiler are never used.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = [os.path.join(root, i) for i in files]
+    for directory in dirs:
+        paths.extend(sorted(
+            os.path.join(root, directory, i) for i in os.listdir(os.path.join(root, directory))
+            if i.endswith(".py")
+        ))
+
+    digest = hashlib.sha1(str(CACHE_VERSION).encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """Returns a digest of the contents of the file at `path`"""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def config_options() -> Dict[str, Any]:
+    """Returns the values of all the config options, which can change the result of compilation"""
+    return {
+        name : getattr(State.config, name) for name in (
+            "target", *State.config.CONFIG_BOOL_OPTIONS,
+            *State.config.CONFIG_INT_OPTIONS, *State.config.CONFIG_BOOL_CLEAR_OPTIONS,
+        )
+    }
+
+
+def config_digest() -> bytes:
+    """
+    Returns a digest of everything besides the source code, that can change the result of parsing
+    except for the working directory.
+    """
+    return hashlib.sha1(json.dumps([compiler_digest(), config_options(), State.dir]).encode()).digest()
+
+
+def new_main_hash() -> Optional["hashlib._Hash"]:
+    """
+    Creates the source hash for the main file, which will be stored in `State.source_hash`.
+    The hash is seeded with the `config_digest` and the working directory, which is used for finding includes.
+
+    Returns None if the include cache is disabled.
+    """
+    if State.config.cache_dir is None:
+        return None
+    source_hash = hashlib.sha1(config_digest())
+    source_hash.update(os.getcwd().encode())
+    return source_hash
+
+
+def new_file_hash(key: str) -> "hashlib._Hash":
+    """Creates the source hash for a file included with the cache entry `key`"""
+    return hashlib.sha1(key.encode())
+
+
+def hashed_lines(program: Union[str, Iterable[str]], source_hash) -> Iterator[str]:
+    """Yields the lines of the `program` updating the `source_hash` with each of them"""
+    if isinstance(program, str):
+        program = program.split("\n")
+    for line in program:
+        # The lines read from a file keep their line breaks unlike the lines of a string,
+        # the break is hashed the same way for both, so the same text split into other lines has another hash
+        source_hash.update(line.rstrip("\n").encode() + b"\n")
+        yield line
+
+
+def include_key(abs_path: str) -> str:
+    """
+    Returns the key of the cache entry for the file at `abs_path` being included
+    at the current position. Since parsing is deterministic the key is computed from
+    all the source code parsed before the include and the contents of the file.
+    The source code parsed before includes all the files included by the earlier includes,
+    since their source digests are added to the source hash of the including file.
+    """
+    return hashlib.sha1(
+        f"{State.source_hash.hexdigest()}:{abs_path}:{file_digest(abs_path)}".encode()
+    ).hexdigest()
+
+
+def is_cacheable() -> bool:
+    """Returns whether a file included in the current state can be loaded from the cache or stored in it"""
+    return (
+        State.current_proc is None and not State.block_stack and
+        not State.tokens_queue and not State.var_type_scopes
+    )
+
+
+def is_pristine() -> bool:
+    """Returns whether nothing, that could change the result of parsing, was parsed yet"""
+    return (
+        State.current_ip == -1 and Memory.global_offset == 0 and is_cacheable() and
+        not State.compile_ifs_opened and not State.global_binded and
+        len(State.files) == 1 and # Only the main file, which doesn't change the locations in the prelude
+        not any(
+            getattr(State, name) for name in (*APPENDED_LISTS, *EXTENDED_DICTS, *EXTENDED_SETS)
+            if name != "files"
+        )
+    )
+
+
+def prelude_key(abs_path: str) -> Optional[str]:
+    """
+    Returns the key of the prelude snapshot if the file at `abs_path` is std.cn,
+    which is being included before anything else was parsed, or None otherwise.
+
+    The result of parsing the prelude depends only on the standard library and the configuration,
+    so the snapshot is shared by all programs and is recreated when any file in std/ changes.
+    """
+    std_dir = os.path.abspath(os.path.join(State.dir, "std"))
+    if abs_path != os.path.join(std_dir, "std.cn") or not is_pristine():
+        return None
+
+    names = sorted(os.listdir(std_dir))
+    # Includes are searched in the working directory first, so it can shadow the standard library
+    if os.path.abspath(os.getcwd()) != std_dir and any(os.path.exists(name) for name in names):
+        return None
+
+    digest = hashlib.sha1(config_digest())
+    for name in names:
+        path = os.path.join(std_dir, name)
+        if os.path.isfile(path):
+            digest.update(f"{name}:{file_digest(path)}".encode())
+    return "prelude_" + digest.hexdigest()
+
+
+class IncludeSnapshot:
+    """
+    The state of the parser before parsing an included file.
+    Used for finding what the file has added to the `State`.
+    """
+    def __init__(self):
+        self.lengths: Dict[str, int] = {name : len(getattr(State, name)) for name in APPENDED_LISTS}
+        self.dicts: Dict[str, dict] = {name : getattr(State, name).copy() for name in EXTENDED_DICTS}
+        self.sets: Dict[str, set] = {name : getattr(State, name).copy() for name in EXTENDED_SETS}
+        self.unchanged: Dict[str, Any] = {
+            name : (value.copy() if isinstance(value, list) else value)
+            for name, value in ((name, getattr(State, name)) for name in UNCHANGED_FIELDS)
+        }
+        self.signature = self.objects_signature()
+
+    def objects_signature(self) -> List[Tuple[int, ...]]:
+        """
+        Returns the sizes of the mutable parts of the existing procedures and structures.
+        If they change the file has modified objects created before it and cannot be cached.
+        """
+        signature = [(len(i.used_procs),) for i in self.dicts["procs"].values()]
+        for struct in self.dicts["structures"].values():
+            signature.append((len(struct.children), len(struct.methods), len(struct.static_methods)))
+        return signature
+
+    def persistent_ids(self) -> Dict[int, Tuple[Any, ...]]:
+        """
+        Returns a dictionary with the persistent ids of the objects created before the
+        included file. Such objects are stored in cache entries by reference.
+        """
+        ids: Dict[int, Tuple[Any, ...]] = {}
+        for index, op in enumerate(State.ops_by_ips[:self.lengths["ops_by_ips"]]):
+            if op is not None:
+                ids[id(op)] = ("op", index)
+        for name, proc in self.dicts["procs"].items():
+            ids[id(proc)] = ("proc", name)
+        for name, memory in self.dicts["memories"].items():
+            ids[id(memory)] = ("memory", name)
+        for name, struct in self.dicts["structures"].items():
+            ids[id(struct)] = ("struct", name)
+            for method_name, method in struct.methods.items():
+                ids.setdefault(id(method), ("method", name, method_name))
+            for method_name, method in struct.static_methods.items():
+                ids.setdefault(id(method), ("static_method", name, method_name))
+        return ids
+
+    def diff(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns everything the included file has added to the `State`
+        or None if the file has changed it in a way, that cannot be cached.
+        """
+        for name, value in self.unchanged.items():
+            if getattr(State, name) != value:
+                return None
+        if self.objects_signature() != self.signature:
+            return None
+
+        return {
+            "lists" : {name : getattr(State, name)[length:] for name, length in self.lengths.items()},
+            "dicts" : {
+                name : {
+                    key : value for key, value in getattr(State, name).items()
+                    if key not in orig or orig[key] is not value
+                } for name, orig in self.dicts.items()
+            },
+            "sets" : {name : getattr(State, name) - orig for name, orig in self.sets.items()},
+            "fields" : {name : getattr(State, name) for name in REPLACED_FIELDS},
+            "global_offset" : Memory.global_offset,
+        }
+
+
+class EntryPickler(pickle.Pickler):
+    """A pickler, which stores the objects from the `ids` dictionary by reference"""
+    def __init__(self, file, ids: Dict[int, Tuple[Any, ...]]):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.ids = ids
+
+    def persistent_id(self, obj: Any) -> Optional[Tuple[Any, ...]]:
+        return self.ids.get(id(obj))
+
+
+class EntryUnpickler(pickle.Unpickler):
+    """An unpickler, which resolves the references stored by `EntryPickler` using the `State`"""
+    def persistent_load(self, pid: Tuple[Any, ...]) -> Any:
+        kind = pid[0]
+        if kind == "op":
+            return State.ops_by_ips[pid[1]]
+        elif kind == "proc":
+            return State.procs[pid[1]]
+        elif kind == "memory":
+            return State.memories[pid[1]]
+        elif kind == "struct":
+            return State.structures[pid[1]]
+        elif kind == "method":
+            return State.structures[pid[1]].methods[pid[2]]
+        elif kind == "static_method":
+            return State.structures[pid[1]].static_methods[pid[2]]
+        raise pickle.UnpicklingError(f"unknown persistent id: {pid}")
+
+
+def entry_path(key: str) -> str:
+    """Returns the path to the file of the cache entry with the `key`"""
+    return os.path.join(State.config.cache_dir, key + ".pickle")
+
+
+def load(key: str) -> Optional[Tuple[List[Op], str]]:
+    """
+    Loads the cache entry with the `key` and adds everything the
+    included file has defined to the `State`.
+
+    Returns a tuple of the operations of the file and its source digest
+    or None if there is no valid entry.
+    """
+    try:
+        with open(entry_path(key), "rb") as f:
+            entry = EntryUnpickler(f).load()
+    except (OSError, EOFError, KeyError, IndexError, pickle.UnpicklingError):
+        return None
+
+    for path, digest in entry["files"]:
+        if not os.path.exists(path) or file_digest(path) != digest:
+            return None
+
+    diff = entry["diff"]
+    for name, tail in diff["lists"].items():
+        getattr(State, name).extend(tail)
+    for name, items in diff["dicts"].items():
+        getattr(State, name).update(items)
+    for name, items in diff["sets"].items():
+        getattr(State, name).update(items)
+    for name, value in diff["fields"].items():
+        setattr(State, name, value)
+    Memory.global_offset = diff["global_offset"]
+
+    return entry["ops"], entry["source_digest"]
+
+
+def store(key: str, snapshot: IncludeSnapshot, ops: List[Op], source_digest: str):
+    """
+    Stores the result of parsing an included file in the cache entry with the `key`.
+    The `snapshot` must be taken right before the file was parsed. The `source_digest`
+    is the digest of the source code of the file and all the files it has included.
+    """
+    diff = snapshot.diff()
+    if diff is None:
+        return
+
+    files = [(path, file_digest(path)) for path in diff["lists"]["included_files"]]
+    os.makedirs(State.config.cache_dir, exist_ok=True)
+    path = entry_path(key)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            EntryPickler(f, snapshot.persistent_ids()).dump(
+                {"files" : files, "diff" : diff, "ops" : ops, "source_digest" : source_digest}
+            )
+        os.replace(temp_path, path)
+    except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+        os.remove(temp_path)
@@ -69,12 +69,21 @@ class Operator(Enum):
     LOAD8 = auto()
 
 
+# Locations are packed into a single int: the id of the file in `State.files`, the line and the column
+LOC_BITS = 20
+LOC_MASK = (1 << LOC_BITS) - 1
+NO_LOC = -1
+
+
 class Op:
     """An operation"""
-    def __init__(self, type: OpType, operand=None, loc: str = "", loc_id=-1) -> None:
+    # Programs have a lot of operations, so they don't have a __dict__ to save memory
+    __slots__ = ("type", "operand", "loc", "loc_id", "compiled")
+
+    def __init__(self, type: OpType, operand=None, loc: int = NO_LOC, loc_id=-1) -> None:
         self.type: OpType = type
         self.operand = operand
-        self.loc: str = loc
+        self.loc: int = loc
         self.loc_id: int = loc_id
         self.compiled: bool = True
 
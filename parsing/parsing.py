@@ -1,12 +1,15 @@
 import os
+import re
 
-from typing import List, Tuple, Dict, Union, Iterable
+from typing import List, Tuple, Dict, Union, Iterable, Callable
 
 from compile_eval.compile_eval import evaluate_block
 from type_checking.types import *
 
 from .op import *
 from state import *
+from . import include_cache
+import timing
 
 OPERATORS = {
     "+" : Operator.ADD,
@@ -39,12 +42,16 @@ END_TYPES = {
     BlockType.BIND : OpType.UNBIND,
 }
 
+WHITESPACE_RE = re.compile(r"\s+")
+WORD_PART_RE = re.compile(r'(?:[^\s"/]|/(?!/))+')
+STRING_PART_RE = re.compile(r'[^"\\]*')
+
 assert len(Operator) == len(OPERATORS), "Unimplemented operator in parsing.py"
 assert len(OpType) == 40, "Unimplemented type in parsing.py"
 assert len(BlockType) == len(END_TYPES), "Unimplemented block type in parsing.py"
 
 
-def safe_next_token(exception: str = "") -> Tuple[str, str]:
+def safe_next_token(exception: str = "") -> Tuple[str, int]:
     """
     Gets the next token from the global iterator and
     throws an error if the EOF was reached.
@@ -66,7 +73,7 @@ def safe_next_token(exception: str = "") -> Tuple[str, str]:
     return token
 
 
-def next_proc_contract_token(name: Tuple[str, str]) -> Tuple[Tuple[str, str], str]:
+def next_proc_contract_token(name: Tuple[str, int]) -> Tuple[Tuple[str, int], str]:
     """
     Gets the next token for the procedure contract and handles the colon.
 
@@ -77,7 +84,7 @@ def next_proc_contract_token(name: Tuple[str, str]) -> Tuple[Tuple[str, str], st
     try:
         proc_token = next(State.tokens)
     except StopIteration:
-        State.loc = f"{State.filename}:{name[1]}"
+        State.loc = name[1]
         State.throw_error("proc contract was not closed")
     parts = proc_token[0].split(":", 1)
     if len(parts) > 1:
@@ -87,7 +94,7 @@ def next_proc_contract_token(name: Tuple[str, str]) -> Tuple[Tuple[str, str], st
 
     return proc_token, parts[0].strip()
 
-def parse_signature(name: Tuple[str, str], var_types_scope: Dict[str, VarType], 
+def parse_signature(name: Tuple[str, int], var_types_scope: Dict[str, VarType], 
                     end_char: str) -> Tuple[List[Type], List[Type], List[str]]:
     """
     Parses a procedure signature from the global token iterator.
@@ -124,7 +131,7 @@ def parse_signature(name: Tuple[str, str], var_types_scope: Dict[str, VarType],
                 continue
 
             is_ended, res = parse_type(
-                (proc_token_value, f"{State.filename}:{proc_token[1]}"),
+                (proc_token_value, proc_token[1]),
                 "procedure contaract",
                 allow_unpack=True,
                 end=end_char,
@@ -156,7 +163,7 @@ def parse_proc_head(self_named: bool = False) -> str:
     Parses the head of a procedure, defines it and returns the operations for the head.
     Does not consume the first token of the definition e. g. "proc".
     """
-    first_token: Tuple[str, str] = next(State.tokens)
+    first_token: Tuple[str, int] = next(State.tokens)
     owner: Optional[Ptr] = (
         None if State.owner is None or State.is_static else Ptr(State.owner)
     )
@@ -167,12 +174,12 @@ def parse_proc_head(self_named: bool = False) -> str:
 
     if first_token[0].startswith("[") and first_token[0].endswith("]"):
         if State.owner is not None:
-            State.loc = f"{State.filename}:{first_token[1]}"
+            State.loc = first_token[1]
             State.throw_error("cannot explicitly specify method's owner inside a structure")
 
         name = next(State.tokens)
         if first_token[0][1:-1] not in State.structures:
-            State.loc = State.loc = f"{State.filename}:{first_token[1]}"
+            State.loc = first_token[1]
             State.throw_error(f"structure {first_token[0][1:-1]} is not defined")
         owner = Ptr(State.structures[first_token[0][1:-1]])
     else:
@@ -199,7 +206,7 @@ def parse_proc_head(self_named: bool = False) -> str:
         in_types, out_types, names = [], [], []
 
     if name_value == "__init__" and out_types:
-        State.loc = f"{State.filename}:{name[1]}"
+        State.loc = name[1]
         State.throw_error("constructor cannot have out types")
 
     # TODO: Fix this hell
@@ -208,7 +215,7 @@ def parse_proc_head(self_named: bool = False) -> str:
         owner is not None and\
         not (len(in_types) == 1 and len(out_types) == 1)
     ):
-        State.loc = f"{State.filename}:{name[1]}"
+        State.loc = name[1]
         State.throw_error(
             f"{name_value} method is required to have 1 argument and 1 out type"
         )
@@ -217,7 +224,7 @@ def parse_proc_head(self_named: bool = False) -> str:
         owner is not None and\
         not (len(in_types) == 1 and len(out_types) == 2)
     ):
-        State.loc = f"{State.filename}:{name[1]}"
+        State.loc = name[1]
         State.throw_error(
             f"{name_value} method is required to have 1 argument and 2 out types", False
         )
@@ -232,11 +239,11 @@ def parse_proc_head(self_named: bool = False) -> str:
         name_value not in State.NOT_SAME_TYPE_DUNDER_METHODS
     ):
         if owner.typ is not in_types[0].typ:
-            State.loc = f"{State.filename}:{name[1]}"
+            State.loc = name[1]
             State.throw_error(f"{name_value} must have owner structure as argument")
         if len(in_types) > 1:
             if owner.typ is not in_types[1].typ:
-                State.loc = f"{State.filename}:{name[1]}"
+                State.loc = name[1]
                 State.throw_error(f"{name_value} must have owner structure as argument")
     if name_value == "__index_ptr__" and owner is not None and\
             not isinstance(out_types[0], Ptr):
@@ -306,6 +313,7 @@ def parse_proc_head(self_named: bool = False) -> str:
         State.owner.static_methods[name_value] = proc
     elif owner is None:
         State.procs[name_value] = proc
+        State.define_name(name_value, SymbolKind.PROC, proc)
     if State.is_named and owner is not None:
         names.append("self")
     State.current_proc = proc
@@ -320,7 +328,7 @@ def parse_proc_head(self_named: bool = False) -> str:
     return [*generated_ops, op, *prefix_ops]
 
 
-def parse_struct_beginning() -> Tuple[Optional[Struct], Tuple[str, str]]:
+def parse_struct_beginning() -> Tuple[Optional[Struct], Tuple[str, int]]:
     """
     Parses the name of the struct and its parent. Doesn't consume the "struct" token.
 
@@ -339,14 +347,14 @@ def parse_struct_beginning() -> Tuple[Optional[Struct], Tuple[str, str]]:
     State.check_name(name, "structure")
     if name[0].endswith(":"):
         sys.stderr.write(
-            f"\033[1;33mWarning {State.filename}:{name[1]}\033[0m: structure definition doesn't need :\n"
+            f"\033[1;33mWarning {State.format_loc(name[1])}\033[0m: structure definition doesn't need :\n"
         )
 
     return parent, name
 
 
 def parse_struct_default(
-    field_type: Any, started_proc: bool, static_started: bool, loc: str
+    field_type: Any, started_proc: bool, static_started: bool, loc: int
 ) -> Tuple[str, int]:
     """
     Parses a field of a struct, that has a default value.
@@ -355,7 +363,7 @@ def parse_struct_default(
     Returns a tuple of the name and the value. 
     """
     prev_loc = State.loc
-    State.loc = f"{State.filename}:{loc}"
+    State.loc = loc
     assert field_type == -1, "field name was not defined"
     assert not started_proc, "field defenition in the method segment"
     assert not static_started, "field defenition in the static segment"
@@ -367,7 +375,7 @@ def parse_struct_default(
 
 
 def parse_struct_proc(
-    struct: Struct, static_started: bool, current_token: Tuple[str, str]
+    struct: Struct, static_started: bool, current_token: Tuple[str, int]
 ) -> List[Op]:
     """
     Parses a procedure defined inside a struct definition.
@@ -384,7 +392,7 @@ def parse_struct_proc(
 
 
 def register_struct(
-    name: Tuple[str, str],
+    name: Tuple[str, int],
     fields: Dict[str, object],
     struct_types: List[object],
     parent: Optional[Struct],
@@ -396,6 +404,7 @@ def register_struct(
     if parent is not None:
         parent.children.append(struct)
     State.structures[name[0]] = struct
+    State.define_name(name[0], SymbolKind.STRUCT, struct)
     return struct
 
 
@@ -418,14 +427,14 @@ def parse_struct() -> List[Op]:
         try:
             current_token = next(State.tokens)
         except StopIteration:
-            State.loc = f"{State.filename}:{name[1]}"
+            State.loc = name[1]
             State.throw_error("structure definition was not closed")
         if current_token[0] == "end":
             break
         if current_token[0] == "static":
             static_started = True
             if field_type != -1:
-                State.loc = f"{State.filename}:{current_token[1]}"
+                State.loc = current_token[1]
                 State.throw_error("field name was not defined")
             continue
         if current_token[0] == "default":
@@ -440,19 +449,19 @@ def parse_struct() -> List[Op]:
             if not started_proc:
                 started_proc = True
                 if field_type != -1:
-                    State.loc = f"{State.filename}:{current_token[1]}"
+                    State.loc = current_token[1]
                     State.throw_error("field name was not defined")
 
             ops.extend(parse_struct_proc(struct, static_started, current_token))
             continue
         if field_type == -1:
             if started_proc or static_started:
-                State.loc = f"{State.filename}:{current_token[1]}"
+                State.loc = current_token[1]
                 State.throw_error("field defenition in non-field segment")
-            field_type = parse_type((current_token[0], f"{State.filename}:{current_token[1]}"), "structure definition")
+            field_type = parse_type((current_token[0], current_token[1]), "structure definition")
         else:
             if current_token[0] in struct.fields:
-                State.loc = f"{State.filename}:{current_token[1]}"
+                State.loc = current_token[1]
                 State.throw_error(
                     f'field "{current_token[0]}" is already defined in structure'
                 )
@@ -462,7 +471,7 @@ def parse_struct() -> List[Op]:
             field_type = -1
 
     if field_type != -1:
-        State.loc = f"{State.filename}:{current_token[1]}"
+        State.loc = current_token[1]
         State.throw_error("field name was not defined")
 
     return ops
@@ -540,7 +549,7 @@ def parse_var() -> Union[Op, List[Op]]:
     # TODO: this function is too long
     name = safe_next_token("Expected variable name")
     type_tok = safe_next_token("Expected variable type")
-    _type = parse_type((type_tok[0], f"{State.filename}:{type_tok[1]}"), "variable", False)
+    _type = parse_type((type_tok[0], type_tok[1]), "variable", False)
     State.check_name(name, "variable")
     mem = Memory.new_memory(name[0], sizeof(_type))
     assert not State.is_init or _type == Array(typ=Ptr()) or isinstance(_type, Struct),\
@@ -617,21 +626,21 @@ def parse_end() -> Union[List[Op], Op]:
     assert len(State.block_stack) > 0, "block for end not found"
     block = State.block_stack.pop()
     if block.binded != 0:
-        State.bind_stack = State.bind_stack[:-block.binded]
+        State.bind_stack.unbind(block.binded)
     if block.type == BlockType.BIND:
         unbinded = State.ops_by_ips[block.start].operand
         op = Op(OpType.UNBIND, unbinded)
-        State.bind_stack = State.bind_stack[:-unbinded]
+        State.bind_stack.unbind(unbinded)
     elif block.type == BlockType.PROC:
         proc = State.current_proc
         State.current_proc = None
         op = Op(OpType.ENDPROC, block)
         if proc.is_named:
-            State.bind_stack = State.bind_stack[:-len(proc.in_stack)]
+            State.bind_stack.unbind(len(proc.in_stack))
             block.end = State.get_new_ip(op)
             return [Op(OpType.UNBIND, len(proc.in_stack) + block.binded), op]
         if proc.is_self_named:
-            State.bind_stack = State.bind_stack[:-1]
+            State.bind_stack.pop()
             block.end = State.get_new_ip(op)
             return [Op(OpType.UNBIND, 1 + block.binded), op]
     elif block.type == BlockType.WHILE:
@@ -674,7 +683,7 @@ def parse_for() -> Op:
 
     itr_ops = parse_dot(itr, allow_var=True)
     for itr_op in itr_ops:
-        itr_op.loc = f"{State.filename}:{itr_loc}"
+        itr_op.loc = itr_loc
     block = Block(BlockType.FOR, -1)
     op = Op(OpType.FOR, (block, type_, itr_ops))
     block.start = State.get_new_ip(op)
@@ -767,417 +776,528 @@ def include_file() -> List[Op]:
     elif os.path.exists(std_path):
         path = std_path
     else:
-        State.loc = f"{State.filename}:{name[1]}"
+        State.loc = name[1]
         State.throw_error(f'include file "{name[0]}" not found')
 
     abs_path = os.path.abspath(path)
-    if abs_path in State.included_files:
-        return []
+    ops = [] if abs_path in State.included_files else parse_included_file(path, abs_path)
+    State.include_edges.append((State.abs_path, abs_path))
+    return ops
+
+
+def parse_included_file(path: str, abs_path: str) -> List[Op]:
+    """
+    Parses a file at the `path` for `include_file` or loads it from the include cache.
+    Returns a list of operations for the file.
+    """
+    parent_hash = State.source_hash
+    snapshot = None
+    if parent_hash is not None:
+        cache_key = include_cache.include_key(abs_path)
+        parent_hash.update(cache_key.encode())
+        if include_cache.is_cacheable():
+            entry_key = include_cache.prelude_key(abs_path) or cache_key
+            with timing.timed_pass("parse", abs_path):
+                entry = include_cache.load(entry_key)
+            if entry is not None:
+                ops, source_digest = entry
+                parent_hash.update(source_digest.encode())
+                return ops
+            snapshot = include_cache.IncludeSnapshot()
+        State.source_hash = include_cache.new_file_hash(cache_key)
 
     State.included_files.append(abs_path)
 
     orig_file, orig_abs = State.filename, State.abs_path
     State.filename, State.abs_path = os.path.basename(os.path.splitext(path)[0]), abs_path 
 
-    with open(path, "r") as f:
-        ops = parse_to_ops(f.read())
+    with open(path, "r") as f, timing.timed_pass("parse", abs_path):
+        ops = parse_to_ops(f)
 
     State.filename, State.abs_path = orig_file, orig_abs
+    if parent_hash is not None:
+        # The code after the include depends on all the files included by this one
+        source_digest = State.source_hash.hexdigest()
+        parent_hash.update(source_digest.encode())
+    State.source_hash = parent_hash
 
-    return ops
+    if snapshot is not None:
+        include_cache.store(entry_key, snapshot, ops, source_digest)
 
+    return ops
 
-def parse_token(token: str, ops: List[Op]) -> Union[Op, List[Op]]:
-    """
-    Parses a token and returns either a list of operation or an operation
-    for the token. Might modify the list of operation for the file `ops`.
-    """
-    cont_assert(len(OpType) == 40, "Unimplemented type in parse_token")
 
-    assert not State.is_unpack or token == "struct", "unpack must be followed by struct"
-    assert not State.is_init or token == "var", "init must be followed by var"
-    assert not State.is_named or token == "proc", "named must be followed by proc"
+def parse_if() -> Op:
+    """Parses an "if" token. Opens a new IF block and returns the IF operation."""
+    op = Op(OpType.IF, -1)
+    block = Block(BlockType.IF, State.get_new_ip(op))
+    op.operand = block
+    State.block_stack.append(block)
+    return op
 
-    if token in OPERATORS:
-        return Op(OpType.OPERATOR, OPERATORS[token])
 
-    elif token.startswith("syscall") and "0" <= token[7] <= "6" and len(token) == 8:
-        return Op(OpType.SYSCALL, int(token[7]))
+def parse_else() -> Union[Op, List[Op]]:
+    """
+    Parses an "else" token. Replaces the IF block with an ELSE block.
+    Returns a list of operations or an operation for the token.
+    """
+    assert len(State.block_stack) > 0, "if for else not found"
 
-    elif token.isnumeric():
-        return Op(OpType.PUSH_INT, int(token) % 2**64)
+    block = State.block_stack.pop()
 
-    elif token.startswith("-") and token[1:].isnumeric():
-        return Op(OpType.PUSH_INT, 0x10000000000000000 - int(token[1:]))
+    assert block.type == BlockType.IF, "else without if"
 
-    elif token.startswith("0x") and State.is_hex(token[2:]):
-        return Op(OpType.PUSH_INT, int(token[2:], 16))
+    new_block = Block(BlockType.ELSE, block.end)
+    State.block_stack.append(new_block)
 
-    elif token.startswith("0b") and State.is_bin(token[2:]):
-        return Op(OpType.PUSH_INT, int(token[2:], 2))
+    op = Op(OpType.ELSE, new_block)
+    block.end = State.get_new_ip(op)
+    new_block.start = block.end
+    if block.binded != 0:
+        State.bind_stack.unbind(block.binded)
+        return [Op(OpType.UNBIND, block.binded), op]
+    else:
+        return op
 
-    elif token.startswith("0o") and State.is_oct(token[2:]):
-        return Op(OpType.PUSH_INT, int(token[2:], 8))
 
-    elif (token.startswith('"') or token.startswith('n"')) and token.endswith('"'):
-        string = bytes(
-            token[1 + token.startswith('n"'):-1], "raw_unicode_escape"
-        ).decode("unicode_escape")
-        State.string_data.append(bytes(string, "utf-8"))
-        optype = OpType.PUSH_NULL_STR if token.startswith('n"') else OpType.PUSH_STR
-        if token.startswith('n"'):
-            State.string_data[-1] += bytes("\0", "utf-8")
-        return Op(optype, len(State.string_data) - 1)
+def parse_compile_if():
+    """Parses an "#if" token, the condition is evaluated at compile time."""
+    cond = evaluate_block(State.loc, "#if condition")
+    State.compile_ifs_opened += 1
+    State.false_compile_ifs += bool(State.false_compile_ifs) or not cond
 
-    elif token.startswith("'") and token.endswith("'") and len(token) == 3:
-        return Op(OpType.PUSH_INT, ord(token[1]))
 
-    elif token == "if":
-        op = Op(OpType.IF, -1)
-        block = Block(BlockType.IF, State.get_new_ip(op))
-        op.operand = block
-        State.block_stack.append(block)
-        return op
+def parse_compile_else():
+    """Parses an "#else" token."""
+    assert State.compile_ifs_opened, "#else without #if"
+    if State.false_compile_ifs < 2:
+        State.false_compile_ifs = int(not State.false_compile_ifs)
 
-    elif token == "end":
-        return parse_end()
 
-    elif token == "else":
-        assert len(State.block_stack) > 0, "if for else not found"
+def parse_compile_endif():
+    """Parses an "#endif" token."""
+    assert State.compile_ifs_opened != 0, "#endif without #if"
+    State.compile_ifs_opened -= 1
+    State.false_compile_ifs -= bool(State.false_compile_ifs)
 
-        block = State.block_stack.pop()
 
-        assert block.type == BlockType.IF, "else without if"
+def parse_while() -> Op:
+    """Parses a "while" token. Opens a new WHILE block and returns the WHILE operation."""
+    block = Block(BlockType.WHILE, -1)
+    op = Op(OpType.WHILE, block)
+    block.start = State.get_new_ip(op)
+    State.block_stack.append(block)
+    State.do_stack.append([])
+    return op
 
-        new_block = Block(BlockType.ELSE, block.end)
-        State.block_stack.append(new_block)
 
-        op = Op(OpType.ELSE, new_block)
-        block.end = State.get_new_ip(op)
-        new_block.start = block.end
-        if block.binded != 0:
-            State.bind_stack = State.bind_stack[:-block.binded]
-            return [Op(OpType.UNBIND, block.binded), op]
-        else:
-            return op
-
-    elif token == "#if":
-        cond = evaluate_block(State.loc, "#if condition")
-        State.compile_ifs_opened += 1
-        State.false_compile_ifs += bool(State.false_compile_ifs) or not cond
-
-    elif token == "#else":
-        assert State.compile_ifs_opened, "#else without #if"
-        if State.false_compile_ifs < 2:
-            State.false_compile_ifs = int(not State.false_compile_ifs)
-
-    elif token == "#endif":
-        assert State.compile_ifs_opened != 0, "#endif without #if"
-        State.compile_ifs_opened -= 1
-        State.false_compile_ifs -= bool(State.false_compile_ifs)
-
-    elif token == "while":
-        block = Block(BlockType.WHILE, -1)
-        op = Op(OpType.WHILE, block)
-        block.start = State.get_new_ip(op)
-        State.block_stack.append(block)
-        State.do_stack.append([])
-        return op
+def parse_memory():
+    """Parses a memory definition. Does not consume the "memory" token."""
+    name = next(State.tokens)
+    size = next(State.tokens)
+    if not size[0].isnumeric() and size[0] not in State.constants:
+        State.loc = size[1]
+        State.throw_error(f'constant "{size[0]}" was not found')
+    State.check_name(name, "memory")
+    if size[0].isnumeric():
+        Memory.new_memory(name[0], int(size[0]))
+    else:
+        Memory.new_memory(name[0], State.constants[size[0]])
 
-    elif token == "for":
-        return parse_for()
 
-    elif token == "do":
-        return parse_do(ops)
+def parse_memo():
+    """Parses a memory definition with a compile time evaluated size. Does not consume the "memo" token."""
+    name = next(State.tokens)
+    State.check_name(name, "memory")
+    size = evaluate_block(State.loc, "memo")
+    Memory.new_memory(name[0], size)
 
-    elif token == "memory":
-        name = next(State.tokens)
-        size = next(State.tokens)
-        if not size[0].isnumeric() and size[0] not in State.constants:
-            State.loc = size[1]
-            State.throw_error(f'constant "{size[0]}" was not found')
-        State.check_name(name, "memory")
-        if size[0].isnumeric():
-            Memory.new_memory(name[0], int(size[0]))
-        else:
-            Memory.new_memory(name[0], State.constants[size[0]])
 
-    elif token == "var":
-        return parse_var()
+def parse_const():
+    """Parses a constant definition. Does not consume the "const" token."""
+    name = next(State.tokens)
+    State.check_name(name, "constant")
+    State.constants[name[0]] = evaluate_block(State.loc, "const")
+    State.define_name(name[0], SymbolKind.CONSTANT, State.constants[name[0]])
 
-    elif token == "memo":
-        name = next(State.tokens)
-        State.check_name(name, "memory")
-        size = evaluate_block(State.loc, "memo")
-        Memory.new_memory(name[0], size)
 
-    elif token == "const":
-        name = next(State.tokens)
-        State.check_name(name, "constant")
-        State.constants[name[0]] = evaluate_block(State.loc, "const")
-
-    elif token == "sizeoftype":
-        type_tok = safe_next_token("Expected type to get a size of")
-        _type = parse_type((type_tok[0], f"{State.filename}:{type_tok[1]}"), "size", False)
-        return Op(OpType.PUSH_INT, sizeof(_type))
-
-    elif token == "bind":
-        return parse_bind()
-    elif token == "let":
-        return parse_bind(end_char=";", unbind_on_block=True)
-    elif token == "proc":
-        return parse_proc_head()
-    elif token == "nproc":
-        State.is_named = True
-        return parse_proc_head()
-    elif token == "sproc":
-        assert not State.is_named, "Procedure cannot be named and self-named at the same time"
-        return parse_proc_head(self_named=True)
-
-    # prefix tokens
-    elif token == "unpack":
-        State.is_unpack = True
-    elif token == "init":
-        State.is_init = True
-    elif token == "named":
-        State.is_named = True
-
-    elif token == "struct":
-        return parse_struct()
-
-    elif token == "enum":
-        name = next(State.tokens)
-        State.check_name(name, "enum")
-        values: List[str] = []
-        while True:
-            current_token = next(State.tokens)
-            if current_token[0] == "end":
-                break
-            if current_token[0] in values:
-                State.loc = f"{State.filename}:{current_token[1]}"
-                State.throw_error(f'enum value "{current_token[0]}" is already defined')
-            values.append(current_token[0])
-
-        State.enums[name[0]] = values
-        if name[0] == "Platform":
-            assert "platform" not in State.constants, "Defined enum Platform and constant platform is already defined"
-            assert State.config.target in values, "Enum Platform does not have a current platform defined"
-            State.constants["platform"] = values.index(State.config.target)
-
-    elif token == "asm":
-        asm = safe_next_token()[0]
-        assert asm.startswith('"') and asm.endswith('"'), "asm must be followed by a string"
-
-        return Op(OpType.ASM, asm[1:-1])
-
-    elif token == "type":
-        type_tok = safe_next_token("Expected a type")
-        typ = parse_type((type_tok[0], f"{State.filename}:{type_tok[1]}"), "type")
-        if typ not in State.runtimed_types_set:
-            State.runtimed_types_set.add(typ)
-            State.runtimed_types_list.append(typ)
-        return Op(OpType.PUSH_TYPE, typ, token[1])
-
-    elif token == "include":
-        return include_file()
-
-    elif token == "call":
-        return Op(OpType.CALL_ADDR, None)
-
-    elif token == "#import":
-        assert State.config.target == "wat64", "Current target does not support imports"
-        
-        name, name_loc = safe_next_token("Expected a function name")
-        path, _ = safe_next_token("Expected a path")
-        State.check_name((name, name_loc))
-        if ";" not in name:
-            in_types, out_types, _ = parse_signature((name, name_loc), {}, ";")
-        else:
-            in_types, out_types = [], []
+def parse_sizeoftype() -> Op:
+    """Parses a "sizeoftype" token and the type after it. Returns a PUSH_INT operation."""
+    type_tok = safe_next_token("Expected type to get a size of")
+    _type = parse_type((type_tok[0], type_tok[1]), "size", False)
+    return Op(OpType.PUSH_INT, sizeof(_type))
 
-            parts = name.split(";")
-            name = parts[0]
-            queued_token = (parts[1].strip(), name_loc)
-            if queued_token[0]:
-                State.tokens_queue.append(queued_token)
-        proc = Proc.create_imported(name, in_types, out_types)
-        State.procs[name] = proc
-        State.imported_procs.append((name, path))
 
-    elif token == "#export":
-        assert State.config.target == "wat64", "Current target does not support exports"
-        name = safe_next_token("Expected a procedure name")[0]
-        assert name in State.procs, f'Procedure "{name}" not found'
-        State.used_procs.add(State.procs[name])
-        State.procs[name].is_exported = True
+def parse_unpack():
+    """Parses an "unpack" prefix token."""
+    State.is_unpack = True
 
-    elif token == "[]":
-        return Op(OpType.INDEX)
 
-    elif token == "*[]":
-        return Op(OpType.INDEX_PTR)
+def parse_init():
+    """Parses an "init" prefix token."""
+    State.is_init = True
 
-    # Checks for token starting with sizeof and ending with any number of @
-    elif token.startswith("sizeof") and all([i == "@" for i in token[6:]]):
-        return Op(OpType.SIZEOF, len(token) - 6)
 
-    elif token in State.bind_stack:
-        index = len(State.bind_stack) - State.bind_stack[::-1].index(token) - 1 # Search from the right
-        return Op(OpType.PUSH_BIND_STACK, (index, token))
+def parse_named():
+    """Parses a "named" prefix token."""
+    State.is_named = True
 
-    elif token == "base":
-        assert "self" in State.bind_stack, "You must have a binded value self to use base"
-        return Op(OpType.PUSH_BIND_STACK, (State.bind_stack.index("self"), "base"))
 
-    elif token in getattr(State.current_proc, "variables", {}):
-        return Op(OpType.PUSH_LOCAL_VAR, token)
+def parse_named_proc() -> List[Op]:
+    """Parses a named procedure. Does not consume the "nproc" token."""
+    State.is_named = True
+    return parse_proc_head()
 
-    elif token.startswith("*") and token[1:] in getattr(
-        State.current_proc, "variables", {}
-    ):
-        return Op(OpType.PUSH_LOCAL_VAR_PTR, token[1:])
 
-    elif (
-        token in getattr(State.current_proc, "memories", {}) and\
-        State.current_proc is not None
-    ):
-        return Op(OpType.PUSH_LOCAL_MEM, State.current_proc.memories[token].offset)
+def parse_enum():
+    """Parses an enum definition and defines the enum. Does not consume the "enum" token."""
+    name = next(State.tokens)
+    State.check_name(name, "enum")
+    values: List[str] = []
+    while True:
+        current_token = next(State.tokens)
+        if current_token[0] == "end":
+            break
+        if current_token[0] in values:
+            State.loc = current_token[1]
+            State.throw_error(f'enum value "{current_token[0]}" is already defined')
+        values.append(current_token[0])
+
+    State.enums[name[0]] = values
+    State.define_name(name[0], SymbolKind.ENUM, values)
+    if name[0] == "Platform":
+        assert "platform" not in State.constants, "Defined enum Platform and constant platform is already defined"
+        assert State.config.target in values, "Enum Platform does not have a current platform defined"
+        State.constants["platform"] = values.index(State.config.target)
+        State.define_name("platform", SymbolKind.CONSTANT, State.constants["platform"])
+
+
+def parse_asm() -> Op:
+    """Parses an inline assembly. Does not consume the "asm" token. Returns an ASM operation."""
+    asm = safe_next_token()[0]
+    assert asm.startswith('"') and asm.endswith('"'), "asm must be followed by a string"
+
+    return Op(OpType.ASM, asm[1:-1])
+
+
+def parse_push_type() -> Op:
+    """Parses a "type" token and the type after it. Returns a PUSH_TYPE operation."""
+    type_tok = safe_next_token("Expected a type")
+    typ = parse_type((type_tok[0], type_tok[1]), "type")
+    if typ not in State.runtimed_types_set:
+        State.runtimed_types_set.add(typ)
+        State.runtimed_types_list.append(typ)
+    return Op(OpType.PUSH_TYPE, typ)
+
+
+def parse_import():
+    """Parses an import of a procedure from the host. Does not consume the "#import" token."""
+    assert State.config.target == "wat64", "Current target does not support imports"
+
+    name, name_loc = safe_next_token("Expected a function name")
+    path, _ = safe_next_token("Expected a path")
+    State.check_name((name, name_loc))
+    if ";" not in name:
+        in_types, out_types, _ = parse_signature((name, name_loc), {}, ";")
+    else:
+        in_types, out_types = [], []
 
-    elif token in State.variables:
-        return Op(OpType.PUSH_VAR, token)
+        parts = name.split(";")
+        name = parts[0]
+        queued_token = (parts[1].strip(), name_loc)
+        if queued_token[0]:
+            State.tokens_queue.append(queued_token)
+    proc = Proc.create_imported(name, in_types, out_types)
+    State.procs[name] = proc
+    State.define_name(name, SymbolKind.PROC, proc)
+    State.imported_procs.append((name, path))
+
+
+def parse_export():
+    """Parses an export of a procedure to the host. Does not consume the "#export" token."""
+    assert State.config.target == "wat64", "Current target does not support exports"
+    name = safe_next_token("Expected a procedure name")[0]
+    assert name in State.procs, f'Procedure "{name}" not found'
+    State.used_procs.add(State.procs[name])
+    State.procs[name].is_exported = True
+
+
+ParseResult = Union[Op, List[Op], None]
+
+# The kinds of names, which can have their fields accessed with a dot
+VARIABLE_SYMBOL_KINDS = (SymbolKind.BINDING, SymbolKind.LOCAL_VARIABLE, SymbolKind.VARIABLE)
+
+# Maps every token with a fixed meaning to the function, which parses it.
+# The functions take the list of operations of the file, only "do" needs it.
+TOKEN_PARSERS: Dict[str, Callable[[List[Op]], ParseResult]] = {
+    **{
+        token: (lambda ops, operator=operator: Op(OpType.OPERATOR, operator))
+        for token, operator in OPERATORS.items()
+    },
+    **{
+        f"syscall{i}": (lambda ops, i=i: Op(OpType.SYSCALL, i)) for i in range(7)
+    },
+    "if" : lambda ops: parse_if(),
+    "end" : lambda ops: parse_end(),
+    "else" : lambda ops: parse_else(),
+    "#if" : lambda ops: parse_compile_if(),
+    "#else" : lambda ops: parse_compile_else(),
+    "#endif" : lambda ops: parse_compile_endif(),
+    "while" : lambda ops: parse_while(),
+    "for" : lambda ops: parse_for(),
+    "do" : parse_do,
+    "memory" : lambda ops: parse_memory(),
+    "var" : lambda ops: parse_var(),
+    "memo" : lambda ops: parse_memo(),
+    "const" : lambda ops: parse_const(),
+    "sizeoftype" : lambda ops: parse_sizeoftype(),
+    "bind" : lambda ops: parse_bind(),
+    "let" : lambda ops: parse_bind(end_char=";", unbind_on_block=True),
+    "proc" : lambda ops: parse_proc_head(),
+    "nproc" : lambda ops: parse_named_proc(),
+    "sproc" : lambda ops: parse_proc_head(self_named=True),
+    "unpack" : lambda ops: parse_unpack(),
+    "init" : lambda ops: parse_init(),
+    "named" : lambda ops: parse_named(),
+    "struct" : lambda ops: parse_struct(),
+    "enum" : lambda ops: parse_enum(),
+    "asm" : lambda ops: parse_asm(),
+    "type" : lambda ops: parse_push_type(),
+    "include" : lambda ops: include_file(),
+    "call" : lambda ops: Op(OpType.CALL_ADDR, None),
+    "#import" : lambda ops: parse_import(),
+    "#export" : lambda ops: parse_export(),
+    "[]" : lambda ops: Op(OpType.INDEX),
+    "*[]" : lambda ops: Op(OpType.INDEX_PTR),
+}
 
-    elif token.startswith("*") and token[1:] in State.variables:
-        return Op(OpType.PUSH_VAR_PTR, token[1:])
 
-    elif token in State.memories:
-        return Op(OpType.PUSH_MEMORY, State.memories[token].offset)
+def parse_literal(token: str) -> Optional[Op]:
+    """
+    Parses a token if it is an integer, a string or a character literal.
+    Returns the operation for the literal or None if the token is not a literal.
+    """
+    first = token[0]
+    if "0" <= first <= "9":
+        if token.isnumeric():
+            return Op(OpType.PUSH_INT, int(token) % 2**64)
+        prefix = token[:2]
+        if prefix == "0x" and State.is_hex(token[2:]):
+            return Op(OpType.PUSH_INT, int(token[2:], 16))
+        if prefix == "0b" and State.is_bin(token[2:]):
+            return Op(OpType.PUSH_INT, int(token[2:], 2))
+        if prefix == "0o" and State.is_oct(token[2:]):
+            return Op(OpType.PUSH_INT, int(token[2:], 8))
+    elif first == "-":
+        if token[1:].isnumeric():
+            return Op(OpType.PUSH_INT, 0x10000000000000000 - int(token[1:]))
+    elif (first == '"' or token.startswith('n"')) and token.endswith('"'):
+        is_null_terminated = first == "n"
+        string = bytes(
+            token[1 + is_null_terminated:-1], "raw_unicode_escape"
+        ).decode("unicode_escape")
+        State.string_data.append(bytes(string, "utf-8"))
+        if is_null_terminated:
+            State.string_data[-1] += bytes("\0", "utf-8")
+        return Op(
+            OpType.PUSH_NULL_STR if is_null_terminated else OpType.PUSH_STR,
+            len(State.string_data) - 1
+        )
+    elif first == "'" and token.endswith("'") and len(token) == 3:
+        return Op(OpType.PUSH_INT, ord(token[1]))
+    return None
 
-    elif token in State.structures:
-        return Op(OpType.PACK, (token, True))
 
-    elif token in State.procs:
-        State.add_proc_use(State.procs[token])
-        return Op(OpType.CALL, State.procs[token])
+def parse_name(token: str) -> Union[Op, List[Op]]:
+    """
+    Parses a token, which is a name defined in the program, possibly
+    with prefixes or field accesses e. g. "*var" or "bind.field".
+    Returns a list of operation or an operation for the token.
+    """
+    # Checks for token starting with sizeof and ending with any number of @
+    if token.startswith("sizeof") and all([i == "@" for i in token[6:]]):
+        return Op(OpType.SIZEOF, len(token) - 6)
 
-    elif token in State.constants:
-        return Op(OpType.PUSH_INT, State.constants[token])
+    symbol = State.resolve_name(token)
+    if symbol is not None:
+        kind, value = symbol
+        if kind == SymbolKind.BINDING:
+            return Op(OpType.PUSH_BIND_STACK, (value, token))
+        elif token == "base":
+            pass
+        elif kind == SymbolKind.LOCAL_VARIABLE:
+            return Op(OpType.PUSH_LOCAL_VAR, token)
+        elif kind == SymbolKind.LOCAL_MEMORY:
+            return Op(OpType.PUSH_LOCAL_MEM, value.offset)
+        elif kind == SymbolKind.VARIABLE:
+            return Op(OpType.PUSH_VAR, token)
+        elif kind == SymbolKind.MEMORY:
+            return Op(OpType.PUSH_MEMORY, value.offset)
+        elif kind == SymbolKind.STRUCT:
+            return Op(OpType.PACK, (token, True))
+        elif kind == SymbolKind.PROC:
+            State.add_proc_use(value)
+            return Op(OpType.CALL, value)
+        elif kind == SymbolKind.CONSTANT:
+            return Op(OpType.PUSH_INT, value)
+
+    if token == "base":
+        assert "self" in State.bind_stack, "You must have a binded value self to use base"
+        return Op(OpType.PUSH_BIND_STACK, (State.bind_stack.index("self"), "base"))
 
-    elif token.startswith("(") and token.endswith(")"):
+    first = token[0]
+    head = token.split(".", 1)[0]
+    if first == "*":
+        local_variables = getattr(State.current_proc, "variables", {})
+        if token[1:] in local_variables:
+            return Op(OpType.PUSH_LOCAL_VAR_PTR, token[1:])
+        if token[1:] in State.variables:
+            return Op(OpType.PUSH_VAR_PTR, token[1:])
+        if token[1:] in State.procs:
+            proc = State.procs[token[1:]]
+            State.add_proc_use(proc)
+            State.referenced_procs.add(proc)
+            return Op(OpType.PUSH_PROC, proc)
+        pointed = State.resolve_name(head[1:])
+        if pointed is not None and pointed[0] in VARIABLE_SYMBOL_KINDS:
+            return parse_dot(token[1:], True, True)
+    elif first == "(" and token.endswith(")"):
         return Op(OpType.CAST, parse_type((token[1:-1], State.loc), "cast"))
-
-    elif token.startswith("upcast(") and token.endswith(")"):
-        return Op(OpType.UPCAST, parse_type((token[7:-1], State.loc), "upcast", False))
-
-    elif token.startswith(".*"):
-        return parse_dot(token[2:], auto_ptr=True)
-
-    elif token.startswith("."):
+    elif first == ".":
+        if token.startswith(".*"):
+            return parse_dot(token[2:], auto_ptr=True)
         return parse_dot(token[1:])
-
-    elif token.startswith("@"):
+    elif first == "@":
         _type = parse_type((token[1:], State.loc), "load type")
         return Op(OpType.TYPED_LOAD, _type)
-
-    elif token.startswith("!."):
-        return [
-            *parse_dot(token[2:], auto_ptr=True),
-            Op(OpType.OPERATOR, Operator.STORE, State.loc),
-        ]
-
-    elif token.startswith("!"):
+    elif first == "!":
+        if token.startswith("!."):
+            return [
+                *parse_dot(token[2:], auto_ptr=True),
+                Op(OpType.OPERATOR, Operator.STORE, State.loc),
+            ]
         return [
             *parse_dot(token[1:], allow_var=True, auto_ptr=True),
             Op(OpType.OPERATOR, Operator.STORE, State.loc),
         ]
+    elif token.startswith("upcast(") and token.endswith(")"):
+        return Op(OpType.UPCAST, parse_type((token[7:-1], State.loc), "upcast", False))
 
-    elif token.startswith("*") and token[1:] in State.procs:
-        proc = State.procs[token[1:]]
-        State.add_proc_use(proc)
-        State.referenced_procs.add(proc)
-        return Op(OpType.PUSH_PROC, proc)
-
-    elif (
-        token.split(".", 1)[0][1:] in State.bind_stack or\
-        token.split(".", 1)[0][1:] in State.variables or\
-        token.split(".", 1)[0][1:] in getattr(State.current_proc, "variables", {}) and\
-        token.split(".", 1)[0].startswith("*")
-    ):
-        return parse_dot(token[1:], True, True)
-
-    elif (
-        token.split(".", 1)[0] == "base" or\
-        token.split(".", 1)[0] in State.bind_stack or\
-        token.split(".", 1)[0] in State.variables or\
-        token.split(".", 1)[0] in getattr(State.current_proc, "variables", {})
-    ):
+    head_symbol = State.resolve_name(head)
+    head_kind = head_symbol[0] if head_symbol is not None else None
+    if head == "base" or head_kind in VARIABLE_SYMBOL_KINDS:
         return parse_dot(token, True)
-
-    elif token.split(".", 1)[0] in State.enums:
+    elif head_kind == SymbolKind.ENUM:
         parts = token.split(".", 1)
-        assert parts[1] in State.enums[parts[0]], f'enum value "{parts[1]}" is not defined'
-        return Op(OpType.PUSH_INT, State.enums[parts[0]].index(parts[1]))
-
-    elif token.split(".", 1)[0] in State.structures:
+        assert parts[1] in head_symbol[1], f'enum value "{parts[1]}" is not defined'
+        return Op(OpType.PUSH_INT, head_symbol[1].index(parts[1]))
+    elif head_kind == SymbolKind.STRUCT:
         parts = token.split(".", 1)
-        assert parts[1] in State.structures[parts[0]].static_methods,\
+        assert parts[1] in head_symbol[1].static_methods,\
             f'static method "{parts[1]}" was not found'
-        State.add_proc_use(State.structures[parts[0]].static_methods[parts[1]])
-        return Op(OpType.CALL, State.structures[parts[0]].static_methods[parts[1]])
-    else:
-        State.throw_error(f"unknown token: {token}")
-    return []
+        State.add_proc_use(head_symbol[1].static_methods[parts[1]])
+        return Op(OpType.CALL, head_symbol[1].static_methods[parts[1]])
+
+    State.throw_error(f"unknown token: {token}")
 
 
-def delete_comments(program: str) -> str:
+def parse_token(token: str, ops: List[Op]) -> Union[Op, List[Op]]:
     """
-    Takes a program as a source code string and returns
-    the same program without all the comments. 
+    Parses a token and returns either a list of operation or an operation
+    for the token. Might modify the list of operation for the file `ops`.
+
+    Tokens with a fixed meaning are dispatched with `TOKEN_PARSERS`, then
+    literals are checked and everything else is resolved as a name.
     """
-    while True:
-        index = program.find("//")
-        if index == -1:
-            break
-        end_comm = program.find("\n", index)
-        program = (
-            program[:index] + program[end_comm if end_comm != -1 else len(program):]
-        )
-    return program
+    cont_assert(len(OpType) == 40, "Unimplemented type in parse_token")
+
+    assert not State.is_unpack or token == "struct", "unpack must be followed by struct"
+    assert not State.is_init or token == "var", "init must be followed by var"
+    assert not State.is_named or token == "proc", "named must be followed by proc"
 
+    parser = TOKEN_PARSERS.get(token)
+    if parser is not None:
+        op = parser(ops)
+        return [] if op is None else op
 
-def tokens(program: str) -> Generator[Tuple[str, str], None, None]:
+    literal = parse_literal(token)
+    if literal is not None:
+        return literal
+
+    return parse_name(token)
+
+
+def tokens(source: Union[str, Iterable[str]], file_id: int = 0) -> Generator[Tuple[str, int], None, None]:
     """
     An iterator, that yields tokens of the program as a
-    tuple of the token value and their location in the format of
-    "{row}:{column}".
+    tuple of the token value and their location packed with
+    the `file_id`, the row and the column (see `State.format_loc`).
+
+    The program is lexed in a single pass, which skips the comments and
+    handles the strings with their escapes. `source` is either a source code string
+    or an iterable of lines e. g. an opened file, which will be read lazily.
+    Tokens in `State.tokens_queue` are yielded before the rest of the program.
     """
+    queue = State.tokens_queue
+    lines = source.split("\n") if isinstance(source, str) else source
     token = ""
     is_string = False
     is_escaped = False
-    for i, line in enumerate(delete_comments(program).split("\n")):
-        for j, char in enumerate(line):
-            if State.tokens_queue:
-                yield State.tokens_queue.pop(0)
-            if (char.isspace()) and not is_string:
-                if token != "":
-                    yield (token, f"{i+1}:{j+1}")
+    file_loc = file_id << 2 * LOC_BITS
+    for row, line in enumerate(lines, 1):
+        if line.endswith("\n"):
+            line = line[:-1]
+        # Bigger lines and columns would overflow into the other parts of the packed locations
+        if row > LOC_MASK or len(line) > LOC_MASK:
+            State.loc = file_loc | min(row, LOC_MASK) << LOC_BITS
+            State.throw_error(f"files can't have more than {LOC_MASK} lines or characters in a line")
+        row_loc = file_loc | row << LOC_BITS
+        pos = 0
+        end = len(line)
+        while pos < end:
+            while queue:
+                yield queue.popleft()
+            if is_string:
+                if is_escaped:
+                    is_escaped = False
+                    token += line[pos]
+                    pos += 1
+                    continue
+                match = STRING_PART_RE.match(line, pos)
+                token += match.group()
+                pos = match.end()
+                if pos == end:
+                    break
+                token += line[pos]
+                if line[pos] == "\\":
+                    is_escaped = True
+                else:
+                    is_string = False
+                    yield (token, row_loc | pos + 1)
                     token = ""
-            elif char == '"' and not is_escaped:
-                is_string = not is_string
-                token += char
-                if not is_string:
-                    yield (token, f"{i+1}:{j+1}")
-                    token = ""
-            elif char == "\\" and is_string and not is_escaped:
-                is_escaped = True
-                token += char
-            elif is_string:
-                is_escaped = False
-                token += char
+                pos += 1
+            elif line[pos] == '"':
+                is_string = True
+                token += '"'
+                pos += 1
+            elif line.startswith("//", pos):
+                end = pos
             else:
-                token += char
+                match = WHITESPACE_RE.match(line, pos)
+                if match is not None:
+                    if token != "":
+                        yield (token, row_loc | pos + 1)
+                        token = ""
+                    pos = match.end()
+                else:
+                    match = WORD_PART_RE.match(line, pos)
+                    token += match.group()
+                    pos = match.end()
         if token != "":
-            yield (token, f"{i+1}:{j+1}")
+            yield (token, row_loc | end)
             token = ""
+    while queue:
+        yield queue.popleft()
 
 
 def parse_until_end() -> List[Op]:
@@ -1196,16 +1316,16 @@ def parse_until_end() -> List[Op]:
             continue
         if token == "end" and len(State.block_stack) - 1 == initial_blocks:
             end = True
-        State.loc = f"{State.filename}:{loc}"
+        State.loc = loc
         op = parse_token(token, ops)
 
         if isinstance(op, list):
             for oper in op:
-                if oper.loc == "":
-                    oper.loc = f"{State.filename}:{loc}" 
+                if oper.loc == NO_LOC:
+                    oper.loc = loc 
             ops.extend(op)
         elif op is not None:
-            op.loc = f"{State.filename}:{loc}"
+            op.loc = loc
             ops.append(op)
 
         if end:
@@ -1216,10 +1336,12 @@ def parse_until_end() -> List[Op]:
     return ops
 
 
-def parse_to_ops(program: str, dump_tokens: bool = False, is_main: int = False) -> List[Op]:
+def parse_to_ops(
+    program: Union[str, Iterable[str]], dump_tokens: bool = False, is_main: int = False
+) -> List[Op]:
     """
-    Parses a program from a raw source code string into a
-    list of operations. The function should be called exactly one
+    Parses a program from a raw source code string or an iterable
+    of its lines e. g. an opened file into a list of operations. The function should be called exactly one
     time with `is_main` set to True for each compilation.
     
     If `dump_tokens` is set the function will print all the tokens
@@ -1228,7 +1350,13 @@ def parse_to_ops(program: str, dump_tokens: bool = False, is_main: int = False)
     Returns a list of operations for the program.
     """
     saver = StateSaver()
-    State.tokens = tokens(program)
+    if is_main:
+        State.source_hash = include_cache.new_main_hash()
+    if State.source_hash is not None:
+        program = include_cache.hashed_lines(program, State.source_hash)
+    State.tokens = timing.timed_iter(
+        tokens(program, State.add_file(State.filename)), "tokenize", State.abs_path
+    )
     ops: List[Op] = []
 
     if dump_tokens:
@@ -1238,15 +1366,15 @@ def parse_to_ops(program: str, dump_tokens: bool = False, is_main: int = False)
     for token, loc in State.tokens:
         if State.false_compile_ifs and token not in ("#if", "#else", "#endif"):
             continue
-        State.loc = f"{State.filename}:{loc}"
+        State.loc = loc
         op = parse_token(token, ops)
         if isinstance(op, list):
             for locating_op in op:
-                if locating_op.loc == "":
-                    locating_op.loc = f"{State.filename}:{loc}"
+                if locating_op.loc == NO_LOC:
+                    locating_op.loc = loc
             ops.extend(op)
             continue
-        op.loc = f"{State.filename}:{loc}"
+        op.loc = loc
         ops.append(op)
 
     if State.block_stack:
@@ -1256,7 +1384,9 @@ def parse_to_ops(program: str, dump_tokens: bool = False, is_main: int = False)
 
     saver.load()
 
-    if is_main and State.global_binded:
+    if is_main:
+        # The type checker uses the bind stack for the types of the bound values
         State.bind_stack = []
-        ops.append(Op(OpType.UNBIND, State.global_binded))
+        if State.global_binded:
+            ops.append(Op(OpType.UNBIND, State.global_binded))
     return ops
@@ -1,11 +1,11 @@
 import sys
 
 from dataclasses import dataclass
-from typing import List, Tuple, Dict, Set, Optional, Any, Generator
+from typing import List, Tuple, Dict, Set, Optional, Any, Generator, Deque, Iterable
+from collections import deque
 from enum import Enum, auto
-from functools import reduce
 
-from parsing.op import Op
+from parsing.op import Op, LOC_BITS, LOC_MASK, NO_LOC
 
 
 class InternalAssertionError(Exception):
@@ -27,6 +27,19 @@ class BlockType(Enum):
     BIND = auto()
 
 
+class SymbolKind(Enum):
+    """The kind of a name, that was resolved with `State.resolve_name`"""
+    BINDING = auto()
+    LOCAL_VARIABLE = auto()
+    LOCAL_MEMORY = auto()
+    VARIABLE = auto()
+    MEMORY = auto()
+    STRUCT = auto()
+    PROC = auto()
+    CONSTANT = auto()
+    ENUM = auto()
+
+
 @dataclass
 class Block:
     """A block in code, which should be used for all the blocks in the `BlockType` enum."""
@@ -36,6 +49,57 @@ class Block:
     stack_effect: Optional[Tuple[int, int]] = None
     binded: int = 0
 
+
+class BindStack:
+    """
+    The names of the bound values while parsing in the order they were bound.
+    Every name is mapped to the positions it's bound at, so a name can be found
+    without searching through the stack.
+    """
+    def __init__(self):
+        self.names: List[str] = []
+        self.slots: Dict[str, List[int]] = {}
+
+    def append(self, name: str):
+        self.slots.setdefault(name, []).append(len(self.names))
+        self.names.append(name)
+
+    def extend(self, names: Iterable[str]):
+        for name in names:
+            self.append(name)
+
+    def pop(self) -> str:
+        """Unbinds the last bound name and returns it"""
+        name = self.names.pop()
+        slots = self.slots[name]
+        slots.pop()
+        if not slots:
+            del self.slots[name]
+        return name
+
+    def unbind(self, count: int):
+        """Unbinds the last `count` names"""
+        for _ in range(count):
+            self.pop()
+
+    def index(self, name: str) -> int:
+        """Returns the position of the first binding with the `name`"""
+        return self.slots[name][0]
+
+    def last_index(self, name: str) -> int:
+        """Returns the position of the last binding with the `name`, which shadows the others"""
+        return self.slots[name][-1]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.slots
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index):
+        return self.names[index]
+
+
 @dataclass
 class Memory:
     """A memory defined with `memo` or `memory` keyword"""
@@ -54,6 +118,7 @@ class Memory:
             mem = Memory(name, Memory.global_offset)
             Memory.global_offset += size + (8 - size % 8 if size % 8 != 0 else 0)
             State.memories[name] = mem
+            State.define_name(name, SymbolKind.MEMORY, mem)
         else:
             mem = Memory(name, State.current_proc.memory_size)
             State.current_proc.memory_size += size + (
@@ -154,10 +219,17 @@ class State:
         cls.config: Any = None
 
         cls.block_stack: List[Block] = []
-        cls.route_stack: List[Tuple[str, List["Type"]]] = []  # type: ignore
-        cls.bind_stack: list = []
+        cls.route_stack: List[Tuple[str, "TypeStack"]] = []  # type: ignore
+        # Holds a `BindStack` while parsing and the types of the bound values while type checking
+        cls.bind_stack: Any = BindStack()
+        # The prepared contracts of the called procedures, which are used while type checking
+        cls.call_signatures: Dict[Proc, Any] = {}
         cls.do_stack: List[List[Op]] = []
         cls.bind_stack_size: int = 0
+        # The comparison, which code is generated with the operation after it, so a branch can use its flags
+        cls.pending_comparison: Optional[Op] = None
+        # The registers with the values from the top of the stack, which aren't pushed yet, the topmost is the last
+        cls.cached_registers: List[str] = []
         cls.compile_ifs_opened: int = 0
         cls.false_compile_ifs: int = 0
         # This is used for the let keyowrd to unbind in the end, becuase main can be called multiple times on wat64
@@ -171,19 +243,25 @@ class State:
         cls.structures: Dict[str, "Struct"] = {}  # type: ignore
         cls.constants: Dict[str, int] = {}
         cls.enums: Dict[str, List[str]] = {}
+        # An index of all the global names from the dictionaries above except the variables
+        cls.global_names: Dict[str, Tuple[SymbolKind, Any]] = {}
         cls.var_type_scopes: List[Dict[str, "VarType"]] = []  # type: ignore
 
         cls.used_procs: Set[Proc] = set()
         cls.included_files: List[str] = []
+        # Pairs of the absolute paths of a file and a file included by it
+        cls.include_edges: List[Tuple[str, str]] = []
         cls.runtimed_types_set: Set["Type"] = set()  # type: ignore
         cls.runtimed_types_list: List["Type"] = []  # type: ignore
         cls.curr_type_id: int = 3
 
         cls.string_data: List[bytes] = []
-        cls.locs_to_include: List[str] = []
+        cls.locs_to_include: List[int] = []
 
         cls.tokens: Generator = (i for i in ())  # type: ignore
-        cls.tokens_queue: List[Tuple[str, str]] = []
+        cls.tokens_queue: Deque[Tuple[str, int]] = deque()
+        # The hash of the source code parsed so far in the current file, None if the include cache is disabled
+        cls.source_hash: Any = None
         cls.ops_by_ips: List[Op] = []
 
         cls.is_unpack = False
@@ -193,7 +271,8 @@ class State:
 
         cls.owner: Optional["Struct"] = None  # type: ignore
 
-        cls.loc: str = ""
+        cls.loc: int = NO_LOC
+        cls.files: List[str] = []
         cls.filename: str = ""
         cls.abs_path: str = ""
 
@@ -205,8 +284,12 @@ class State:
     @classmethod
     def full_reset(cls):
         """Resets the state to the default values including the static state of other classes."""
+        # Imported here, since the types depend on the state
+        from type_checking.types import clear_interned_types
+
         cls.initialize()
         Memory.global_offset = 0
+        clear_interned_types()
 
     UNAVAILABLE_NAMES: List[str] = [
         "if", "else", "end", "while", "proc", "bind", 
@@ -236,11 +319,17 @@ class State:
         "addr" : 3,
     }
 
-    def var_types() -> Dict[str, "VarType"]:  # type: ignore
-        """Returns the union of all dictionaries in `State.var_type_scopes`"""
-        if State.var_type_scopes:
-            return reduce(lambda a, b: {**a, **b}, State.var_type_scopes)
-        return {}
+    @staticmethod
+    def find_var_type(name: str) -> Optional["VarType"]:  # type: ignore
+        """
+        Returns the type variable with the `name` from the innermost scope
+        in `State.var_type_scopes`, which defines it, or None if there is no such type variable.
+        """
+        for scope in reversed(State.var_type_scopes):
+            var_type = scope.get(name)
+            if var_type is not None:
+                return var_type
+        return None
 
     @staticmethod
     def get_new_ip(op: Op):
@@ -253,21 +342,51 @@ class State:
         return State.current_ip
 
     @staticmethod
-    def check_name(token: Tuple[str, str], error="procedure"):
+    def check_name(token: Tuple[str, int], error="procedure"):
         """
         Checks whether the provided token has a value, that is an available and valid name.
 
         Throws an error if it isn't. The `error` parameter indicates what was the type of the thing,
         that was supposed be named with the provided name e. g. a procedure.
         """
-        if token[0] in [*State.procs, *State.memories, 
-            *State.constants, *State.structures, *State.enums]:
+        if token[0] in State.global_names:
             State.loc = token[1]
             State.throw_error(f'name for {error} "{token[0]}" is already taken')
         if token[0] in State.UNAVAILABLE_NAMES:
             State.loc = token[1]
             State.throw_error(f'name for {error} "{token[0]}" is unavailable')
 
+    @staticmethod
+    def resolve_name(name: str) -> Optional[Tuple[SymbolKind, Any]]:
+        """
+        Finds what the `name` refers to from the current place in the program.
+        Bindings shadow the names local to the procedure, which shadow the global names.
+
+        Returns a tuple of the kind of the name and its value or None if the name is not defined.
+        The value is the index on the bind stack for bindings, the type for variables,
+        the `Memory` for memories and the defined object itself for other kinds.
+        """
+        if name in State.bind_stack:
+            return (SymbolKind.BINDING, State.bind_stack.last_index(name))
+        proc = State.current_proc
+        if proc is not None:
+            if name in proc.variables:
+                return (SymbolKind.LOCAL_VARIABLE, proc.variables[name])
+            if name in proc.memories:
+                return (SymbolKind.LOCAL_MEMORY, proc.memories[name])
+        if name in State.variables:
+            return (SymbolKind.VARIABLE, State.variables[name])
+        return State.global_names.get(name)
+
+    @staticmethod
+    def define_name(name: str, kind: SymbolKind, value: Any):
+        """
+        Adds a global name to the `State.global_names` index. Must be called
+        for every global memory, structure, procedure, constant and enum after
+        it is added to its dictionary in the `State`.
+        """
+        State.global_names.setdefault(name, (kind, value))
+
     @staticmethod
     def get_proc_by_block(block: Block):
         """
@@ -277,6 +396,36 @@ class State:
         proc_op = State.ops_by_ips[block.start]
         return proc_op.operand
 
+    @staticmethod
+    def add_file(name: str) -> int:
+        """Adds the file to `State.files` and returns its id, which is used in the locations"""
+        State.files.append(name)
+        return len(State.files) - 1
+
+    @staticmethod
+    def unpack_loc(loc: int) -> Tuple[str, int, int]:
+        """Returns a tuple of the file name, the line and the column of the packed location `loc`"""
+        return (
+            State.files[loc >> 2 * LOC_BITS],
+            (loc >> LOC_BITS) & LOC_MASK,
+            loc & LOC_MASK,
+        )
+
+    @staticmethod
+    def is_included_loc(loc: int) -> bool:
+        """Returns whether the location is in one of the included files and not in the main one"""
+        return loc != NO_LOC and loc >> 2 * LOC_BITS != 0
+
+    @staticmethod
+    def format_loc(loc: int) -> str:
+        """
+        Converts a packed location to a string in the format of "{file}:{line}:{column}".
+        Locations are only formatted, when they are shown to the user or included into the program.
+        """
+        if loc == NO_LOC:
+            return ""
+        return "{}:{}:{}".format(*State.unpack_loc(loc))
+
     @staticmethod
     def throw_error(error: str, do_exit: bool = True):
         """
@@ -285,7 +434,7 @@ class State:
 
         If `do_exit` is false the message will be printed to stderr, but the script won't exit.
         """
-        sys.stderr.write(f"\033[1;31mError {State.loc}:\033[0m {error}\n")
+        sys.stderr.write(f"\033[1;31mError {State.format_loc(State.loc)}:\033[0m {error}\n")
         if do_exit:
             exit(1)
 
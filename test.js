@@ -148,7 +148,9 @@ const testImport = {
 const fs = require("fs");
 const process = require("process");
 
-let wasm_bytes = fs.readFileSync("tests/temp/code_" + process.argv[2] + ".wasm");
+// Either the name of a test or a path to a wasm file
+const wasm_path = process.argv[2].endsWith(".wasm") ? process.argv[2] : "tests/temp/code_" + process.argv[2] + ".wasm";
+let wasm_bytes = fs.readFileSync(wasm_path);
 
 WebAssembly.instantiate(wasm_bytes, testImport).then(
     (obj) => {
@@ -1,7 +1,15 @@
+import hashlib
+import json
 import os
+import pickle
+import shutil
 import subprocess
 import pytest
 
+from parsing import include_cache
+from type_checking.type_stack import TypeStack
+from type_checking.types import Int, Ptr
+
 tests = os.listdir("tests")
 
 try:
@@ -17,52 +25,80 @@ if subprocess.getstatusoutput("fasm -v")[0] == 0: # Check if fasm is installed
     print("Please install Flat Assembler (Fasm)")
     exit(1)
 
-@pytest.mark.parametrize("test_name", tests)
-def test(test_name):
+# The configurations, which all the tests are also run with on the fasm_x86_64_linux target
+CONFIGS = {
+    # The output must be the same without the optimizations
+    "o0" : {"optimization_level" : 0},
+    # The memory operations without the null pointer checks use the cached registers
+    "unchecked" : {"re_NPD" : False},
+    # The procedures are type checked by the workers even in the small programs
+    "ptc" : {"ptc_jobs" : 2, "ptc_min_procs" : 1},
+    # The procedures are generated by the workers even in the small programs
+    "pcg" : {"pcg_jobs" : 2, "pcg_min_procs" : 1},
+    # The procedures from the included files are type checked after the rest of the program
+    "ltc" : {"o_LTC" : True},
+}
+
+def run_fasm_test(test_name, name, args):
+    """Runs the test `test_name` with the extra arguments `args`, the files are named after `name`"""
     with open(f"tests/{test_name}", "r") as f:
         test = f.read()
 
     parts = test.split("\n:\n")
 
-    with open(f"tests/temp/code_{test_name}.cn", "w") as f:
+    with open(f"tests/temp/code_{name}.cn", "w") as f:
         f.write(parts[0])
-    with open(f"tests/temp/stdin_{test_name}", "w") as f:
+    with open(f"tests/temp/stdin_{name}", "w") as f:
         if len(parts) > 2:
             f.write(parts[2])
     exp_stdout = parts[1]
     if len(parts) > 3:
-        exp_stderr = parts[3].format(source_file=f"tests/temp/code_{test_name}")
+        exp_stderr = parts[3].format(source_file=f"tests/temp/code_{name}")
     else:
         exp_stderr = ""
 
     subprocess.run(
         [
-            "python", "cont.py", f"tests/temp/code_{test_name}.cn",
+            "python", "cont.py", f"tests/temp/code_{name}.cn",
             "-t", "fasm_x86_64_linux",
-            "-i", f"tests/temp/stdin_{test_name}",
-            "-e", f"tests/results/{test_name}_stderr",
-            "--stdout", f"tests/results/{test_name}_stdout",
-            "-r",
+            "-i", f"tests/temp/stdin_{name}",
+            "-e", f"tests/results/{name}_stderr",
+            "--stdout", f"tests/results/{name}_stdout",
+            "-r", *args,
         ]
     )
 
-    os.remove(f"tests/temp/code_{test_name}.cn")
-    os.remove(f"tests/temp/stdin_{test_name}")
+    os.remove(f"tests/temp/code_{name}.cn")
+    os.remove(f"tests/temp/stdin_{name}")
     try:
-        os.remove(f"tests/temp/code_{test_name}.asm")
-        os.remove(f"tests/temp/code_{test_name}")
+        os.remove(f"tests/temp/code_{name}.asm")
+        os.remove(f"tests/temp/code_{name}")
     except FileNotFoundError:
         pass
 
-    with open(f"tests/results/{test_name}_stdout", "r") as f:
+    with open(f"tests/results/{name}_stdout", "r") as f:
         stdout = f.read()
 
-    with open(f"tests/results/{test_name}_stderr", "r") as f:
+    with open(f"tests/results/{name}_stderr", "r") as f:
         stderr = f.read()
 
     assert stdout == exp_stdout
     assert stderr == exp_stderr
 
+@pytest.mark.parametrize("test_name", tests)
+def test(test_name):
+    run_fasm_test(test_name, test_name, [])
+
+@pytest.mark.parametrize("config_name", CONFIGS)
+@pytest.mark.parametrize("test_name", tests)
+def test_config(test_name, config_name):
+    with open(f"tests/temp/config_{config_name}.json", "w") as f:
+        json.dump(CONFIGS[config_name], f)
+    run_fasm_test(
+        test_name, f"{test_name}_{config_name}", ["-c", f"tests/temp/config_{config_name}.json"]
+    )
+    os.remove(f"tests/temp/config_{config_name}.json")
+
 if subprocess.getstatusoutput("node -v")[0] != 0:
     print("[OPTIONAL] Cannot run tests for wasm, please install node.js.")
 else:
@@ -117,4 +153,397 @@ else:
             stderr = f.read()
 
         assert stdout == exp_stdout
-        assert stderr == exp_stderr
\ No newline at end of file
+        assert stderr == exp_stderr
+
+def test_incremental_switch_program():
+    for name, number in (("a", 1), ("b", 2)):
+        with open(f"tests/temp/incremental_{name}.cn", "w") as f:
+            f.write(f"include std.cn\n{number} print\n")
+
+    outputs = []
+    for name in ("a", "b", "a"):
+        result = subprocess.run(
+            [
+                "python", "cont.py", f"tests/temp/incremental_{name}.cn",
+                "-o", "tests/temp/incremental", "--incremental", "-r",
+            ],
+            capture_output=True, text=True
+        )
+        outputs.append(result.stdout)
+
+    for path in (
+        "tests/temp/incremental_a.cn", "tests/temp/incremental_b.cn", "tests/temp/incremental",
+        "tests/temp/incremental.asm", "tests/temp/incremental.manifest.json",
+    ):
+        os.remove(path)
+
+    assert outputs == ["1\n", "2\n", "1\n"]
+
+PTC_LOCATIONS_PROGRAM = """\
+include std.cn
+
+memory value 8
+
+proc load ptr -> int:
+  @
+end
+
+10 value !
+value @ print
+
+proc increment int -> int:
+  value @ +
+end
+
+proc indirect ptr -> int:
+  dup (int) 0 == if drop value end
+  load 1 +
+end
+
+proc broken ptr -> int:
+  value @ drop
+  @
+end
+
+5 increment print
+0 (ptr) indirect print
+value @ print
+0 (ptr) broken print
+"unreachable" puts
+"""
+
+def test_ptc_locations():
+    # The runtime errors print the locations, which are renumbered after the parallel type checking
+    with open("tests/temp/ptc_locations.cn", "w") as f:
+        f.write(PTC_LOCATIONS_PROGRAM)
+    with open("tests/temp/config_ptc_locations.json", "w") as f:
+        json.dump(CONFIGS["ptc"], f)
+
+    outputs = []
+    for args in ([], ["-c", "tests/temp/config_ptc_locations.json"]):
+        result = subprocess.run(
+            [
+                "python", "cont.py", "tests/temp/ptc_locations.cn",
+                "-o", "tests/temp/ptc_locations", "-r", *args,
+            ],
+            capture_output=True, text=True
+        )
+        outputs.append(result.stdout)
+
+    for path in (
+        "tests/temp/ptc_locations.cn", "tests/temp/config_ptc_locations.json",
+        "tests/temp/ptc_locations", "tests/temp/ptc_locations.asm",
+    ):
+        os.remove(path)
+
+    assert outputs[0].endswith("Null pointer dereference in tests/temp/ptc_locations:23:3\n")
+    assert outputs[1] == outputs[0]
+
+PROC_CACHE_PROGRAM = """\
+include std.cn
+
+proc callee int -> int:
+  2 *
+end
+
+proc caller ptr int -> int:
+  callee 1 + swap
+  dup (int) 0 == if drop 0 else @ end
+  + 3 * 1 -
+end
+
+proc broken ptr -> int:
+  1 callee drop 2 callee drop
+  @ 1 + 2 *
+end
+
+0 (ptr) 5 caller print
+0 (ptr) broken print
+"""
+
+def test_proc_cache():
+    # The procedures are loaded from the cache, when the lines before them change,
+    # and are type checked again, when the signatures of the procedures they call change
+    programs = [
+        PROC_CACHE_PROGRAM,
+        "// A new line\n" + PROC_CACHE_PROGRAM,
+        ("// A new line\n" + PROC_CACHE_PROGRAM).replace(
+            "proc callee int -> int:\n  2 *", "proc callee int -> ptr:\n  2 * (ptr)"
+        ),
+    ]
+    os.makedirs("tests/temp/proc_cache", exist_ok=True)
+    outputs = []
+    keys = []
+    for program in programs:
+        with open("tests/temp/proc_cache/program.cn", "w") as f:
+            f.write(program)
+        for args in ([], ["-cd", "tests/temp/proc_cache/cache"]):
+            result = subprocess.run(
+                [
+                    "python", "cont.py", "tests/temp/proc_cache/program.cn",
+                    "-o", "tests/temp/proc_cache/program", "-r", *args,
+                ],
+                capture_output=True, text=True
+            )
+            outputs.append(result.stdout + result.stderr)
+        for name in os.listdir("tests/temp/proc_cache/cache"):
+            if name.startswith("procs_"):
+                with open(f"tests/temp/proc_cache/cache/{name}", "rb") as f:
+                    keys.append(set(pickle.load(f)))
+
+    shutil.rmtree("tests/temp/proc_cache")
+
+    assert outputs[1] == outputs[0]
+    assert outputs[3] == outputs[2]
+    assert outputs[5] == outputs[4]
+    assert "incompatible types" in outputs[4]
+    assert keys[1] == keys[0]
+
+LTC_LIBRARY = """\
+include std.cn
+
+proc double int -> int:
+  2 *
+end
+
+proc quadruple int -> int:
+  double double
+end
+
+nproc add_to int n ptr p:
+  p @ n + p !
+end
+
+struct Counter
+  int value
+
+  nproc __init__:
+    0 !self.value
+  end
+
+  nproc add int n:
+    n *self.value add_to
+  end
+
+  nproc get -> int:
+    self.value
+  end
+end
+"""
+
+LTC_PROGRAM = """\
+include ltc_lib.cn
+
+init var counter Counter
+
+5 *double call print
+3 *quadruple call print
+4 counter.add
+counter.get quadruple print
+"""
+
+@pytest.mark.parametrize("error", [
+    None,
+    # In a procedure only referenced by its address
+    ("  double double", '  double "x" +'),
+    # In a procedure only called by a method
+    ("  p @ n + p !", "  p n + p !"),
+])
+def test_ltc(error):
+    # The deferred procedures must be type checked, when they are used in any way
+    os.makedirs("tests/temp/ltc", exist_ok=True)
+    with open("tests/temp/ltc/ltc_lib.cn", "w") as f:
+        f.write(LTC_LIBRARY if error is None else LTC_LIBRARY.replace(*error))
+    with open("tests/temp/ltc/main.cn", "w") as f:
+        f.write(LTC_PROGRAM)
+    with open("tests/temp/ltc/config.json", "w") as f:
+        json.dump(CONFIGS["ltc"], f)
+
+    outputs = []
+    # The included files are found from the working directory
+    for args in ([], ["-c", "config.json"]):
+        result = subprocess.run(
+            ["python", "../../../cont.py", "main.cn", "-o", "main", "-r", *args],
+            capture_output=True, text=True, cwd="tests/temp/ltc"
+        )
+        outputs.append(result.stdout + result.stderr)
+
+    shutil.rmtree("tests/temp/ltc")
+
+    assert outputs[1] == outputs[0]
+    if error is None:
+        assert outputs[0] == "10\n12\n16\n"
+    else:
+        assert "incompatible types" in outputs[0]
+
+# The types are compared by their identity, when they can't be equal to other types
+INT, PTR = Int(), Ptr()
+
+def test_type_stack_diverged():
+    base = TypeStack([INT, PTR])
+    branch1, branch2 = base.copy(), base.copy()
+    assert branch1.diverged(branch2) == 0
+
+    branch1.append(INT)
+    branch2.append(PTR)
+    assert branch1.diverged(branch2) == 1
+    assert branch1 != branch2
+
+    # The routes share the nodes again after the types pushed by them are popped
+    branch1.pop()
+    branch2.pop()
+    assert branch1.diverged(branch2) == 0
+
+    branch1[0] = PTR
+    assert branch1.diverged(branch2) == 2
+    assert list(branch2) == [INT, PTR]
+
+def test_type_stack_shared_tails():
+    base = TypeStack([INT, PTR, INT])
+    branch = base.copy()
+    branch.drop(2)
+    branch.pop()
+    with pytest.raises(IndexError):
+        branch.pop()
+    branch.extend([INT, PTR, INT])
+
+    # Popping past the shared nodes doesn't change the stack they were copied from
+    assert list(base) == [INT, PTR, INT]
+    assert len(base) == 3
+    # The same types pushed again are equal, but aren't shared
+    assert branch == base
+    assert branch.diverged(base) == 3
+
+def test_type_stack_equality():
+    stack = TypeStack([INT, PTR])
+    assert stack == [INT, PTR]
+    assert stack != [INT]
+    assert stack != TypeStack([PTR, INT])
+    assert stack != TypeStack([INT, PTR, INT])
+    assert stack[-1] == PTR
+    assert stack[1:] == [PTR]
+
+    copy = stack.copy()
+    copy.append(INT)
+    copy.pop()
+    assert copy == stack
+    assert copy.diverged(stack) == 0
+
+def test_hashed_lines():
+    # The same text split into other lines must have another hash
+    hashes = []
+    for lines in (["ab", "c"], ["a", "bc"], "ab\nc"):
+        source_hash = hashlib.sha1()
+        list(include_cache.hashed_lines(lines, source_hash))
+        hashes.append(source_hash.hexdigest())
+    assert hashes[0] != hashes[1]
+    assert hashes[2] == hashes[0]
+
+@pytest.mark.parametrize("test_name", tests)
+def test_include_cache_same_code(test_name):
+    # The included files parsed and loaded from the cache must give the same code and errors
+    with open(f"tests/{test_name}", "r") as f:
+        program = f.read().split("\n:\n")[0]
+    with open(f"tests/temp/include_cache_{test_name}.cn", "w") as f:
+        f.write(program)
+
+    outputs = []
+    for name, args in (
+        ("uncached", []),
+        ("cold", ["-cd", f"tests/temp/include_cache_{test_name}_cache"]),
+        ("warm", ["-cd", f"tests/temp/include_cache_{test_name}_cache"]),
+    ):
+        result = subprocess.run(
+            [
+                "python", "cont.py", f"tests/temp/include_cache_{test_name}.cn",
+                "-o", f"tests/temp/include_cache_{test_name}_{name}", *args,
+            ],
+            capture_output=True, text=True
+        )
+        try:
+            with open(f"tests/temp/include_cache_{test_name}_{name}.asm", "r") as f:
+                outputs.append((f.read(), result.stderr))
+            os.remove(f"tests/temp/include_cache_{test_name}_{name}.asm")
+            os.remove(f"tests/temp/include_cache_{test_name}_{name}")
+        except FileNotFoundError:
+            # The programs with the compilation errors have no code
+            outputs.append((None, result.stderr))
+
+    os.remove(f"tests/temp/include_cache_{test_name}.cn")
+    shutil.rmtree(f"tests/temp/include_cache_{test_name}_cache", ignore_errors=True)
+
+    assert outputs[1] == outputs[0]
+    assert outputs[2] == outputs[0]
+
+@pytest.mark.parametrize("test_name", tests)
+def test_prelude_snapshot(test_name):
+    # The prelude snapshot created by another program must give the same code and errors
+    with open(f"tests/{test_name}", "r") as f:
+        program = f.read().split("\n:\n")[0]
+    with open(f"tests/temp/prelude_{test_name}.cn", "w") as f:
+        f.write(program)
+    with open(f"tests/temp/prelude_{test_name}_other.cn", "w") as f:
+        f.write("include std.cn\n1 print\n")
+
+    outputs = []
+    for name, path, args in (
+        ("uncached", f"tests/temp/prelude_{test_name}.cn", []),
+        ("other", f"tests/temp/prelude_{test_name}_other.cn", ["-cd", f"tests/temp/prelude_{test_name}_cache"]),
+        ("cached", f"tests/temp/prelude_{test_name}.cn", ["-cd", f"tests/temp/prelude_{test_name}_cache"]),
+    ):
+        result = subprocess.run(
+            ["python", "cont.py", path, "-o", f"tests/temp/prelude_{test_name}_{name}", *args],
+            capture_output=True, text=True
+        )
+        try:
+            with open(f"tests/temp/prelude_{test_name}_{name}.asm", "r") as f:
+                outputs.append((f.read(), result.stderr))
+            os.remove(f"tests/temp/prelude_{test_name}_{name}.asm")
+            os.remove(f"tests/temp/prelude_{test_name}_{name}")
+        except FileNotFoundError:
+            # The programs with the compilation errors have no code
+            outputs.append((None, result.stderr))
+        if name == "other":
+            snapshots = [
+                i for i in os.listdir(f"tests/temp/prelude_{test_name}_cache") if i.startswith("prelude_")
+            ]
+
+    os.remove(f"tests/temp/prelude_{test_name}.cn")
+    os.remove(f"tests/temp/prelude_{test_name}_other.cn")
+    shutil.rmtree(f"tests/temp/prelude_{test_name}_cache")
+
+    assert len(snapshots) == 1
+    assert outputs[2] == outputs[0]
+
+@pytest.mark.parametrize("test_name", tests)
+def test_pcg_same_code(test_name):
+    # The code generated by the workers must be put together into exactly the same assembly
+    with open(f"tests/{test_name}", "r") as f:
+        program = f.read().split("\n:\n")[0]
+    with open(f"tests/temp/pcg_{test_name}.cn", "w") as f:
+        f.write(program)
+    with open(f"tests/temp/config_pcg_{test_name}.json", "w") as f:
+        json.dump(CONFIGS["pcg"], f)
+
+    outputs = []
+    for name, args in (("serial", []), ("parallel", ["-c", f"tests/temp/config_pcg_{test_name}.json"])):
+        subprocess.run(
+            [
+                "python", "cont.py", f"tests/temp/pcg_{test_name}.cn",
+                "-o", f"tests/temp/pcg_{test_name}_{name}", *args,
+            ],
+            capture_output=True
+        )
+        try:
+            with open(f"tests/temp/pcg_{test_name}_{name}.asm", "rb") as f:
+                outputs.append(f.read())
+            os.remove(f"tests/temp/pcg_{test_name}_{name}.asm")
+            os.remove(f"tests/temp/pcg_{test_name}_{name}")
+        except FileNotFoundError:
+            # The programs with the compilation errors have no code
+            outputs.append(None)
+
+    os.remove(f"tests/temp/pcg_{test_name}.cn")
+    os.remove(f"tests/temp/config_pcg_{test_name}.json")
+
+    assert outputs[1] == outputs[0]
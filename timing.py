@@ -0,0 +1,158 @@
+import json
+import os
+import resource
+import sys
+import time
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+TIME_PASSES_FORMATS = ["text", "json"]
+
+
+class PassRecord:
+    """
+    The accumulated measurements for one pass of the compiler.
+    The `file` is set for the passes, which are done separately for each file.
+    """
+    def __init__(self, name: str, file: Optional[str]):
+        self.name = name
+        self.file = file
+        self.time = 0.0
+        self.max_rss = 0
+        self.calls = 0
+
+    def to_json(self) -> Dict[str, Any]:
+        """Returns a dictionary, that represents the record in the JSON report"""
+        return {
+            "pass" : self.name,
+            "file" : self.file,
+            "time" : self.time,
+            "max_rss" : self.max_rss,
+            "calls" : self.calls,
+        }
+
+
+class PassTimer:
+    """
+    Measures the wall time and the peak memory of the compiler passes.
+
+    Passes can be nested e. g. parsing an included file happens while parsing
+    the file, that includes it. The time of a pass doesn't include the time of
+    the passes nested in it, so the times of all the passes add up to the total time.
+    The memory is measured as the maximum resident set size of the compiler process
+    at the end of the pass. It never decreases, so the passes, which have increased it,
+    are the ones, that have used the most memory. Tracing every allocation would
+    slow down the compiler a few times and make the measured times useless.
+    """
+    def __init__(self):
+        self.records: Dict[Tuple[str, Optional[str]], PassRecord] = {}
+        # Each frame is [record, start time, time spent in nested passes]
+        self.frames: List[List[Any]] = []
+        self.start_time = time.perf_counter()
+
+    def enter(self, name: str, file: Optional[str] = None):
+        """Starts measuring the pass `name` for the `file`"""
+        key = (name, file)
+        if key not in self.records:
+            self.records[key] = PassRecord(name, file)
+        self.frames.append([self.records[key], time.perf_counter(), 0.0])
+
+    def exit(self):
+        """Stops measuring the innermost pass"""
+        record, start, nested_time = self.frames.pop()
+        elapsed = time.perf_counter() - start
+
+        record.time += elapsed - nested_time
+        record.max_rss = max(record.max_rss, max_rss())
+        record.calls += 1
+        if self.frames:
+            self.frames[-1][2] += elapsed
+
+    def to_json(self) -> Dict[str, Any]:
+        """Returns a dictionary with the whole report"""
+        return {
+            "total_time" : time.perf_counter() - self.start_time,
+            "max_rss" : max_rss(),
+            "passes" : [record.to_json() for record in self.records.values()],
+        }
+
+    def to_text(self) -> str:
+        """Returns a human readable table with the report"""
+        report = self.to_json()
+        lines = [f"{'pass':<20} {'time, ms':>10} {'rss, KiB':>10} {'calls':>7}  file"]
+        for record in report["passes"]:
+            file = "" if record["file"] is None else os.path.relpath(record["file"])
+            lines.append(
+                f"{record['pass']:<20} {record['time'] * 1000:>10.2f} "
+                f"{record['max_rss'] // 1024:>10} {record['calls']:>7}  {file}"
+            )
+        lines.append(f"{'total':<20} {report['total_time'] * 1000:>10.2f} {report['max_rss'] // 1024:>10}")
+        return "\n".join(lines)
+
+
+def max_rss() -> int:
+    """Returns the maximum resident set size of the compiler process in bytes"""
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+timer: Optional[PassTimer] = None
+
+
+def start():
+    """Starts measuring the passes, which is disabled by default"""
+    global timer
+    timer = PassTimer()
+
+
+def stop(format: str):
+    """
+    Stops measuring the passes and writes the report to the stderr.
+    The `format` must be one of the `TIME_PASSES_FORMATS`.
+    """
+    global timer
+    if timer is None:
+        return
+    if format == "json":
+        sys.stderr.write(json.dumps(timer.to_json(), indent=4) + "\n")
+    else:
+        sys.stderr.write(timer.to_text() + "\n")
+    timer = None
+
+
+@contextmanager
+def timed_pass(name: str, file: Optional[str] = None) -> Iterator[None]:
+    """A context manager, which measures the pass `name` for the `file` if measuring is enabled"""
+    if timer is None:
+        yield
+        return
+    timer.enter(name, file)
+    try:
+        yield
+    finally:
+        timer.exit()
+
+
+def timed_iter(iterator: Iterator[T], name: str, file: Optional[str] = None) -> Iterator[T]:
+    """
+    Returns an iterator over the `iterator`, which measures the time spent
+    in the `iterator` as the pass `name` for the `file` if measuring is enabled.
+    """
+    if timer is None:
+        return iterator
+    return _timed_iter(iterator, name, file)
+
+
+def _timed_iter(iterator: Iterator[T], name: str, file: Optional[str]) -> Iterator[T]:
+    while True:
+        timer.enter(name, file)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timer.exit()
+        yield item
@@ -0,0 +1,288 @@
+import io
+import multiprocessing
+import os
+import pickle
+import sys
+
+from bisect import bisect_right
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from parsing.op import Op, OpType
+from state import State, Proc
+from .proc_cache import ProcCache
+from .type_stack import TypeStack
+
+# The operations of the program, the objects shared by the main process and the workers
+# and the function type checking one operation, it's passed in to avoid a circular import.
+# The workers are forked, so they have the same objects at the same addresses.
+_ops: List[Op] = []
+_shared: Dict[int, Any] = {}
+_type_check_into: Callable[[Op, TypeStack, List[Op]], None] = lambda op, stack, checked: None
+
+
+class SharedPickler(pickle.Pickler):
+    """A pickler, which stores the objects shared by the main process and the workers by their ids"""
+    def persistent_id(self, obj: Any) -> Optional[int]:
+        return id(obj) if id(obj) in _shared and _shared[id(obj)] is obj else None
+
+
+class SharedUnpickler(pickle.Unpickler):
+    """An unpickler, which resolves the ids stored by `SharedPickler`"""
+    def persistent_load(self, pid: int) -> Any:
+        return _shared[pid]
+
+
+def dumps(obj: Any) -> bytes:
+    file = io.BytesIO()
+    SharedPickler(file, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return file.getvalue()
+
+
+def loads(data: bytes) -> Any:
+    return SharedUnpickler(io.BytesIO(data)).load()
+
+
+def shared_objects(ops: List[Op]) -> Dict[int, Any]:
+    """
+    Returns a dictionary of the objects, which must stay the same objects when
+    the type checked operations are sent back from a worker, mapped by their ids.
+    These are the procedures with their blocks and the structures.
+    """
+    procs: List[Proc] = [op.operand for op in ops if op.type == OpType.DEFPROC]
+    procs.extend(State.procs.values())
+    objects: List[Any] = []
+    for struct in State.structures.values():
+        objects.append(struct)
+        procs.extend(struct.methods.values())
+        procs.extend(struct.static_methods.values())
+    for proc in procs:
+        objects.append(proc)
+        if getattr(proc, "block", None) is not None:
+            objects.append(proc.block)
+    return {id(obj) : obj for obj in objects}
+
+
+def check_procs(data: bytes) -> bytes:
+    """
+    Type checks a batch of procedures in a worker. The batch is a list of
+    the indexes of their DEFPROC and ENDPROC operations and the types
+    on the bind stack before them. Stops at the first procedure with an error.
+
+    Returns a list of the results of `check_proc`.
+    """
+    results = []
+    for start, end, bind_stack in loads(data):
+        results.append(check_proc(start, end, bind_stack))
+        if results[-1][0] != "ok":
+            break
+    return dumps(results)
+
+
+def check_proc(start: int, end: int, bind_stack: List[Any]) -> Tuple[Any, ...]:
+    """
+    Type checks the procedure with operations from `start` to `end` in a worker.
+    The errors are written to a buffer, so they can be reported in the order of the program.
+
+    Returns a tuple of "ok", the type checked operations, the operations of the ips of the
+    procedure, the procedures used by it, the first loc_id and the locations added to
+    `State.locs_to_include` if the procedure is correct. Otherwise returns a tuple of
+    "exit" and the exit code or "raise" and the exception, the written errors and `State.loc`.
+    """
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    first_loc_id = len(State.locs_to_include)
+    try:
+        State.bind_stack = bind_stack
+        State.route_stack = []
+        State.current_proc = None
+        stack = TypeStack()
+        checked: List[Op] = []
+        for op in _ops[start : end + 1]:
+            _type_check_into(op, stack, checked)
+
+        proc = _ops[start].operand
+        return (
+            "ok", checked, State.ops_by_ips[proc.block.start : proc.block.end + 1],
+            proc.used_procs, first_loc_id, State.locs_to_include[first_loc_id:],
+        )
+    except SystemExit as e:
+        return ("exit", e.code, sys.stderr.getvalue(), State.loc)
+    except Exception as e:
+        return ("raise", e, sys.stderr.getvalue(), State.loc)
+    finally:
+        sys.stderr = stderr
+
+
+class ParallelProc:
+    """A procedure sent to the workers"""
+    def __init__(self, proc: Proc, chunk: List[Op], mark: int, key: Optional[str]):
+        self.proc = proc
+        # The key of the procedure in the cache of type checked procedures
+        self.key = key
+        # The list, where the type checked operations of the procedure will be put
+        self.chunk = chunk
+        # The length of `State.locs_to_include` in the main process, when the procedure was sent
+        self.mark = mark
+
+
+class ParallelTypeChecker:
+    """
+    Type checks the bodies of the procedures in a pool of forked processes,
+    while the main process type checks the rest of the program.
+
+    The type checking of a procedure body only depends on the signatures of procedures
+    and on the bind stack before it. The workers are forked before type checking starts,
+    so they get the whole `State` and report back everything the procedure body has changed:
+    the operations, the procedures it uses and the locations for the runtime checks.
+    The results are merged in the order of the program, so the result is the same as
+    if the procedures were type checked one by one.
+    """
+    def __init__(
+        self, ops: List[Op], type_check_into: Callable[[Op, TypeStack, List[Op]], None], jobs: int, procs_count: int
+    ):
+        global _ops, _shared, _type_check_into
+        _ops = ops
+        _shared = shared_objects(ops)
+        _type_check_into = type_check_into
+        self.ops = ops
+        self.base = len(State.locs_to_include)
+        self.batch_size = max(1, procs_count // (jobs * 4))
+        self.batch: List[Tuple[int, int, List[Any]]] = []
+        self.pending: List[Any] = []
+        self.procs: List[ParallelProc] = []
+        self.pool = multiprocessing.get_context("fork").Pool(jobs)
+
+    @staticmethod
+    def create(
+        ops: List[Op], type_check_into: Callable[[Op, TypeStack, List[Op]], None]
+    ) -> Optional["ParallelTypeChecker"]:
+        """
+        Returns a `ParallelTypeChecker` for the program if the parallel type checking(o_PTC)
+        is enabled and the program has enough procedures for it to be worth it, otherwise None.
+        """
+        if not State.config.o_PTC or State.config.lsp_mode:
+            return None
+        jobs = State.config.ptc_jobs if State.config.ptc_jobs > 0 else os.cpu_count() or 1
+        procs_count = sum(1 for op in ops if op.type == OpType.DEFPROC and op.compiled)
+        if jobs < 2 or procs_count < State.config.ptc_min_procs:
+            return None
+        try:
+            return ParallelTypeChecker(ops, type_check_into, jobs, procs_count)
+        except (OSError, ValueError):
+            # Forking isn't available on the platform
+            return None
+
+    def submit(self, start: int, end: int, key: Optional[str]) -> List[Op]:
+        """
+        Sends the procedure with the operations from `start` to `end` to the workers.
+        The ips of the procedure must only have its operations, since they are sent back.
+        The result is stored in the cache of type checked procedures with the `key` if it isn't None.
+
+        Returns the list, where the type checked operations will be put by `finish`.
+        """
+        chunk: List[Op] = []
+        self.procs.append(ParallelProc(self.ops[start].operand, chunk, len(State.locs_to_include), key))
+        self.batch.append((start, end, list(State.bind_stack)))
+        if len(self.batch) >= self.batch_size:
+            self.submit_batch()
+        return chunk
+
+    def submit_batch(self):
+        """Sends the collected procedures to the workers"""
+        if self.batch:
+            self.pending.append(self.pool.apply_async(check_procs, (dumps(self.batch),)))
+            self.batch = []
+
+    def results(self) -> List[Tuple[Any, ...]]:
+        """
+        Waits for the workers and returns the results of all the procedures.
+        Reports the error of the first incorrect procedure if there is one.
+        """
+        self.submit_batch()
+        results = []
+        for pending in self.pending:
+            for result in loads(pending.get()):
+                if result[0] != "ok":
+                    self.pool.terminate()
+                    self.report(result)
+                results.append(result)
+        self.pool.terminate()
+        return results
+
+    def report(self, result: Tuple[Any, ...]):
+        """Reports the error of a procedure the same way, as if it was type checked in the main process"""
+        kind, value, errors, loc = result
+        sys.stderr.write(errors)
+        State.loc = loc
+        if kind == "exit":
+            exit(value)
+        raise value
+
+    @contextmanager
+    def errors_in_order(self) -> Iterator[None]:
+        """
+        Delays the errors of type checking in the main process, so an error
+        in a procedure sent to the workers before it is reported instead.
+        """
+        stderr = sys.stderr
+        sys.stderr = errors = io.StringIO()
+        try:
+            yield
+        except (SystemExit, Exception):
+            sys.stderr = stderr
+            self.results()
+            sys.stderr.write(errors.getvalue())
+            raise
+        finally:
+            sys.stderr = stderr
+        sys.stderr.write(errors.getvalue())
+
+    def finish(self, chunks: List[List[Op]], proc_cache: Optional[ProcCache]):
+        """
+        Waits for the workers and puts the type checked procedures into their chunks.
+        The `chunks` are all the chunks of the program, the locations for the
+        runtime checks are renumbered in all of them to be in the order of the program.
+        The procedures are stored in the `proc_cache` if it isn't None.
+        """
+        results = self.results()
+
+        locs = State.locs_to_include[:self.base]
+        marks: List[int] = []
+        shifts: List[int] = [0]
+        mark = self.base
+        for parallel_proc, result in zip(self.procs, results):
+            _, checked, ips_ops, used_procs, first_loc_id, proc_locs = result
+            locs.extend(State.locs_to_include[mark:parallel_proc.mark])
+            mark = parallel_proc.mark
+            shift = len(locs) - first_loc_id
+            locs.extend(proc_locs)
+
+            parallel_proc.chunk[:] = checked
+            proc = parallel_proc.proc
+            State.ops_by_ips[proc.block.start : proc.block.end + 1] = ips_ops
+            proc.used_procs.update(used_procs)
+            if proc_cache is not None and parallel_proc.key is not None:
+                proc_cache.store(parallel_proc.key, proc, checked, first_loc_id, proc_locs)
+
+            for op in unique_ops(checked):
+                if first_loc_id <= op.loc_id < first_loc_id + len(proc_locs):
+                    op.loc_id += shift
+            marks.append(mark)
+            shifts.append(shifts[-1] + len(proc_locs))
+        locs.extend(State.locs_to_include[mark:])
+
+        # The locations added in the main process are moved by the ones of the procedures before them
+        proc_chunks = {id(parallel_proc.chunk) for parallel_proc in self.procs}
+        for chunk in chunks:
+            if id(chunk) in proc_chunks:
+                continue
+            for op in unique_ops(chunk):
+                if op.loc_id >= self.base:
+                    op.loc_id += shifts[bisect_right(marks, op.loc_id)]
+        State.locs_to_include[:] = locs
+
+
+def unique_ops(ops: List[Op]) -> Iterator[Op]:
+    """Returns an iterator over the operations, where every operation object is only once"""
+    return iter({id(op) : op for op in ops}.values())
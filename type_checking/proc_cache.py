@@ -0,0 +1,284 @@
+import hashlib
+import io
+import os
+import pickle
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from state import State, Block, Proc
+from parsing.op import Op, OpType, LOC_BITS, LOC_MASK, NO_LOC
+from parsing.include_cache import config_digest
+from .types import Struct
+
+# Smaller procedures are type checked faster than their keys are computed
+MIN_CACHED_OPS = 10
+
+# The entries used by the previous compilation in this process or None if they aren't kept.
+# The language server keeps them, so procedures, which haven't changed, aren't type checked on every check.
+_recent_entries: Optional[Dict[str, bytes]] = None
+
+
+def keep_entries_in_memory():
+    """Makes the type checked procedures reused by the next compilations in the same process"""
+    global _recent_entries
+    if _recent_entries is None:
+        _recent_entries = {}
+
+
+def references() -> Dict[int, Tuple[Any, ...]]:
+    """
+    Returns a dictionary with the persistent ids of the procedures, their blocks and the structures.
+    The ids are the same in all compilations, which define the objects with the same names.
+    """
+    ids: Dict[int, Tuple[Any, ...]] = {}
+    procs: List[Tuple[Proc, Tuple[Any, ...]]] = [(proc, ("proc", name)) for name, proc in State.procs.items()]
+    for name, struct in State.structures.items():
+        ids[id(struct)] = ("struct", name)
+        procs.extend((method, ("method", name, method_name)) for method_name, method in struct.methods.items())
+        procs.extend(
+            (method, ("static_method", name, method_name))
+            for method_name, method in struct.static_methods.items()
+        )
+    for proc, pid in procs:
+        if id(proc) not in ids:
+            ids[id(proc)] = pid
+            if proc.block is not None:
+                ids[id(proc.block)] = ("block", *pid)
+    return ids
+
+
+def reference(pid: Tuple[Any, ...]) -> Any:
+    """Returns the object with the persistent id `pid` from `references`"""
+    kind = pid[0]
+    if kind == "block":
+        return reference(pid[1:]).block
+    elif kind == "proc":
+        return State.procs[pid[1]]
+    elif kind == "struct":
+        return State.structures[pid[1]]
+    elif kind == "method":
+        return State.structures[pid[1]].methods[pid[2]]
+    elif kind == "static_method":
+        return State.structures[pid[1]].static_methods[pid[2]]
+    raise pickle.UnpicklingError(f"unknown persistent id: {pid}")
+
+
+def proc_loc(proc: Proc) -> int:
+    """Returns the location of the start of the line, where the procedure `proc` is defined"""
+    return State.ops_by_ips[proc.block.start].loc & ~LOC_MASK
+
+
+def relative_loc(loc: int, base: int) -> Tuple[bool, int]:
+    """
+    Returns a tuple of whether the location `loc` is after the location `base` in the same file
+    and the location relative to the `base` if it is or the location itself if it isn't.
+    """
+    if loc != NO_LOC and loc >> 2 * LOC_BITS == base >> 2 * LOC_BITS and loc >= base:
+        return (True, loc - base)
+    return (False, loc)
+
+
+def move_loc(loc: int, old_base: int, new_base: int) -> int:
+    """Returns the location `loc` moved from after the `old_base` to after the `new_base`"""
+    is_relative, value = relative_loc(loc, old_base)
+    return new_base + value if is_relative else loc
+
+
+class ReferencePickler(pickle.Pickler):
+    """
+    A pickler, which stores the objects from `references` by their persistent ids,
+    so they are found with `reference` when unpickled. The procedures and the structures
+    are collected into `refs`, so their descriptions can be added to the keys.
+
+    A reducer is used instead of `persistent_id`, since it isn't called for the builtin types.
+    """
+    def __init__(self, file, ids: Dict[int, Tuple[Any, ...]]):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.ids = ids
+        self.refs: List[Any] = []
+
+    def reducer_override(self, obj: Any) -> Any:
+        pid = self.ids.get(id(obj))
+        if pid is None:
+            if type(obj) is Proc or type(obj) is Struct:
+                raise pickle.PicklingError("the object can't be referenced from a cache entry")
+            return NotImplemented
+        if type(obj) is not Block:
+            self.refs.append(obj)
+        return (reference, (pid,))
+
+
+class ProcCache:
+    """
+    The cache of the type checked procedures. The result of type checking the body of a procedure
+    depends only on its operations, the signatures of the procedures and the structures
+    it references, the types on the bind stack before it and the configuration.
+    The key of a procedure is a digest of all of them, so a procedure is type checked again only
+    if one of them has changed. The locations in the key are relative to the procedure, so the procedure
+    isn't type checked again, when the lines before it change, its locations are moved instead.
+
+    The entries used by a compilation are kept for the next compilation of the same program.
+    They are stored in a single file in the cache directory and, for the language server, in memory.
+    """
+    def __init__(self):
+        self.ids = references()
+        self.config_digest = config_digest()
+        # Pickled descriptions of the procedures and structures with the objects they reference
+        self.descriptions: Dict[int, Tuple[bytes, List[Any]]] = {}
+        self.path: Optional[str] = None
+        if State.config.cache_dir is not None:
+            name = hashlib.sha1(State.abs_path.encode()).hexdigest()
+            self.path = os.path.join(State.config.cache_dir, f"procs_{name}.pickle")
+        # The entries used by the previous compilation and by this one
+        self.recent: Dict[str, bytes] = _recent_entries if _recent_entries is not None else self.load_recent()
+        self.entries: Dict[str, bytes] = {}
+
+    @staticmethod
+    def create() -> Optional["ProcCache"]:
+        """Returns the cache for the compilation or None if the procedures aren't cached"""
+        if State.config.cache_dir is None and _recent_entries is None:
+            return None
+        return ProcCache()
+
+    def load_recent(self) -> Dict[str, bytes]:
+        """Returns the entries stored by the previous compilation of the program"""
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path, "rb") as f:
+                entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def save(self):
+        """Keeps the entries used by the compilation for the next one"""
+        global _recent_entries
+        if _recent_entries is not None:
+            _recent_entries = self.entries
+        if self.path is None or self.entries.keys() == self.recent.keys():
+            return
+
+        os.makedirs(State.config.cache_dir, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    def description(self, obj: Any) -> Tuple[Any, ...]:
+        """Returns everything about the procedure or the structure, that the type checker uses"""
+        if isinstance(obj, Proc):
+            return (self.ids[id(obj)], obj.in_stack, obj.out_stack, obj.is_named, obj.is_self_named, obj.is_imported)
+        return (
+            self.ids[id(obj)], obj.fields, obj.fields_types, obj.is_unpackable,
+            obj.parent, obj.defaults, obj.methods, obj.static_methods,
+        )
+
+    def describe(self, obj: Any) -> Tuple[bytes, List[Any]]:
+        """
+        Returns a tuple of the pickled description of the procedure or the structure
+        and a list of the procedures and the structures it references.
+        """
+        if id(obj) not in self.descriptions:
+            file = io.BytesIO()
+            pickler = ReferencePickler(file, self.ids)
+            pickler.dump(self.description(obj))
+            self.descriptions[id(obj)] = (file.getvalue(), pickler.refs)
+        return self.descriptions[id(obj)]
+
+    def key(self, ops: List[Op], start: int, end: int) -> Optional[str]:
+        """
+        Returns the key of the procedure with operations from `start` to `end`
+        or None if it can't be cached.
+        """
+        if end - start + 1 < MIN_CACHED_OPS:
+            return None
+        proc = ops[start].operand
+        base = proc_loc(proc)
+        # The named objects the type checker finds in the `State`
+        lookups: List[Any] = []
+        for op in ops[start : end + 1]:
+            if op.type in (OpType.PUSH_VAR, OpType.PUSH_VAR_PTR):
+                lookups.append(State.variables.get(op.operand))
+            elif op.type == OpType.PACK:
+                lookups.append(State.structures.get(op.operand[0]))
+            elif op.type == OpType.PUSH_TYPE:
+                lookups.append([State.structures.get(name) for name in State.TYPE_STRUCTS])
+
+        file = io.BytesIO()
+        pickler = ReferencePickler(file, self.ids)
+        try:
+            pickler.dump((
+                [(op.type, op.operand, relative_loc(op.loc, base), op.compiled) for op in ops[start : end + 1]],
+                State.bind_stack, lookups, proc.ip, proc.block.start, proc.block.end,
+                proc.block.stack_effect, proc.block.binded, proc.memories, proc.memory_size, proc.variables,
+                self.description(proc),
+            ))
+        except (pickle.PicklingError, KeyError, TypeError, AttributeError, RecursionError):
+            return None
+
+        digest = hashlib.sha1(self.config_digest)
+        digest.update(file.getvalue())
+        queue = pickler.refs
+        # The description of the procedure itself is already in the key
+        described: Set[int] = {id(proc)}
+        while queue:
+            obj = queue.pop()
+            if id(obj) in described:
+                continue
+            described.add(id(obj))
+            try:
+                description, refs = self.describe(obj)
+            except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+                return None
+            digest.update(description)
+            queue.extend(refs)
+        return "proc_" + digest.hexdigest()
+
+    def load(self, key: str, proc: Proc) -> Optional[List[Op]]:
+        """
+        Loads the type checked operations of the procedure `proc` with the `key`
+        and adds to the `State` everything type checking the procedure would.
+
+        Returns the type checked operations or None if there is no valid entry.
+        """
+        data = self.recent.get(key)
+        if data is None:
+            return None
+
+        try:
+            checked, ips_ops, used_procs, first_loc_id, locs, old_base = pickle.loads(data)
+        except (EOFError, KeyError, IndexError, AttributeError, ValueError, pickle.UnpicklingError):
+            return None
+        self.entries[key] = data
+
+        # The locations for the runtime checks are numbered in the order they were added
+        shift = len(State.locs_to_include) - first_loc_id
+        for op in {id(op) : op for op in checked}.values():
+            if first_loc_id <= op.loc_id < first_loc_id + len(locs):
+                op.loc_id += shift
+        # The lines before the procedure could have changed since it was stored
+        base = proc_loc(proc)
+        if base != old_base:
+            for op in {id(op) : op for op in [*checked, *ips_ops] if op is not None}.values():
+                op.loc = move_loc(op.loc, old_base, base)
+            locs = [move_loc(loc, old_base, base) for loc in locs]
+        State.locs_to_include.extend(locs)
+        State.ops_by_ips[proc.block.start : proc.block.end + 1] = ips_ops
+        proc.used_procs.update(used_procs)
+        return checked
+
+    def store(self, key: str, proc: Proc, checked: List[Op], first_loc_id: int, locs: List[int]):
+        """
+        Stores the type checked operations of the procedure `proc` with the `key`.
+        The `first_loc_id` is the id of the first of the `locs` added by type checking it.
+        """
+        file = io.BytesIO()
+        try:
+            ReferencePickler(file, self.ids).dump((
+                checked, State.ops_by_ips[proc.block.start : proc.block.end + 1],
+                proc.used_procs, first_loc_id, locs, proc_loc(proc),
+            ))
+        except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+            return
+        self.entries[key] = file.getvalue()
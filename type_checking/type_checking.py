@@ -1,16 +1,20 @@
-from typing import List, Dict, Union, Iterable
+from contextlib import nullcontext
+from typing import List, Dict, Optional, Union
 
 from parsing.op import *
 from state import *
 from .types import type_to_str
 from .types import *
+from .type_stack import TypeStack
+from .parallel import ParallelTypeChecker
+from .proc_cache import ProcCache
 
 assert len(Operator) == 20, "Unimplemented operator in type_checking.py"
 assert len(OpType) == 40, "Unimplemented type in type_checking.py"
 assert len(BlockType) == 6, "Unimplemented block type in type_checking.py"
 
 
-def check_stack(stack: List[Type], expected: List[Type], arg=0):
+def check_stack(stack: TypeStack, expected: List[Type], arg=0):
     """
     Checks whether the types at the top of the `stack` match those
     in `expected`. If they are not throws an appropriate error.
@@ -37,7 +41,7 @@ def check_stack(stack: List[Type], expected: List[Type], arg=0):
 
 
 def check_route_stack(
-    stack1: List[Type], stack2: List[Type], can_collapse_stack: bool = True,
+    stack1: TypeStack, stack2: Union[TypeStack, List[Type]], can_collapse_stack: bool = True,
     error: str = "in different routes of if-end"
 ):
     """
@@ -48,6 +52,9 @@ def check_route_stack(
     will be on the stack after the branches' control flow joins. Otherwise a simple
     equals check will be performed for every type.
 
+    If `stack2` is a copy of an earlier state of `stack1`, the types below the part
+    of the stack changed since then are shared and aren't checked.
+
     The error indicates the type of routes, which will be used for error messages.
     """
     if len(stack1) > len(stack2):
@@ -62,37 +69,44 @@ def check_route_stack(
             f"\033[1;34mTypes\033[0m: {', '.join(type_to_str(i) for i in stack2[len(stack1)-len(stack2):])}\n"
         )
         exit(1)
-    for i in range(len(stack1)):
+    changed = stack1.diverged(stack2) if isinstance(stack2, TypeStack) else len(stack1)
+    types1 = stack1.top_types(changed)
+    types2 = stack2[len(stack2) - changed:]
+    for i in range(changed):
         if can_collapse_stack:
-            typ, is_succ = down_cast(stack1[i], stack2[i])
+            typ, is_succ = down_cast(types1[i], types2[i])
             if not is_succ:
                 State.throw_error(f"different types {error}", False)
                 sys.stderr.write(
-                    f"\033[1;34mElement {len(stack1)-i}\033[0m: {type_to_str(stack1[i])} instead of {type_to_str(stack2[i])}\n"
+                    f"\033[1;34mElement {changed-i}\033[0m: {type_to_str(types1[i])} instead of {type_to_str(types2[i])}\n"
                 )
                 exit(1)
-            stack1[i] = typ
+            types1[i] = typ
         else:
-            if stack1[i] != stack2[i] and stack1[i] is not None and stack2[i] is not None:
+            if types1[i] != types2[i] and types1[i] is not None and types2[i] is not None:
                 State.throw_error(f"different types {error}", False)
                 sys.stderr.write(
-                    f"\033[1;34mElement {len(stack1)-i}\033[0m: {type_to_str(stack1[i])} instead of {type_to_str(stack2[i])}\n"
+                    f"\033[1;34mElement {changed-i}\033[0m: {type_to_str(types1[i])} instead of {type_to_str(types2[i])}\n"
                 )
                 exit(1)
+    if can_collapse_stack:
+        stack1.drop(changed)
+        stack1.extend(types1)
 
 
-def type_check(ops: List[Op], is_main: bool = False) -> list:
+def type_check(ops: List[Op], is_main: bool = False) -> TypeStack:
     """
     Type checks the list of operations `op`. Returns the stack at the end of execution.
     Might modify the operations list because of desugaring or adding new information,
-    which can only be added if the types are known. 
+    which can only be added if the types are known. The type checked operations are
+    collected into new lists and replace the contents of `ops` in the end.
 
     The function should be called with is_main set to True only one time per compilation.
     """
-    stack: list = []
+    stack = TypeStack()
 
     if is_main and State.config.struct_malloc[1]:
-        State.loc = ""
+        State.loc = NO_LOC
         if "malloc" not in State.procs:
             assert not State.config.struct_malloc[0],\
                 "Malloc procedure not found while struct_malloc is enabled"
@@ -111,23 +125,47 @@ def type_check(ops: List[Op], is_main: bool = False) -> list:
             State.add_proc_use(proc)
 
     if is_main and len(State.runtimed_types_list):
-        State.loc = ""
+        State.loc = NO_LOC
         for struct in State.TYPE_STRUCTS:
             assert struct in State.structures,\
                 f"If types in runtime are used type.cn must be included from std. Structure {struct} not found."
 
-    index = 0
-    while index < len(ops):
-        op = ops[index]
-        new_op = type_check_op(op, stack)
-        if isinstance(new_op, Iterable):
-            ops[index : index + 1] = new_op
-            index += len(new_op) - 1
-        elif new_op is not None:
-            ops[index] = new_op
-
-        index += 1
-
+    is_lazy = is_main and State.config.o_LTC and State.config.o_UPR
+    # The type checked operations split into chunks, every deferred procedure
+    # and every procedure type checked in parallel has its own chunk
+    chunks: List[List[Op]] = [[]]
+    deferred_procs: Dict[Proc, List[Op]] = {}
+
+    proc_cache = ProcCache.create() if is_main else None
+    parallel = ParallelTypeChecker.create(ops, type_check_into) if is_main else None
+    with parallel.errors_in_order() if parallel is not None else nullcontext():
+        index = 0
+        while index < len(ops):
+            op = ops[index]
+            if is_lazy and op.type == OpType.DEFPROC and op.compiled and State.is_included_loc(op.loc):
+                end = find_endproc(ops, index)
+                deferred_procs[op.operand] = ops[index:end + 1]
+                chunks.extend((deferred_procs[op.operand], []))
+                index = end + 1
+                continue
+            if op.type == OpType.DEFPROC and op.compiled and (parallel is not None or proc_cache is not None):
+                end = find_endproc(ops, index)
+                chunk = type_check_proc(ops, index, end, stack, parallel, proc_cache)
+                if chunk is not None:
+                    chunks.extend((chunk, []))
+                    index = end + 1
+                    continue
+            type_check_into(op, stack, chunks[-1])
+            index += 1
+
+    if parallel is not None:
+        parallel.finish(chunks, proc_cache)
+    if proc_cache is not None:
+        proc_cache.save()
+    if deferred_procs:
+        type_check_deferred_procs(deferred_procs)
+
+    ops[:] = chunks[0] if len(chunks) == 1 else [op for chunk in chunks for op in chunk]
     if is_main:
         ops.extend([Op(OpType.OPERATOR, Operator.DROP) 
             for _ in range(len(stack))])
@@ -135,7 +173,98 @@ def type_check(ops: List[Op], is_main: bool = False) -> list:
     return stack
 
 
-def process_for_in(op: Op, stack: List[Type], iter_stack: list) -> list:
+def find_endproc(ops: List[Op], index: int) -> int:
+    """Returns the index of the ENDPROC operation of the procedure defined at the `index`"""
+    while ops[index].type != OpType.ENDPROC:
+        index += 1
+    return index
+
+
+def has_own_ips(ops: List[Op], start: int, end: int) -> bool:
+    """
+    Returns whether the ips of the procedure with operations from `start` to `end`
+    only have its own operations, so the procedure can be type checked on its own.
+    """
+    block = ops[start].operand.block
+    ids = {id(op) for op in ops[start : end + 1]}
+    return all(op is None or id(op) in ids for op in State.ops_by_ips[block.start : block.end + 1])
+
+
+def type_check_proc(
+    ops: List[Op], start: int, end: int, stack: TypeStack,
+    parallel: Optional[ParallelTypeChecker], proc_cache: Optional[ProcCache]
+) -> Optional[List[Op]]:
+    """
+    Type checks the procedure with operations from `start` to `end` using
+    the cache of type checked procedures and the workers if they are enabled.
+
+    Returns the list with the type checked operations of the procedure, which
+    is filled later if the procedure was sent to the workers, or None if
+    the procedure must be type checked together with the rest of the program.
+    """
+    if not has_own_ips(ops, start, end):
+        return None
+    proc = ops[start].operand
+    key = proc_cache.key(ops, start, end) if proc_cache is not None else None
+    if key is not None:
+        checked = proc_cache.load(key, proc)
+        if checked is not None:
+            return checked
+    if parallel is not None:
+        return parallel.submit(start, end, key)
+    if key is None:
+        return None
+
+    checked = []
+    first_loc_id = len(State.locs_to_include)
+    for op in ops[start : end + 1]:
+        type_check_into(op, stack, checked)
+    proc_cache.store(key, proc, checked, first_loc_id, State.locs_to_include[first_loc_id:])
+    return checked
+
+
+def type_check_into(op: Op, stack: TypeStack, checked: List[Op]):
+    """
+    Type checks the operation `op` and appends the operations,
+    that replace it according to `type_check_op`, to `checked`.
+    """
+    new_op = type_check_op(op, stack)
+    if new_op is None:
+        checked.append(op)
+    elif isinstance(new_op, Op):
+        checked.append(new_op)
+    else:
+        checked.extend(new_op)
+
+
+def type_check_deferred_procs(deferred_procs: Dict[Proc, List[Op]]):
+    """
+    Type checks the procedures from the included files, which were skipped
+    because of the lazy type checking(o_LTC), but are used by the program.
+    Type checking a procedure can add new uses e. g. of methods, so this
+    is repeated until no more deferred procedures become used.
+
+    `deferred_procs` maps the skipped procedures to the lists of their operations,
+    which are replaced with the type checked operations. The procedures
+    will be removed from it once they are type checked.
+    """
+    while True:
+        State.compute_used_procs()
+        used = [proc for proc in deferred_procs if proc in State.used_procs]
+        if not used:
+            return
+
+        # Starting from the end of the program as the procedures were checked before
+        for proc in reversed(used):
+            proc_ops = deferred_procs.pop(proc)
+            stack = TypeStack()
+            checked: List[Op] = []
+            for op in proc_ops:
+                type_check_into(op, stack, checked)
+            proc_ops[:] = checked
+
+
+def process_for_in(op: Op, stack: TypeStack, iter_stack: TypeStack) -> list:
     """
     Type checks and desugars the FOR operation with type of in.
     Returns the result of desugaring as a list of operations.
@@ -167,7 +296,7 @@ def process_for_in(op: Op, stack: List[Type], iter_stack: list) -> list:
     ]
 
 
-def process_for_until(op: Op, stack: List[Type], iter_stack: list) -> list:
+def process_for_until(op: Op, stack: TypeStack, iter_stack: TypeStack) -> list:
     """
     Type checks and desugars the FOR operation with type of until.
     Returns the result of desugaring as a list of operations.
@@ -223,7 +352,9 @@ def get_var_type_values(types: List[Type], stack: List[Type]) -> Dict[int, Type]
     var_types: Dict[int, Type] = {}
     assert len(stack) >= len(types), "Not enough elements on the stack"
     for typ, actual in zip(types, stack):
-        var_types = {**match_type_var(typ, actual), **var_types}
+        for var_id, value in match_type_var(typ, actual).items():
+            # The first value found for a type variable is used
+            var_types.setdefault(var_id, value)
     return var_types
 
 
@@ -244,24 +375,66 @@ def get_concrete_type(typ: Type, var_types: Dict[int, Type]) -> Type:
     return typ
 
 
-def process_call(op: Op, stack: List[Type]) -> None:
+def has_type_vars(typ: Optional[Type]) -> bool:
+    """Returns whether the type must be made concrete with `get_concrete_type`"""
+    if isinstance(typ, VarType):
+        return True
+    if isinstance(typ, (Ptr, Array)):
+        return has_type_vars(typ.typ)
+    return False
+
+
+class CallSignature:
+    """
+    The contract of a procedure prepared for type checking the calls to it.
+
+    The contract of a generic procedure is made concrete once for every combination of
+    argument types and reused for the next calls with the same types. The types are
+    interned, so the combinations are compared by the identities of the types.
+    """
+    def __init__(self, proc: Proc):
+        self.in_types: List[Type] = proc.in_stack
+        self.out_types: List[Type] = proc.out_stack
+        self.is_generic: bool = any(has_type_vars(typ) for typ in (*proc.in_stack, *proc.out_stack))
+        # Maps the ids of the argument types to the argument types and the concrete in and out types.
+        # The argument types are stored to keep them alive, so their ids aren't reused.
+        self.instances: Dict[Tuple[int, ...], Tuple[List[Type], List[Type], List[Type]]] = {}
+
+    def instantiate(self, stack: TypeStack) -> Tuple[List[Type], List[Type]]:
+        """Returns the concrete in and out types of the procedure called with the `stack`"""
+        if not self.is_generic:
+            return self.in_types, self.out_types
+
+        args = stack.top_types(len(self.in_types))
+        key = tuple(map(id, args))
+        instance = self.instances.get(key)
+        if instance is None:
+            var_types = get_var_type_values(self.in_types, args)
+            instance = (
+                args,
+                [get_concrete_type(typ, var_types) for typ in self.in_types],
+                [get_concrete_type(typ, var_types) for typ in self.out_types],
+            )
+            self.instances[key] = instance
+        return instance[1], instance[2]
+
+
+def process_call(op: Op, stack: TypeStack) -> None:
     """
     Type checks an operation with the CALL type.
     """
-    in_types: List[object] = []
-    out_types: List[object] = []
-    var_types = get_var_type_values(
-        op.operand.in_stack, stack[-len(op.operand.in_stack):]
-    )
-    for typ in op.operand.in_stack:
-        in_types.append(get_concrete_type(typ, var_types))
-    for typ in op.operand.out_stack:
-        out_types.append(get_concrete_type(typ, var_types))
-    check_stack(stack, in_types)
+    proc = op.operand
+    signature = State.call_signatures.get(proc)
+    if signature is None:
+        signature = State.call_signatures[proc] = CallSignature(proc)
+
+    assert len(stack) >= len(proc.in_stack), "Not enough elements on the stack"
+    in_types, out_types = signature.instantiate(stack)
+    check_stack(stack, in_types.copy())
     stack.extend(out_types)
 
 
-def type_check_op(op: Op, stack: List[Type]) -> Optional[Union[Op, List[Op]]]:
+def type_check_op(op: Op, stack: TypeStack) -> Optional[Union[Op, List[Op]]]:
     """
     Type checks the operation `op` and modifies the stack appropriately.
 
@@ -347,8 +520,7 @@ def type_check_op(op: Op, stack: List[Type]) -> Optional[Union[Op, List[Op]]]:
         original_stack = State.route_stack.pop()[1]
         op.operand.stack_effect = (len(original_stack), len(stack))
         State.route_stack.append(("if-else", stack.copy()))
-        stack.clear()
-        stack.extend(original_stack)
+        stack.assign(original_stack)
     elif op.type == OpType.ENDIF:
         route_stack = State.route_stack.pop()
         if route_stack[0] == "if-end":
@@ -381,6 +553,8 @@ def type_check_op(op: Op, stack: List[Type]) -> Optional[Union[Op, List[Op]]]:
                 return []
             pre_for_stack = State.route_stack.pop()[1]
             check_route_stack(stack, pre_for_stack, "in different routes of for")
+            # The index is on the stack during the loop
+            op.operand[0].stack_effect = (len(pre_for_stack) + 1, len(pre_for_stack) + 1)
             end_while = Op(OpType.ENDWHILE, op.operand[0], loc=op.loc)
             State.ops_by_ips[op.operand[0].end] = end_while
             return [
@@ -397,6 +571,8 @@ def type_check_op(op: Op, stack: List[Type]) -> Optional[Union[Op, List[Op]]]:
         elif op.operand[1] == "until":
             pre_for_stack = State.route_stack.pop()[1]
             check_route_stack(stack, pre_for_stack, "in different routes of for")
+            # The pointer and the character are on the stack during the loop
+            op.operand[0].stack_effect = (len(pre_for_stack) + 2, len(pre_for_stack) + 2)
 
             if State.config.re_NPD:
                 State.locs_to_include.append(op.loc)
@@ -418,11 +594,13 @@ def type_check_op(op: Op, stack: List[Type]) -> Optional[Union[Op, List[Op]]]:
                 Op(OpType.OPERATOR, Operator.NE, loc=op.loc),
                 Op(OpType.UNBIND, 2, loc=op.loc),
                 end_while,
+                Op(OpType.OPERATOR, Operator.DROP, loc=op.loc),
+                Op(OpType.OPERATOR, Operator.DROP, loc=op.loc),
             ]
     elif op.type == OpType.BIND:
         assert len(stack) >= op.operand, "stack is too short for bind"
-        State.bind_stack.extend(stack[-op.operand:])
-        stack[-op.operand:] = []
+        State.bind_stack.extend(stack.top_types(op.operand))
+        stack.drop(op.operand)
     elif op.type == OpType.UNBIND:
         for _ in range(op.operand):
             State.bind_stack.pop()
@@ -447,8 +625,7 @@ def type_check_op(op: Op, stack: List[Type]) -> Optional[Union[Op, List[Op]]]:
             stack, State.get_proc_by_block(op.operand).out_stack,
             can_collapse_stack=False, error="in procedure definition",
         )
-        stack.clear()
-        stack.extend(State.route_stack.pop()[1])
+        stack.assign(State.route_stack.pop()[1])
         State.current_proc = None
     elif op.type == OpType.CALL:
         process_call(op, stack)
@@ -572,7 +749,7 @@ def type_check_op(op: Op, stack: List[Type]) -> Optional[Union[Op, List[Op]]]:
     return None
 
 
-def type_check_operator(op: Op, stack: List[Type]) -> Optional[Union[Op, List[Op]]]:
+def type_check_operator(op: Op, stack: TypeStack) -> Optional[Union[Op, List[Op]]]:
     """
     Type checks the operation of type OPERATOR `op` and modifies the stack appropriately.
 
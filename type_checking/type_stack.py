@@ -0,0 +1,134 @@
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+# A node of the stack is a tuple of the type and the node below it, None is the bottom of the stack
+Node = Optional[Tuple[Any, Any]]
+
+
+class TypeStack:
+    """
+    The stack of types used by the type checker. Supports the operations
+    of a list the type checker needs, but is persistent: the nodes are never changed,
+    so copies share them and copying is O(1). Changing a copy only creates
+    new nodes for the changed part of the stack, all the nodes below it stay shared.
+
+    The copies are made for the routes of the control flow, so when two routes are compared
+    only the types above the nodes shared by both routes need to be checked.
+    """
+    __slots__ = ("top", "size")
+
+    def __init__(self, types: Iterable[Any] = ()):
+        self.top: Node = None
+        self.size: int = 0
+        self.extend(types)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.top_types(self.size))
+
+    def __repr__(self) -> str:
+        return f"TypeStack({list(self)})"
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, TypeStack):
+            return self.size == other.size and list(self) == list(other)
+        return list(self) == other
+
+    def node_at(self, index: int) -> Node:
+        """Returns the node with the type at the `index` counting from the top, which is 0"""
+        node = self.top
+        for _ in range(index):
+            node = node[1]
+        return node
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            if stop == self.size and step == 1:
+                return self.top_types(max(self.size - start, 0))
+            return list(self)[index]
+
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("type stack index out of range")
+        return self.node_at(self.size - 1 - index)[0]
+
+    def __setitem__(self, index: int, typ: Any):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("type stack index out of range")
+        # The nodes above the changed one are recreated, so the copies don't see the change
+        above = self.size - 1 - index
+        types = self.top_types(above)
+        node = self.node_at(above)
+        self.top = (typ, node[1])
+        for above_typ in types:
+            self.top = (above_typ, self.top)
+
+    def top_types(self, count: int) -> List[Any]:
+        """Returns a list of `count` types from the top of the stack, the topmost type is the last"""
+        assert count <= self.size, "stack is too short"
+        types = []
+        node = self.top
+        for _ in range(count):
+            types.append(node[0])
+            node = node[1]
+        types.reverse()
+        return types
+
+    def append(self, typ: Any):
+        self.top = (typ, self.top)
+        self.size += 1
+
+    def extend(self, types: Iterable[Any]):
+        top = self.top
+        size = self.size
+        for typ in types:
+            top = (typ, top)
+            size += 1
+        self.top = top
+        self.size = size
+
+    def pop(self) -> Any:
+        if self.top is None:
+            raise IndexError("pop from empty type stack")
+        typ, self.top = self.top
+        self.size -= 1
+        return typ
+
+    def drop(self, count: int):
+        """Removes `count` types from the top of the stack"""
+        assert count <= self.size, "stack is too short"
+        self.top = self.node_at(count)
+        self.size -= count
+
+    def clear(self):
+        self.top = None
+        self.size = 0
+
+    def copy(self) -> "TypeStack":
+        copy = TypeStack.__new__(TypeStack)
+        copy.top = self.top
+        copy.size = self.size
+        return copy
+
+    def assign(self, other: "TypeStack"):
+        """Makes the stack the same as the `other`, which takes O(1)"""
+        self.top = other.top
+        self.size = other.size
+
+    def diverged(self, other: "TypeStack") -> int:
+        """
+        Returns the number of types from the top, after which the stack and the `other`
+        stack of the same size share all the nodes. Only these types can be different.
+        """
+        assert self.size == other.size, "stacks of different sizes never share the bottom"
+        node1, node2 = self.top, other.top
+        count = 0
+        while node1 is not node2:
+            node1, node2 = node1[1], node2[1]
+            count += 1
+        return count
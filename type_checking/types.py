@@ -1,13 +1,54 @@
-from abc import ABC, abstractmethod
-from typing import List, Tuple, Dict, Optional
+from abc import ABCMeta, abstractmethod
+from typing import Any, List, Tuple, Dict, Optional
 
 from state import State, Proc, cont_assert
 
 
-class Type(ABC):
+class TypeMeta(ABCMeta):
+    """
+    The metaclass of cont types, which interns the instances of the classes with an `interned` dictionary.
+    Creating a type structurally identical to an existing one returns the existing object,
+    so such types can be compared by identity and their hashes are computed only once.
+    """
+    def __call__(cls, *args, **kwargs):
+        if cls.interned is None:
+            return super().__call__(*args, **kwargs)
+        key = cls.intern_key(*args, **kwargs)
+        typ = cls.interned.get(key)
+        if typ is None:
+            typ = cls.interned[key] = super().__call__(*args, **kwargs)
+        return typ
+
+
+class Type(metaclass=TypeMeta):
     """An abstract class for all cont types"""
+    # Maps the keys returned by `intern_key` to the types, None if the type isn't interned
+    interned: Optional[Dict[Tuple[Any, ...], "Type"]] = None
+    # Whether the type doesn't contain any types, which are equal to other types e. g. ptr or structures.
+    # Two different exact types are never equal, since all the exact types are interned.
+    is_exact: bool = False
+    _hash: Optional[int] = None
+
     def __hash__(self) -> int:
-        return hash(self.text_repr())
+        if self._hash is None:
+            self._hash = hash(self.text_repr())
+        return self._hash
+
+    def __reduce__(self):
+        # Unpickled types must be interned as well
+        return (self.__class__, self.intern_args()) if self.interned is not None else super().__reduce__()
+
+    @staticmethod
+    def intern_key(*args, **kwargs) -> Tuple[Any, ...]:
+        """
+        Returns a key, which identifies the type created with the same arguments.
+        The types inside the type are already interned, so their identities are used.
+        """
+        return ()
+
+    def intern_args(self) -> Tuple[Any, ...]:
+        """Returns the arguments, which create this type"""
+        return ()
 
     @abstractmethod
     def __eq__(self, other) -> bool: ...
@@ -16,25 +57,44 @@ class Type(ABC):
     def text_repr(self) -> str: ...
 
 
+def clear_interned_types():
+    """Forgets all the interned types, must be called when the state of the compiler is reset"""
+    for cls in (Ptr, Array, Int, Addr):
+        cls.interned.clear()
+
+
 class Ptr(Type):
     """
     A cont pointer type, where `typ` is the type the pointer to pointing to
     or None if the pointer is `ptr`.
     """
+    interned: Dict[Tuple[Any, ...], "Ptr"] = {}
+
     def __init__(self, typ: Optional[Type] = None):
         self.typ = typ
+        self.is_exact = typ is not None and typ.is_exact
+
+    @staticmethod
+    def intern_key(typ: Optional[Type] = None) -> Tuple[Any, ...]:
+        return (id(typ),)
+
+    def intern_args(self) -> Tuple[Any, ...]:
+        return (self.typ,)
 
     def __eq__(self, other) -> bool:
+        if self is other:
+            return True
         if isinstance(other, Ptr):
+            if self.is_exact and other.is_exact:
+                return False
             return self.typ == other.typ or other.typ is None or self.typ is None
         
         return False
 
     def text_repr(self) -> str:
         return f"ptr{'_' + self.typ.text_repr() if self.typ is not None else ''}"
-    
-    def __hash__(self) -> int:
-        return hash(self.text_repr())
+
+    __hash__ = Type.__hash__
 
 
 class Array(Type):
@@ -49,12 +109,26 @@ class Array(Type):
     with types. If `typ` is None, that means an array with any type of element.
     And if `len` is -1 it means an array with any length.
     """
+    interned: Dict[Tuple[Any, ...], "Array"] = {}
+
     def __init__(self, len: int = -1, typ: Optional[Type] = None):
         self.len = len
         self.typ = typ
+        self.is_exact = len != -1 and typ is not None and typ.is_exact
+
+    @staticmethod
+    def intern_key(len: int = -1, typ: Optional[Type] = None) -> Tuple[Any, ...]:
+        return (len, id(typ))
+
+    def intern_args(self) -> Tuple[Any, ...]:
+        return (self.len, self.typ)
 
     def __eq__(self, other) -> bool:
+        if self is other:
+            return True
         if isinstance(other, Array):
+            if self.is_exact and other.is_exact:
+                return False
             return (
                 (
                     self.typ == other.typ and\
@@ -70,20 +144,21 @@ class Array(Type):
             "Can't get text representation of an internal array")
         return f"arr_{self.typ.text_repr()}_{self.len}"
 
-    def __hash__(self) -> int:
-        return hash(self.text_repr())
+    __hash__ = Type.__hash__
 
 
 class Int(Type):
     """A cont integer type"""
+    interned: Dict[Tuple[Any, ...], "Int"] = {}
+    is_exact = True
+
     def __eq__(self, other) -> bool:
-        return isinstance(other, Int) or other is None
+        return self is other or isinstance(other, Int) or other is None
 
     def text_repr(self) -> str:
         return f"int"
 
-    def __hash__(self) -> int:
-        return hash(self.text_repr())
+    __hash__ = Type.__hash__
 
 
 class Addr(Type):
@@ -91,13 +166,26 @@ class Addr(Type):
     A cont address type, denotes a function pointer. Has `in_types` and
     `out_types` which must match for addrs to be equal.
     """
+    interned: Dict[Tuple[Any, ...], "Addr"] = {}
+
     def __init__(self, in_types: List[Type], out_types: List[Type]):
-        self.in_types = in_types
-        self.out_types = out_types
+        # Copied, since the lists of a procedure's contract may be changed after the type is interned
+        self.in_types = list(in_types)
+        self.out_types = list(out_types)
+        self.is_exact = all(i is not None and i.is_exact for i in (*in_types, *out_types))
+
+    @staticmethod
+    def intern_key(in_types: List[Type], out_types: List[Type]) -> Tuple[Any, ...]:
+        return (tuple(map(id, in_types)), tuple(map(id, out_types)))
+
+    def intern_args(self) -> Tuple[Any, ...]:
+        return (self.in_types, self.out_types)
 
     def __eq__(self, other) -> bool:
+        if self is other: return True
         if other is None: return True
         if not isinstance(other, Addr): return False
+        if self.is_exact and other.is_exact: return False
         return self.in_types == other.in_types and self.out_types == other.out_types
 
     def text_repr(self) -> str:
@@ -105,8 +193,7 @@ class Addr(Type):
         out_types = '__'.join([i.text_repr() for i in self.out_types])
         return f"addr_{len(self.in_types)}_{len(self.out_types)}__{in_types}___{out_types}"
 
-    def __hash__(self) -> int:
-        return hash(self.text_repr())
+    __hash__ = Type.__hash__
 
 
 class VarType(Type):
@@ -172,7 +259,8 @@ class Struct(Type):
         return False
 
     def text_repr(self) -> str:
-        return f"struct_{id(self)}"
+        # The names are unique, the characters, which can't be in labels, are replaced with their codes
+        return "struct_" + "".join(char if char.isalnum() else f"_{ord(char):06x}" for char in self.name)
 
     def __hash__(self) -> int:
         return hash(self.text_repr())
@@ -206,7 +294,7 @@ def type_to_str(_type: Type) -> str:
 
 
 def parse_type(
-    token: Tuple[str, str],
+    token: Tuple[str, int],
     error: str,
     auto_ptr: bool = True,
     allow_unpack: bool = False,
@@ -316,9 +404,8 @@ def parse_type(
     elif name == "":
         State.throw_error(f"Expected token, but end was reached in {error}")
     else:
-        if name in State.var_types():
-            result = State.var_types()[name]
-        else:
+        result = State.find_var_type(name)
+        if result is None:
             if var_type_scope is not None:
                 result = var_type = VarType(name)
                 var_type_scope[name] = var_type